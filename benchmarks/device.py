@@ -0,0 +1,272 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Benchmarks the board transfers against a simulated device. For each link
+(a serial port at each baudrate and a WebREPL connection) it measures the
+query latency, upload and download throughput, the time to build the module
+index and the rate the Monitor's terminal renders output.
+
+Usage:
+
+    python benchmarks/device.py --baudrate 115200 --baudrate 921600 --websocket
+
+@author: jrm
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from twisted.internet import task
+from twisted.internet.defer import inlineCallbacks
+from micropyde.core.utils import async_sleep, log
+from micropyde.board.simulator import Simulator
+from micropyde.board.plugin import (
+    Board, BoardPlugin, QueryProtocol, SerialConnection, WebsocketConnection
+)
+
+#: Benchmarks that can be selected
+BENCHMARKS = ('query', 'upload', 'download', 'index', 'terminal')
+
+
+def result(value, unit, higher_is_better=True):
+    """ Format a result so it can be compared against a baseline. If
+    `higher_is_better` is None the result is only informational.
+
+    """
+    return {'value': round(value, 4), 'unit': unit,
+            'higher_is_better': higher_is_better}
+
+
+def generate_source(size):
+    """ Generate about `size` bytes of python source to upload """
+    line = b"print('The quick brown fox jumps over the lazy dog')  # 0123\n"
+    return (line * (size // len(line) + 1))[:size]
+
+
+class TerminalView(object):
+    """ Stands in for the MonitorDockItem so the TerminalProtocol can be
+    driven without the workbench. The console is an offscreen widget if
+    Qt is available.
+
+    """
+
+    def __init__(self, plugin, widget=None):
+        self.plugin = plugin
+        self.opened = False
+        self.console = self
+        self.proxy = self
+        self.widget = widget
+
+
+def load_terminal_protocol(render):
+    """ Import the TerminalProtocol from the enaml view (and create a
+    console widget to render into if requested).
+
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from enaml.qt.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    import enaml
+    with enaml.imports():
+        from micropyde.board.view import TerminalProtocol, PlainTextEdit
+    widget = None
+    if render:
+        widget = PlainTextEdit().create_widget(None)
+        widget._app = app
+    return TerminalProtocol, widget
+
+
+@inlineCallbacks
+def bench_query(plugin, count=20):
+    """ Mean round trip time of an expression in ms """
+    board = plugin.board
+    board.disconnect()
+    device = QueryProtocol(plugin)
+    yield board.connect(device)
+    yield device.query(b"\r\n")
+    start = time.perf_counter()
+    for i in range(count):
+        yield device.query("{}+1".format(i).encode())
+    duration = time.perf_counter() - start
+    board.disconnect()
+    return result(1000*duration/count, 'ms', False)
+
+
+@inlineCallbacks
+def bench_upload(plugin, source):
+    """ Upload throughput in KB/s """
+    start = time.perf_counter()
+    ok = yield plugin.upload('bench.py', source)
+    duration = time.perf_counter() - start
+    plugin.board.disconnect()
+    if not ok:
+        raise IOError("Upload failed")
+    return result(len(source)/1024.0/duration, 'KB/s')
+
+
+@inlineCallbacks
+def bench_download(plugin, source):
+    """ Download throughput in KB/s (of the file uploaded) """
+    start = time.perf_counter()
+    data = yield plugin.download('bench.py')
+    duration = time.perf_counter() - start
+    plugin.board.disconnect()
+    if data != source:
+        raise IOError("Downloaded data does not match")
+    return result(len(data)/1024.0/duration, 'KB/s')
+
+
+@inlineCallbacks
+def bench_index(plugin):
+    """ Time to build the module index in s """
+    start = time.perf_counter()
+    yield plugin.build_index(None)
+    duration = time.perf_counter() - start
+    plugin.board.disconnect()
+    if not plugin.modules:
+        raise IOError("No modules were indexed")
+    return result(duration, 's', False)
+
+
+@inlineCallbacks
+def bench_terminal(plugin, size, render):
+    """ Rate output from the device is shown in the Monitor in MB/s and
+    the number of console updates per second.
+
+    """
+    TerminalProtocol, widget = load_terminal_protocol(render)
+    view = TerminalView(plugin, widget)
+    protocol = TerminalProtocol(view)
+    flushes = []
+    protocol.listeners.append(flushes.append)
+    board = plugin.board
+    board.disconnect()
+    yield board.connect(protocol)
+    yield async_sleep(500)  #: Let the banner through
+
+    line = "x"*62
+    count = size // (len(line) + 2)
+    received = []
+    protocol.listeners.append(received.append)
+    del flushes[:]
+    start = time.perf_counter()
+    board.write("for i in range({}): print('{}')\r".format(
+        count, line).encode())
+    #: Wait for the output (and the echo of the command) then the prompt
+    while (sum(text.count('\n') for text in received) <= count or
+           not received[-1].endswith('>>> ')):
+        if time.perf_counter() - start > 120:
+            raise IOError("Timed out waiting for output")
+        yield async_sleep(10)
+    duration = time.perf_counter() - start
+    board.disconnect()
+    mb = count*(len(line) + 2)/1024.0/1024.0
+    return {
+        'throughput': result(mb/duration, 'MB/s'),
+        'renders': result(len(flushes)/duration, 'renders/s', None),
+    }
+
+
+@inlineCallbacks
+def run_link(name, plugin, benchmarks, size, render):
+    """ Run the selected benchmarks over the board's connection """
+    results = {}
+    source = generate_source(size)
+    if 'query' in benchmarks:
+        results['query.{}'.format(name)] = yield bench_query(plugin)
+    if 'upload' in benchmarks or 'download' in benchmarks:
+        value = yield bench_upload(plugin, source)
+        if 'upload' in benchmarks:
+            results['upload.{}'.format(name)] = value
+    if 'download' in benchmarks:
+        results['download.{}'.format(name)] = yield bench_download(
+            plugin, source)
+    if 'index' in benchmarks:
+        results['index.{}'.format(name)] = yield bench_index(plugin)
+    if 'terminal' in benchmarks:
+        values = yield bench_terminal(plugin, size*16, render)
+        for key, value in values.items():
+            results['terminal.{}.{}'.format(key, name)] = value
+    return results
+
+
+@inlineCallbacks
+def run(baudrates=(115200, 921600), websocket=True, benchmarks=BENCHMARKS,
+        size=4096, latency=0.002, backend='cpython', render=False):
+    """ Run the benchmarks against a new simulated device for each link.
+
+    Returns
+    -------
+        results: Deferred
+            Fires with a dict of results keyed by benchmark and link name
+
+    """
+    links = [('serial-{}'.format(b), b) for b in baudrates]
+    if websocket:
+        links.append(('websocket', 0))
+    results = {}
+    for name, baudrate in links:
+        root = tempfile.mkdtemp(prefix='micropyde-bench-')
+        simulator = Simulator(root, backend=backend, latency=latency,
+                              bandwidth=baudrate//10)
+        if baudrate:
+            connection = SerialConnection(port=simulator.open_pty(),
+                                          baudrate=baudrate)
+        else:
+            port = simulator.listen_webrepl(0)
+            connection = WebsocketConnection(address='127.0.0.1', port=port)
+        simulator.start()
+        board = Board(configured_connections=[connection],
+                      connection=connection, auto_reconnect=False)
+        plugin = BoardPlugin(board=board, capture_enabled=False)
+        try:
+            values = yield run_link(name, plugin, benchmarks, size, render)
+            results.update(values)
+        finally:
+            board.disconnect()
+            yield async_sleep(100)
+            simulator.stop()
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[3])
+    parser.add_argument('--baudrate', type=int, action='append',
+                        help="Simulated baudrate (can be repeated)")
+    parser.add_argument('--websocket', action='store_true',
+                        help="Also benchmark a WebREPL connection")
+    parser.add_argument('--only', action='append', choices=BENCHMARKS,
+                        help="Benchmarks to run (default all)")
+    parser.add_argument('--size', type=int, default=4096,
+                        help="Bytes to transfer")
+    parser.add_argument('--latency', type=float, default=2,
+                        help="Simulated link latency in ms")
+    parser.add_argument('--backend', default='cpython',
+                        choices=['auto', 'micropython', 'cpython'])
+    parser.add_argument('--render', action='store_true',
+                        help="Render the terminal into an offscreen console")
+    args = parser.parse_args()
+    log.setLevel(logging.WARNING)
+
+    def run_all(reactor):
+        d = run(args.baudrate or (115200, 921600), args.websocket,
+                args.only or BENCHMARKS, args.size, args.latency/1000.0,
+                args.backend, args.render)
+        return d.addCallback(lambda r: print(json.dumps(r, indent=2)))
+    task.react(run_all)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Runs the benchmark suite headless, writes the results as JSON and compares
+them to a stored baseline. Exits with a non-zero status if any result is
+worse than the baseline by more than the tolerance.
+
+Usage:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --save-baseline
+
+@author: jrm
+"""
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from twisted.internet import task
+from micropyde.core.utils import log
+
+import device
+import terminal
+
+#: Default location of the baseline
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+
+
+def run_terminal(size=1):
+    """ Run the terminal pipeline benchmark in the suite's format. The text
+    is rendered since decoding alone isn't what the buffering speeds up.
+
+    """
+    results = terminal.run(size=size, render=True)
+    return {'terminal.pipeline.{}'.format(name): device.result(rate, 'MB/s')
+            for name, rate in results.items()}
+
+
+def compare(results, baseline, tolerance):
+    """ Compare the results to the baseline.
+
+    Returns
+    -------
+        report: list
+            A (name, baseline, value, change, regressed) tuple for each
+            result that is in the baseline. The change is the relative
+            improvement (negative if it got worse).
+
+    """
+    report = []
+    for name, r in sorted(results.items()):
+        b = baseline.get(name)
+        if b is None or r['higher_is_better'] is None or not b['value']:
+            continue
+        change = (r['value'] - b['value'])/b['value']
+        if not r['higher_is_better']:
+            change = -change
+        report.append((name, b['value'], r['value'], change,
+                       change < -tolerance))
+    return report
+
+
+def print_report(report, results):
+    print("{:<36} {:>12} {:>12} {:>8}".format("Benchmark", "Baseline",
+                                              "Result", "Change"))
+    for name, base, value, change, regressed in report:
+        print("{:<36} {:>12.4g} {:>12.4g} {:>+7.1f}% {}".format(
+            name, base, value, 100*change, "REGRESSED" if regressed else "",
+        ).rstrip() + " " + results[name]['unit'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[3])
+    parser.add_argument('--output', help="Write the results to this file")
+    parser.add_argument('--baseline', default=BASELINE,
+                        help="Baseline to compare against")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Save the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="Allowed relative slowdown before failing")
+    parser.add_argument('--baudrate', type=int, action='append',
+                        help="Simulated baudrate (default 115200 and 921600)")
+    parser.add_argument('--no-websocket', action='store_true',
+                        help="Skip the WebREPL benchmarks")
+    parser.add_argument('--only', action='append', choices=device.BENCHMARKS,
+                        help="Device benchmarks to run (default all)")
+    parser.add_argument('--size', type=int, default=4096,
+                        help="Bytes to transfer")
+    parser.add_argument('--latency', type=float, default=2,
+                        help="Simulated link latency in ms")
+    parser.add_argument('--backend', default='cpython',
+                        choices=['auto', 'micropython', 'cpython'])
+    args = parser.parse_args()
+    log.setLevel(logging.WARNING)
+
+    def run_all(reactor):
+        d = device.run(args.baudrate or (115200, 921600),
+                       not args.no_websocket, args.only or device.BENCHMARKS,
+                       args.size, args.latency/1000.0, args.backend,
+                       render=True)
+        return d.addCallback(finish)
+
+    def finish(results):
+        results.update(run_terminal())
+        output = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'results': results,
+        }
+        text = json.dumps(output, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text)
+        else:
+            print(text)
+
+        if args.save_baseline:
+            with open(args.baseline, 'w') as f:
+                f.write(text)
+            print("Saved baseline to {}".format(args.baseline))
+            return
+
+        if not os.path.exists(args.baseline):
+            print("No baseline at {}, run with --save-baseline to create "
+                  "one".format(args.baseline))
+            return
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        report = compare(results, baseline, args.tolerance)
+        print_report(report, results)
+        if any(r[-1] for r in report):
+            raise SystemExit(1)
+
+    task.react(run_all)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Measures how long the IDE takes to start from a cold interpreter (with an
+empty config) until the window and dock area are shown. Exits with a
+non-zero status if the median is over the budget or a plugin or module that
+should be deferred was loaded.
+
+Usage:
+
+    python benchmarks/startup.py --budget 3
+
+@author: jrm
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: Modules that should only be imported once the feature is used
+DEFERRED_MODULES = ('esptool', 'pyocd', 'autobahn', 'serial')
+
+#: Plugins that should only start once their dock item, a command or
+#: settings page is first used
+DEFERRED_PLUGINS = ('micropyde.board', 'micropyde.console', 'micropyde.esp',
+                    'micropyde.firmware', 'micropyde.ocd')
+
+
+def child():
+    """ Start the app and report the timings once the dock area is shown """
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from micropyde.app import create_workbench
+    workbench = create_workbench()
+    registered = time.perf_counter()
+
+    from enaml.workbench.api import Extension, PluginManifest
+    from enaml.workbench.ui.api import Autostart
+    from enaml.workbench.plugin import Plugin
+
+    PROBE_ID = 'micropyde.benchmarks.startup'
+
+    class ProbePlugin(Plugin):
+        def start(self):
+            self.workbench.application.deferred_call(self.check)
+
+        def check(self):
+            ui = self.workbench.get_plugin('enaml.workbench.ui')
+            workspace = ui.workspace
+            if workspace is None or workspace.content is None or \
+                    not workspace.content.find('dock_area'):
+                self.workbench.application.timed_call(10, self.check)
+                return
+            ready = time.perf_counter()
+            print(json.dumps({
+                'import': registered - start,
+                'ready': ready - start,
+                'started': sorted(
+                    p for p in workbench._plugins
+                    if p.startswith('micropyde') and p != PROBE_ID),
+                'imported': sorted(m for m in DEFERRED_MODULES
+                                   if m in sys.modules),
+            }))
+            sys.stdout.flush()
+            ui.close_window()
+            ui.stop_application()
+
+    manifest = PluginManifest(id=PROBE_ID,
+                              factory=ProbePlugin)
+    extension = Extension(id='autostart', rank=100,
+                          point='enaml.workbench.ui.autostart')
+    extension.insert_children(None, [Autostart(plugin_id=manifest.id)])
+    manifest.insert_children(None, [extension])
+    workbench.register(manifest)
+    workbench.run()
+
+
+def run(runs=5):
+    """ Start the app in a new interpreter `runs` times.
+
+    Returns
+    -------
+        results: list
+            The timings reported by each run
+
+    """
+    results = []
+    for i in range(runs):
+        home = tempfile.mkdtemp(prefix='micropyde-startup-')
+        try:
+            env = dict(os.environ, HOME=home, QT_QPA_PLATFORM='offscreen')
+            out = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), '--child'],
+                env=env, cwd=home, stderr=subprocess.DEVNULL, timeout=120)
+        finally:
+            shutil.rmtree(home, ignore_errors=True)
+        for line in out.decode().splitlines():
+            if line.startswith('{'):
+                results.append(json.loads(line))
+                break
+        else:
+            raise RuntimeError("Startup did not report its timings")
+    return results
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values)//2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[3])
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--runs', type=int, default=5,
+                        help="Number of cold starts to measure")
+    parser.add_argument('--budget', type=float, default=3.0,
+                        help="Max median time until the window is ready (s)")
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    results = run(args.runs)
+    ready = median([r['ready'] for r in results])
+    imported = median([r['import'] for r in results])
+    last = results[-1]
+    print("Import and register: {:.3f}s".format(imported))
+    print("Window ready:        {:.3f}s (budget {:.3f}s)".format(
+        ready, args.budget))
+    print("Plugins started:     {}".format(", ".join(last['started'])))
+    print("Deferred modules imported: {}".format(
+        ", ".join(last['imported']) or "none"))
+    failed = False
+    if ready > args.budget:
+        print("Startup is over budget!")
+        failed = True
+    started = sorted({p for r in results for p in r['started']
+                      if p in DEFERRED_PLUGINS})
+    if started:
+        print("Plugins started too early: {}".format(", ".join(started)))
+        failed = True
+    imported = sorted({m for r in results for m in r['imported']})
+    if imported:
+        print("Modules imported too early: {}".format(", ".join(imported)))
+        failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Throughput benchmark for the Monitor's terminal pipeline. Feeds generated
+REPL output through the buffered pipeline (flushed once per frame) and the
+previous decode and insert per packet approach and reports MB/s for each.
+
+Usage:
+
+    python benchmarks/terminal.py --size 8 --chunk 64 --render
+
+@author: jrm
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from micropyde.board.terminal import TerminalBuffer, tail_lines
+
+
+def generate(size):
+    """ Generate about `size` bytes of chatty firmware output containing
+    colored log lines and line editing escape sequences.
+
+    """
+    lines = [
+        b'\x1b[0;32mI (1234) wifi: connected to ap, rssi: -42\x1b[0m\r\n',
+        b'accel: x=0.012 y=-0.981 z=0.034 t=25.3\r\n',
+        b'>>> \x1b[K\x08\x08print("hello")\r\nhello\r\n',
+        'temp: 21.5°C humidity: 40%\r\n'.encode(),
+    ]
+    block = b''.join(lines)
+    return block * (size // len(block) + 1)
+
+
+def create_widget():
+    """ Create an offscreen QPlainTextEdit configured like the Monitor's
+    console, or None if Qt is unavailable.
+
+    """
+    try:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from enaml.qt.QtWidgets import QApplication, QPlainTextEdit
+    except ImportError:
+        return None
+    app = QApplication.instance() or QApplication([])
+    widget = QPlainTextEdit()
+    widget.setReadOnly(True)
+    widget.setMaximumBlockCount(1000)
+    widget._app = app
+    return widget
+
+
+def insert(widget, text):
+    from enaml.qt.QtGui import QTextCursor
+    widget.moveCursor(QTextCursor.End)
+    widget.insertPlainText(text)
+    widget.moveCursor(QTextCursor.End)
+
+
+def run_buffered(data, chunk, baudrate, fps=30, widget=None):
+    """ Feed the data through the TerminalBuffer flushing once per frame
+    worth of data at the given baudrate.
+
+    """
+    frame_size = max(chunk, baudrate // 10 // fps)
+    buf = TerminalBuffer()
+    received = 0
+    start = time.perf_counter()
+    for i in range(0, len(data), chunk):
+        buf.feed(data[i:i+chunk])
+        received += chunk
+        if received >= frame_size:
+            received = 0
+            text = buf.flush()
+            if widget is not None:
+                insert(widget, tail_lines(text, 1000))
+    text = buf.flush()
+    if widget is not None:
+        insert(widget, tail_lines(text, 1000))
+    return time.perf_counter() - start
+
+
+def run_unbuffered(data, chunk, widget=None):
+    """ Decode and insert every packet as it's received """
+    start = time.perf_counter()
+    for i in range(0, len(data), chunk):
+        text = data[i:i+chunk].decode('utf-8', 'replace')
+        if widget is not None:
+            insert(widget, text)
+    return time.perf_counter() - start
+
+
+def run(size=4, chunk=64, baudrate=921600, render=False):
+    """ Run the benchmark and return the results in MB/s """
+    data = generate(size*1024*1024)
+    mb = len(data)/1024.0/1024.0
+    results = {}
+    widget = create_widget() if render else None
+    results['buffered'] = mb/run_buffered(data, chunk, baudrate,
+                                          widget=widget)
+    results['unbuffered'] = mb/run_unbuffered(data, chunk, widget=widget)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[3])
+    parser.add_argument('--size', type=int, default=4,
+                        help="Megabytes of data to feed")
+    parser.add_argument('--chunk', type=int, default=64,
+                        help="Bytes per packet received")
+    parser.add_argument('--baudrate', type=int, default=921600)
+    parser.add_argument('--render', action='store_true',
+                        help="Also insert the text into a QPlainTextEdit")
+    args = parser.parse_args()
+    results = run(args.size, args.chunk, args.baudrate, args.render)
+    for name, rate in results.items():
+        print("{:<12} {:>10.2f} MB/s".format(name, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,11 +9,17 @@ Created on Jan 1, 2018
 
 @author: jrm
 """
-import enaml
-from micropyde.core.workbench import MicropydeWorkbench
+import sys
+import argparse
 
 
-def main():
+def create_workbench():
+    """ Create the workbench with every plugin registered. Plugins are only
+    started when they're first used.
+
+    """
+    import enaml
+    from micropyde.core.workbench import MicropydeWorkbench
     workbench = MicropydeWorkbench()
 
     with enaml.imports():
@@ -24,6 +30,7 @@ def main():
         from micropyde.board.manifest import BoardManifest
         from micropyde.esp.manifest import EspManifest
         from micropyde.ocd.manifest import OpenChipDebuggerManifest
+        from micropyde.firmware.manifest import FirmwareManifest
 
     workbench.register(CoreManifest())
     workbench.register(UIManifest())
@@ -32,4 +39,26 @@ def main():
     workbench.register(BoardManifest())
     workbench.register(EspManifest())
     workbench.register(OpenChipDebuggerManifest())
+    workbench.register(FirmwareManifest())
+    return workbench
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='micropyde')
+    parser.add_argument('--profile-startup', metavar='PATH', nargs='?',
+                        const='micropyde-startup.json',
+                        help="Save a trace of the imports, plugin starts and "
+                             "dock items created during startup")
+    parser.add_argument('--exit-after-startup', action='store_true',
+                        help="Quit once the window is ready")
+    #: Leave anything else for Qt
+    args, argv = parser.parse_known_args()
+    sys.argv[1:] = argv
+
+    if args.profile_startup:
+        from micropyde.core.profiler import start_profiler
+        start_profiler(args.profile_startup)
+
+    workbench = create_workbench()
+    workbench.exit_after_startup = args.exit_after_startup
     workbench.run()
@@ -0,0 +1,306 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import os
+import re
+import time
+import glob
+import shutil
+import struct
+from bisect import bisect_right
+from micropyde.core.utils import log
+
+#: Index entry of (timestamp, byte offset in the segment, line number)
+INDEX_ENTRY = struct.Struct('<dQQ')
+
+
+class IndexEntry(object):
+    """ A checkpoint in the capture used to seek to a line or time """
+    __slots__ = ('time', 'segment', 'offset', 'line')
+
+    def __init__(self, time, segment, offset, line):
+        self.time = time
+        self.segment = segment
+        self.offset = offset
+        self.line = line
+
+
+class StreamCapture(object):
+    """ Records the raw stream from the device to disk so it can be paged
+    through, searched, and exported after it scrolls out of the console.
+
+    The stream is appended as is to numbered segment files which are
+    rotated once they reach `segment_size`. Only the newest `segments` are
+    kept. Alongside each segment is a sparse index with a checkpoint every
+    `index_interval` bytes or second (whichever comes first) recording the
+    time, byte offset, and line number so any line or time can be found by
+    reading at most one interval.
+
+    """
+
+    def __init__(self, path, segment_size=8*1024*1024, segments=8,
+                 index_interval=64*1024):
+        self.path = path
+        self.segment_size = segment_size
+        self.segments = segments
+        self.index_interval = index_interval
+
+        #: Index of all the kept segments
+        self.index = []
+
+        #: Current segment state
+        self.segment = 0
+        self.file = None
+        self.index_file = None
+        self.offset = 0
+        self.lines = 0
+        self.last_index = (0, 0)
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.load()
+
+    # -------------------------------------------------------------------------
+    # Segment API
+    # -------------------------------------------------------------------------
+    def segment_path(self, segment, ext='log'):
+        return os.path.join(self.path, 'capture-{:06d}.{}'.format(segment,
+                                                                 ext))
+
+    def list_segments(self):
+        """ Return the numbers of the segments on disk, oldest first """
+        segments = []
+        for path in glob.glob(os.path.join(self.path, 'capture-*.log')):
+            try:
+                name = os.path.splitext(os.path.basename(path))[0]
+                segments.append(int(name.split('-')[-1]))
+            except ValueError:
+                pass
+        return sorted(segments)
+
+    def load(self):
+        """ Load the index of any existing segments so the capture
+        continues where it left off.
+
+        """
+        index = []
+        for segment in self.list_segments():
+            try:
+                with open(self.segment_path(segment, 'idx'), 'rb') as f:
+                    data = f.read()
+                n = len(data) - len(data) % INDEX_ENTRY.size
+                for t, offset, line in INDEX_ENTRY.iter_unpack(data[:n]):
+                    index.append(IndexEntry(t, segment, offset, line))
+            except IOError:
+                pass
+        self.index = index
+        if index:
+            #: Resume line numbering from the end of the last segment
+            last = index[-1]
+            self.segment = last.segment + 1
+            self.lines = last.line + self.count_lines(last.segment,
+                                                      last.offset)
+
+    def open_segment(self):
+        """ Start a new segment and remove any old ones over the limit """
+        self.close()
+        self.offset = 0
+        self.file = open(self.segment_path(self.segment), 'ab')
+        self.index_file = open(self.segment_path(self.segment, 'idx'), 'ab')
+        self.add_checkpoint(time.time())
+
+        segments = self.list_segments()
+        for segment in segments[:max(0, len(segments)-self.segments)]:
+            log.debug("capture | Removing segment {}".format(segment))
+            for ext in ('log', 'idx'):
+                try:
+                    os.remove(self.segment_path(segment, ext))
+                except OSError:
+                    pass
+            self.index = [e for e in self.index if e.segment != segment]
+
+    def add_checkpoint(self, t):
+        entry = IndexEntry(t, self.segment, self.offset, self.lines)
+        self.index.append(entry)
+        self.index_file.write(INDEX_ENTRY.pack(t, self.offset, self.lines))
+        self.index_file.flush()
+        self.file.flush()
+        self.last_index = (t, self.offset)
+
+    def write(self, data, timestamp=None):
+        """ Append data received from the device to the capture """
+        if not data:
+            return
+        t = timestamp or time.time()
+        if self.file is None or self.offset >= self.segment_size:
+            if self.file is not None:
+                self.segment += 1
+            self.open_segment()
+        self.file.write(data)
+        self.offset += len(data)
+        self.lines += data.count(b'\n')
+
+        last_time, last_offset = self.last_index
+        if (self.offset - last_offset >= self.index_interval or
+                t - last_time >= 1):
+            self.add_checkpoint(t)
+
+    def close(self):
+        for f in (self.file, self.index_file):
+            if f is not None:
+                f.close()
+        self.file = None
+        self.index_file = None
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def clear(self):
+        """ Delete all of the captured data """
+        self.close()
+        for segment in self.list_segments():
+            for ext in ('log', 'idx'):
+                os.remove(self.segment_path(segment, ext))
+        self.index = []
+        self.segment = 0
+        self.lines = 0
+
+    # -------------------------------------------------------------------------
+    # Query API
+    # -------------------------------------------------------------------------
+    @property
+    def first_line(self):
+        """ Number of the oldest line still kept in the capture """
+        return self.index[0].line if self.index else 0
+
+    @property
+    def line_count(self):
+        return self.lines
+
+    def count_lines(self, segment, offset):
+        """ Count the lines from the offset to the end of the capture """
+        return sum(chunk.count(b'\n')
+                   for chunk in self.iter_chunks(segment, offset))
+
+    def find_line(self, line):
+        """ Find the last checkpoint at or before the given line """
+        i = bisect_right([e.line for e in self.index], line)
+        return self.index[max(0, i-1)] if self.index else None
+
+    def find_time(self, t):
+        """ Find the line number of the data received at the given time """
+        i = bisect_right([e.time for e in self.index], t)
+        entry = self.index[max(0, i-1)] if self.index else None
+        return entry.line if entry else 0
+
+    def iter_chunks(self, segment=None, offset=0):
+        """ Read the capture in chunks starting from the offset in the
+        given segment continuing through all newer segments.
+
+        """
+        self.flush()
+        for n in self.list_segments():
+            if segment is not None and n < segment:
+                continue
+            with open(self.segment_path(n), 'rb') as f:
+                if n == segment:
+                    f.seek(offset)
+                for chunk in iter(lambda: f.read(self.index_interval), b''):
+                    yield chunk
+
+    def iter_blocks(self, segment=None, offset=0):
+        """ Same as iter_chunks but each block ends on a line boundary
+        (except possibly the last one).
+
+        """
+        remainder = b''
+        for chunk in self.iter_chunks(segment, offset):
+            data = remainder + chunk
+            end = data.rfind(b'\n') + 1
+            remainder = data[end:]
+            if end:
+                yield data[:end]
+        if remainder:
+            yield remainder
+
+    def read_lines(self, start, count):
+        """ Read count lines starting from the given line number.
+
+        Returns
+        -------
+            lines: list
+                List of decoded lines (may be less than count)
+
+        """
+        entry = self.find_line(start)
+        if entry is None:
+            return []
+        lines = []
+        line = entry.line
+        for block in self.iter_blocks(entry.segment, entry.offset):
+            parts = block.split(b'\n')
+            if not parts[-1]:
+                parts.pop()
+            for part in parts:
+                if line >= start:
+                    lines.append(part.rstrip(b'\r').decode('utf-8',
+                                                           'replace'))
+                    if len(lines) >= count:
+                        return lines
+                line += 1
+        return lines
+
+    def search(self, pattern, limit=1000, ignore_case=True):
+        """ Search the whole capture for lines matching the regex pattern.
+
+        Returns
+        -------
+            results: list
+                List of (line number, line) tuples of matches
+
+        """
+        return [r for matches in self.iter_search(pattern, limit, ignore_case)
+                for r in matches]
+
+    def iter_search(self, pattern, limit=1000, ignore_case=True):
+        """ Same as search but yields the list of matches in each block so
+        a long search can be run in steps (ex with task.cooperate).
+
+        """
+        flags = re.IGNORECASE if ignore_case else 0
+        regex = re.compile(pattern.encode(), flags)
+        found = 0
+        line = self.first_line
+        for block in self.iter_blocks():
+            results = []
+            pos = 0
+            for m in regex.finditer(block):
+                if m.start() < pos:
+                    continue  #: Already matched this line
+                line += block.count(b'\n', pos, m.start())
+                start = block.rfind(b'\n', 0, m.start()) + 1
+                pos = block.find(b'\n', m.start()) + 1 or len(block)
+                text = block[start:pos].rstrip(b'\r\n')
+                results.append((line, text.decode('utf-8', 'replace')))
+                line += 1
+                if found + len(results) >= limit:
+                    yield results
+                    return
+            line += block.count(b'\n', pos)
+            found += len(results)
+            yield results
+
+    def export(self, path):
+        """ Write the whole capture to the given file """
+        self.flush()
+        with open(path, 'wb') as dst:
+            for segment in self.list_segments():
+                with open(self.segment_path(segment), 'rb') as src:
+                    shutil.copyfileobj(src, dst)
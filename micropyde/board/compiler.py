@@ -0,0 +1,169 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+from twisted.internet import utils
+from twisted.internet.defer import (
+    DeferredList, DeferredSemaphore, inlineCallbacks, succeed
+)
+from micropyde.core.utils import atomic_write, log
+
+#: Architectures mpy-cross can emit native code for
+MPY_ARCHS = ('', 'x86', 'x64', 'armv6', 'armv6m', 'armv7m', 'armv7em',
+             'armv7emsp', 'armv7emdp', 'xtensa', 'xtensawin')
+
+#: Files the board runs by name so they must stay as source
+MPY_EXCLUDED = ('boot.py', 'main.py')
+
+
+def find_mpy_cross(upy_path=''):
+    """ Find the mpy-cross executable built in the micropython source tree
+    or on the path.
+
+    """
+    name = 'mpy-cross.exe' if sys.platform == 'win32' else 'mpy-cross'
+    if upy_path:
+        for path in (os.path.join(upy_path, 'mpy-cross', 'build', name),
+                     os.path.join(upy_path, 'mpy-cross', name)):
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+    return shutil.which(name)
+
+
+def should_compile(filename):
+    """ Return whether the file should be uploaded as bytecode """
+    name = os.path.basename(filename)
+    return name.endswith('.py') and name not in MPY_EXCLUDED
+
+
+class MpyCompiler(object):
+    """ Compiles source to .mpy files using mpy-cross. Outputs are cached
+    by the hash of the source, the mpy-cross version and the flags so only
+    modules that changed are rebuilt. At most `jobs` instances of mpy-cross
+    are run at once.
+
+    """
+
+    def __init__(self, executable, cache_dir, arch='', flags=(), jobs=None):
+        self.executable = executable
+        self.cache_dir = cache_dir
+        self.arch = arch
+        self.flags = list(flags)
+        self.semaphore = DeferredSemaphore(jobs or os.cpu_count() or 1)
+        self.version = None
+
+    def args(self):
+        args = list(self.flags)
+        if self.arch:
+            args.append('-march={}'.format(self.arch))
+        return args
+
+    @inlineCallbacks
+    def get_version(self):
+        """ The version reported by mpy-cross (it changes the bytecode) """
+        if self.version is None:
+            out, err, code = yield utils.getProcessOutputAndValue(
+                self.executable, ['--version'], env=os.environ)
+            if code != 0:
+                raise IOError("Failed to run {}: {}".format(
+                    self.executable, err.decode(errors='replace')))
+            self.version = out.decode(errors='replace').strip()
+        return self.version
+
+    def cache_key(self, source, filename):
+        h = hashlib.sha256()
+        for part in (self.version, ' '.join(self.args()),
+                     os.path.basename(filename)):
+            h.update(part.encode())
+            h.update(b'\0')
+        h.update(source)
+        return h.hexdigest()
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.mpy')
+
+    @inlineCallbacks
+    def compile(self, filename, source):
+        """ Compile the source of the given file.
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires with the contents of the .mpy file
+
+        """
+        yield self.get_version()
+        path = self.cache_path(self.cache_key(source, filename))
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        data = yield self.semaphore.run(self.run, filename, source)
+        atomic_write(path, data)
+        return data
+
+    @inlineCallbacks
+    def run(self, filename, source):
+        """ Run mpy-cross on the source """
+        name = os.path.basename(filename)
+        tmp = tempfile.mkdtemp(prefix='micropyde-mpy-')
+        try:
+            src = os.path.join(tmp, name)
+            dst = os.path.join(tmp, name[:-3] + '.mpy')
+            with open(src, 'wb') as f:
+                f.write(source)
+            args = self.args() + ['-s', name, '-o', dst, src]
+            log.debug("mpy-cross {}".format(' '.join(args)))
+            out, err, code = yield utils.getProcessOutputAndValue(
+                self.executable, args, env=os.environ, path=tmp)
+            if code != 0:
+                raise SyntaxError("Failed to compile {}: {}".format(
+                    filename, (err or out).decode(errors='replace').strip()))
+            with open(dst, 'rb') as f:
+                return f.read()
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def compile_all(self, paths):
+        """ Compile each of the given files. Files that fail are logged
+        and left out.
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires with a dict of the .mpy contents by
+                path
+
+        """
+        paths = [p for p in paths if should_compile(p)]
+        if not paths:
+            return succeed({})
+
+        def compile_path(path):
+            with open(path, 'rb') as f:
+                return self.compile(path, f.read())
+
+        def on_done(results):
+            compiled = {}
+            for path, (ok, result) in zip(paths, results):
+                if ok:
+                    compiled[path] = result
+                else:
+                    log.warning(result.getErrorMessage())
+            return compiled
+        d = DeferredList([compile_path(p) for p in paths],
+                         consumeErrors=True)
+        return d.addCallback(on_done)
+
+    def clear(self):
+        """ Remove everything in the cache """
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,279 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import ipaddress
+from twisted.internet import reactor, task
+from twisted.internet.defer import Deferred, DeferredList
+from twisted.internet.protocol import Protocol
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from micropyde.core.utils import atomic_write, log
+
+#: Handshake sent to check if a host is serving the WebREPL
+HANDSHAKE = (
+    "GET / HTTP/1.1\r\n"
+    "Host: {host}:{port}\r\n"
+    "Connection: Upgrade\r\n"
+    "Upgrade: websocket\r\n"
+    "Sec-WebSocket-Key: {key}\r\n"
+    "Sec-WebSocket-Version: 13\r\n"
+    "\r\n"
+)
+
+#: Magic string used to compute the Sec-WebSocket-Accept reply (RFC 6455)
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+#: Never scan more than this many hosts at once
+MAX_HOSTS = 65536
+
+
+def parse_networks(networks, address=''):
+    """ Parse a comma separated list of CIDR ranges (ex 192.168.1.0/24,
+    10.0.0.0/22). If none are given the /24 of the address is used.
+
+    Returns
+    -------
+        networks: list
+            List of IPv4Network
+
+    """
+    results = []
+    for cidr in networks.replace(';', ',').split(','):
+        cidr = cidr.strip()
+        if cidr:
+            results.append(ipaddress.IPv4Network(u"{}".format(cidr),
+                                                 strict=False))
+    if not results and address:
+        results.append(ipaddress.IPv4Network(u"{}/24".format(address),
+                                             strict=False))
+    return results
+
+
+def iter_hosts(networks, limit=MAX_HOSTS):
+    """ Iterate over the unique host addresses in the networks """
+    seen = set()
+    for network in networks:
+        hosts = network.hosts() if network.num_addresses > 2 else network
+        for host in hosts:
+            if len(seen) >= limit:
+                log.warning("discovery | Scan limited to {} hosts".format(
+                    limit))
+                return
+            host = str(host)
+            if host not in seen:
+                seen.add(host)
+                yield host
+
+
+class HandshakeProbe(Protocol):
+    """ Sends a WebSocket upgrade request and checks the reply is a valid
+    101 Switching Protocols like the WebREPL sends. The deferred is fired
+    with True if it is or False otherwise.
+
+    """
+
+    def __init__(self, address, port, deferred):
+        self.address = address
+        self.port = port
+        self.deferred = deferred
+        self.buffer = b''
+        self.key = base64.b64encode(os.urandom(16))
+
+    def connectionMade(self):
+        self.transport.write(HANDSHAKE.format(
+            host=self.address, port=self.port,
+            key=self.key.decode()).encode())
+
+    def dataReceived(self, data):
+        self.buffer += data
+        if b'\r\n\r\n' in self.buffer:
+            self.done(self.is_valid(self.buffer))
+            self.transport.loseConnection()
+        elif len(self.buffer) > 4096:
+            self.done(False)
+            self.transport.loseConnection()
+
+    def is_valid(self, response):
+        lines = response.split(b'\r\n')
+        status = lines[0].split()
+        if len(status) < 2 or status[1] != b'101':
+            return False
+        accept = base64.b64encode(hashlib.sha1(self.key+WS_GUID).digest())
+        for line in lines[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'sec-websocket-accept':
+                return value.strip() == accept
+        return False
+
+    def connectionLost(self, reason):
+        self.done(False)
+
+    def done(self, result):
+        if not self.deferred.called:
+            self.deferred.callback(result)
+
+
+def probe(address, port, timeout=1.0):
+    """ Check if the host is serving the WebREPL on the given port.
+
+    Returns
+    -------
+        result: Deferred
+            A deferred that fires with True or False within the timeout
+
+    """
+    d = Deferred()
+    protocol = HandshakeProbe(address, port, d)
+    point = TCP4ClientEndpoint(reactor, address, port, timeout=timeout)
+    connecting = connectProtocol(point, protocol)
+    connecting.addErrback(lambda e: protocol.done(False))
+
+    def on_timeout():
+        if d.called:
+            return
+        connecting.cancel()
+        if protocol.transport is not None:
+            protocol.transport.abortConnection()
+        protocol.done(False)
+
+    call = reactor.callLater(timeout, on_timeout)
+
+    def on_done(result):
+        if call.active():
+            call.cancel()
+        return result
+    return d.addBoth(on_done)
+
+
+class DiscoveryCache(object):
+    """ Remembers the boards found by previous scans so they can be shown
+    without waiting for a scan. Entries expire once they have not been
+    seen for `ttl` seconds.
+
+    """
+
+    def __init__(self, path, ttl=7*24*60*60):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}
+        self.expire()
+
+    def save(self):
+        atomic_write(self.path, json.dumps(self.entries, indent=2))
+
+    def expire(self, now=None):
+        """ Remove entries that have not been seen within the ttl """
+        now = now or time.time()
+        self.entries = {k: e for k, e in self.entries.items()
+                        if now - e.get('last_seen', 0) < self.ttl}
+
+    def add(self, address, port, now=None):
+        self.entries["{}:{}".format(address, port)] = {
+            'address': address,
+            'port': port,
+            'last_seen': now or time.time(),
+        }
+
+    def remove(self, address, port):
+        self.entries.pop("{}:{}".format(address, port), None)
+
+    def addresses(self, port=None):
+        """ Return the addresses seen on the port, most recent first """
+        self.expire()
+        entries = sorted(self.entries.values(),
+                         key=lambda e: e['last_seen'], reverse=True)
+        return [e['address'] for e in entries
+                if port is None or e['port'] == port]
+
+
+class Discovery(object):
+    """ Scans ranges of addresses for boards serving the WebREPL. At most
+    `concurrency` hosts are probed at once and each probe gives up after
+    `timeout` seconds.
+
+    """
+
+    def __init__(self, cache, concurrency=32, timeout=1.0):
+        self.cache = cache
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.scanning = False
+
+    def scan(self, networks, port, found=None):
+        """ Probe every host in the networks.
+
+        Parameters
+        ----------
+            networks: list
+                List of IPv4Network to scan
+            port: int
+                Port the WebREPL is served on
+            found: callable or None
+                Called with each address as soon as it is found
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires with the list of addresses found
+                when the scan completes or is stopped.
+
+        """
+        addresses = []
+        self.scanning = True
+        start = time.time()
+
+        def on_result(result, address):
+            if not result:
+                return
+            log.debug("discovery | {}:{} is a WebREPL".format(address, port))
+            addresses.append(address)
+            self.cache.add(address, port)
+            if found is not None:
+                found(address)
+
+        def work():
+            for address in iter_hosts(networks):
+                if not self.scanning:
+                    return
+                d = probe(address, port, self.timeout)
+                d.addCallback(on_result, address)
+                yield d
+
+        #: Each worker pulls the next host from the same generator
+        #: so only `concurrency` probes are ever in flight
+        hosts = work()
+        workers = [task.coiterate(hosts)
+                   for i in range(max(1, self.concurrency))]
+
+        def on_done(r):
+            self.scanning = False
+            log.debug("discovery | Found {} in {}s".format(
+                addresses, round(time.time()-start, 2)))
+            try:
+                self.cache.save()
+            except (IOError, OSError) as e:
+                log.warning("discovery | Couldn't save cache: {}".format(e))
+            return addresses
+        return DeferredList(workers).addCallback(on_done)
+
+    def stop(self):
+        """ Stop the scan after the probes in flight complete """
+        self.scanning = False
@@ -8,39 +8,64 @@ The full license is in the file LICENSE, distributed with this software.
 @author: jrm
 """
 import os
-import enaml
-import socket
 import hashlib
 import textwrap
 import traceback
-from base64 import b64decode
-from atom.api import Dict, Int, Instance, Str, List, Value, observe
-from autobahn.twisted.websocket import (
-    WebSocketClientFactory, WebSocketClientProtocol
+import re
+import time
+import zlib
+from binascii import a2b_base64, b2a_base64
+from collections import deque
+from atom.api import (
+    Bool, Dict, Enum, Event, Float, Int, Instance, Str, List, Value, observe
 )
 from twisted.internet import reactor
-from twisted.internet.defer import Deferred, DeferredList, inlineCallbacks
-from twisted.internet.serialport import SerialPort
-from twisted.protocols.basic import LineReceiver
+from twisted.internet.defer import (
+    Deferred, DeferredList, inlineCallbacks, succeed
+)
+from twisted.internet.threads import deferToThread
 from twisted.internet.protocol import Protocol
 from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
-from serial.tools.list_ports import comports
-from enaml.application import deferred_call, timed_call
+from twisted.protocols.basic import LineReceiver
 from micropyde.core.api import Plugin, Model
-from micropyde.core.utils import async_sleep, log
+from micropyde.core import logs
+from micropyde.core.utils import async_sleep, load_enaml, log, transport_log
+from .capture import StreamCapture
+from .compiler import MPY_ARCHS, MpyCompiler, find_mpy_cross, should_compile
+from .discovery import Discovery, DiscoveryCache, parse_networks
+from .ports import PortMonitor, port_key
+from .profiler import DeviceProfiler
+from .stats import BoardStats, measured
+from .store import CacheStore
+from .webrepl import FileTransfer, WebsocketTransport
+from .telemetry import Telemetry
 
 UPLOAD_TEMPLATE = """
-def __uploader__(filename, filesize, expected_hash):
+def __uploader__(filename, filesize, expected_hash, resume):
+    import os
     import sys
     import uhashlib
     import ubinascii
     print("Uploading %s..." % filename)
-    f = open(filename, 'wb')
-    try:
+    part = filename + '.part'
+    n = 0
+    if resume:
+        try:
+            n = os.stat(part)[6]
+        except OSError:
+            pass
+    if n > filesize:
         n = 0
+    f = open(part, 'ab' if n else 'wb')
+    print('Offset: %i' % n)
+    try:
+        flushed = n
         while n < filesize:
             cnt = min(filesize - n, 64)
             n += f.write(sys.stdin.read(cnt))
+            if n - flushed >= 4096:
+                f.flush()
+                flushed = n
             print('Uploaded: %i of %i'%(n, filesize))
     except Exception as e:
         print(e)
@@ -48,24 +73,180 @@ def __uploader__(filename, filesize, expected_hash):
         f.close()
     try:
         print("Verifying...")
-        f = open(filename, 'rb')
+        f = open(part, 'rb')
         hash = uhashlib.sha256()
         while True:
             data = f.read(64)
             if not data:
                 break
             hash.update(data)
-        if ubinascii.hexlify(hash.digest()) == expected_hash:
+        ok = ubinascii.hexlify(hash.digest()) == expected_hash
+        f.close()
+        if ok:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            os.rename(part, filename)
             print("Upload success!")
         else:
+            os.remove(part)
             print("Upload failed (hash mismatch)!")
+    except Exception as e:
+        f.close()
+        print("Upload failed (%s)!" % e)
+__uploader__(\'{filename}\', {size}, b\'{expected_hash}\', {resume})
+"""
+
+ENCODED_UPLOAD_TEMPLATE = """
+def __uploader__(filename, filesize, datasize, expected_hash, method, resume):
+    import os
+    import sys
+    import uhashlib
+    import ubinascii
+    print("Uploading %s..." % filename)
+    part = filename + '.z'
+    n = 0
+    if resume:
+        try:
+            n = os.stat(part)[6]
+        except OSError:
+            pass
+    if n > datasize or (n % 48 and n != datasize):
+        n = 0
+    f = open(part, 'ab' if n else 'wb')
+    size = (datasize + 2) // 3 * 4
+    n = (n + 2) // 3 * 4
+    print('Offset: %i' % n)
+    try:
+        flushed = n
+        while n < size:
+            cnt = min(size - n, 64)
+            f.write(ubinascii.a2b_base64(sys.stdin.read(cnt)))
+            n += cnt
+            if n - flushed >= 4096:
+                f.flush()
+                flushed = n
+            print('Uploaded: %i of %i'%(n, size))
     except Exception as e:
         print(e)
     finally:
         f.close()
-__uploader__(\'{filename}\', {size}, b\'{expected_hash}\')
+    try:
+        print("Verifying...")
+        f = open(part, 'rb')
+        if method == 'deflate':
+            import deflate
+            src = deflate.DeflateIO(f, deflate.ZLIB)
+        elif method:
+            src = __import__(method).DecompIO(f, {wbits})
+        else:
+            src = f
+        out = open(filename + '.part', 'wb')
+        hash = uhashlib.sha256()
+        n = 0
+        while True:
+            data = src.read(256)
+            if not data:
+                break
+            hash.update(data)
+            n += out.write(data)
+        out.close()
+        f.close()
+        os.remove(part)
+        ok = n == filesize and ubinascii.hexlify(hash.digest()) == expected_hash
+        if ok:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            os.rename(filename + '.part', filename)
+            print("Upload success!")
+        else:
+            os.remove(filename + '.part')
+            print("Upload failed (hash mismatch)!")
+    except Exception as e:
+        f.close()
+        print("Upload failed (%s)!" % e)
+__uploader__(\'{filename}\', {size}, {datasize}, b\'{expected_hash}\', {method!r}, {resume})
+"""
+
+DECOMPRESS_QUERY = """
+def __decompress__():
+    for name, attr in (('deflate', 'DeflateIO'), ('zlib', 'DecompIO'),
+                       ('uzlib', 'DecompIO')):
+        try:
+            if hasattr(__import__(name), attr):
+                return name
+        except ImportError:
+            pass
+print('Decompress: %s' % __decompress__())
 """
 
+#: Window size used to compress uploads. The board allocates a buffer of
+#: 2**wbits to decompress so it's kept small.
+DEFLATE_WBITS = 10
+
+#: Matches anything that can't be sent through the REPL as is
+UNSAFE_PATTERN = re.compile(rb'[^\t\n\r\x20-\x7e]')
+
+DOWNLOAD_TEMPLATE = """
+def __downloader__(path, offset):
+    import sys
+    from ubinascii import b2a_base64
+    f = open(path, 'rb')
+    f.seek(offset)
+    while True:
+        d = f.read(256)
+        if not d:
+            break
+        sys.stdout.write(b2a_base64(d))
+    f.close()
+__downloader__(\'{path}\', {offset})"""
+
+REMOVE_TEMPLATE = """
+def __remove__(path):
+    import os
+    try:
+        os.remove(path)
+        print("Removed %s" % path)
+    except OSError:
+        print("Not found %s" % path)
+__remove__(\'{path}\')"""
+
+
+#: Matches a line written by the downloader
+BASE64_PATTERN = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
+
+
+class ConnectionLost(IOError):
+    """ Raised when the connection drops while waiting on the board. The
+    lines received before it dropped are kept so work can be resumed.
+
+    """
+    def __init__(self, message="Connection lost", lines=None):
+        super(ConnectionLost, self).__init__(message)
+        self.lines = lines or []
+
+
+def decode_download(lines):
+    """ Decode the base64 lines written by the downloader """
+    start, end = None, len(lines)
+    for i, line in enumerate(lines):
+        if "__downloader__" in line:
+            start = i+1
+        elif line.startswith(">>>"):
+            end = i
+    if start is None:
+        return b''  #: Never started
+    data = []
+    for line in lines[start:end]:
+        if not BASE64_PATTERN.match(line):
+            log.warning("Invalid download data: {}".format(line))
+            break
+        data.append(a2b_base64(line))
+    return b''.join(data)
+
 
 class Connection(Model):
     """ The abstract connection protocol
@@ -75,7 +256,17 @@ class Connection(Model):
     #: The connection name
     name = Str()
 
-    def is_available(self):
+    #: Fired with the reason when the connection drops unexpectedly
+    lost = Event()
+
+    #: Set when the connection is closed on purpose
+    closing = Bool()
+
+    def check_available(self):
+        """ Must return a deferred that resolves with whether the
+        connection can be opened
+
+        """
         raise NotImplementedError
 
     def configure(self):
@@ -92,6 +283,41 @@ class Connection(Model):
     def disconnect(self):
         raise NotImplementedError
 
+    def connection_lost(self, reason):
+        """ Called by the transport when the connection closes """
+        if not self.closing:
+            message = getattr(reason, 'getErrorMessage', lambda: reason)()
+            log.warning("{} connection lost: {}".format(self.name, message))
+            self.lost(reason)
+
+
+class SerialDelegateProtocol(Protocol):
+    """ Delegates the calls to the given protocol and tells the connection
+    if the port goes away.
+
+    """
+
+    def __init__(self, connection, delegate):
+        self.connection = connection
+        self.delegate = delegate
+
+    def connectionMade(self):
+        self.delegate.makeConnection(self.transport)
+
+    def dataReceived(self, data):
+        if logs.trace is not None:
+            logs.trace.record(logs.RX, self.connection.name, data)
+        self.delegate.dataReceived(data)
+
+    def connectionLost(self, reason):
+        port = self.connection.serial_port
+        if port is not None and port is not self.transport:
+            return  #: Closing a port that was already replaced
+        self.delegate.connectionLost(reason)
+        if port is not None:
+            #: Otherwise it was disconnected on purpose
+            self.connection.connection_lost(reason)
+
 
 class SerialConnection(Connection):
     #: Connection settings
@@ -99,16 +325,27 @@ class SerialConnection(Connection):
     ports = List()
     baudrate = Int(115200).tag(config=True)
 
-    #: Actual connection
-    serial_port = Instance(SerialPort)
+    #: Key (VID:PID:serial) of the board last connected on this port
+    port_key = Str().tag(config=True)
+
+    #: Read through the reactor or on a dedicated thread and the settings
+    #: used by the thread
+    io_mode = Enum('reactor', 'thread').tag(config=True)
+    read_size = Int(4096).tag(config=True)
+    low_latency = Bool(True).tag(config=True)
+
+    #: Actual connection (a SerialPort or SerialThreadTransport)
+    serial_port = Value()
 
     #: Comport instance
     comport = Value()
 
-    def is_available(self):
-        self.ports = comports()
-        self.name = self._default_name()
-        return bool(self.ports)
+    def check_available(self):
+        def on_ports(ports):
+            self.ports = ports
+            self.name = self._default_name()
+            return bool(ports)
+        return PortMonitor.instance().get_ports().addCallback(on_ports)
 
     def _default_name(self):
         for comport in self.ports:
@@ -126,29 +363,67 @@ class SerialConnection(Connection):
         if change['type'] == 'update':
             self.port = self.comport.device
 
+    def locate(self):
+        """ Switch to the port the board is on if it came back on a
+        different device path (ex after a reset).
+
+        """
+        port = PortMonitor.instance().find(self.port_key)
+        if port is not None and port.device != self.port:
+            log.info("{} moved to {}".format(self.port, port.device))
+            self.port = port.device
+
     def connect(self, protocol):
+        self.closing = False
+        if self.io_mode == 'thread':
+            return self.connect_thread(protocol)
         d = Deferred()
 
         def do_connect():
+            from twisted.internet.serialport import SerialPort
             try:
                 self.serial_port = SerialPort(
-                    protocol, self.port, reactor,
-                    baudrate=self.baudrate)
+                    SerialDelegateProtocol(self, protocol), self.port,
+                    reactor, baudrate=self.baudrate)
+                self.port_key = (PortMonitor.instance().key_for(self.port) or
+                                 self.port_key)
                 d.callback(True)
                 log.debug("{} connected!".format(self.port))
             except Exception as e:
-                d.callback(e)
-        deferred_call(do_connect)
+                d.errback(e)
+        reactor.callLater(0, do_connect)
         return d
 
+    def connect_thread(self, protocol):
+        """ Open the port in a thread (it can be slow for some adapters)
+        and read it on a dedicated thread.
+
+        """
+        def on_open(transport):
+            self.serial_port = transport
+            self.port_key = (PortMonitor.instance().key_for(self.port) or
+                             self.port_key)
+            transport.start()
+            log.debug("{} connected (threaded io)!".format(self.port))
+            return True
+        from .serial_thread import SerialThreadTransport
+        d = deferToThread(SerialThreadTransport,
+                          SerialDelegateProtocol(self, protocol), self.port,
+                          baudrate=self.baudrate, read_size=self.read_size,
+                          low_latency=self.low_latency)
+        return d.addCallback(on_open)
+
     def write(self, message):
         if self.serial_port is None:
             return 0
+        if logs.trace is not None:
+            logs.trace.record(logs.TX, self.name, message)
         return self.serial_port.write(message)
 
     def disconnect(self):
         """ """
         s = self.serial_port
+        self.closing = True
         if s:
             log.debug("{} disconnected!".format(self.port))
             s.loseConnection()
@@ -157,73 +432,125 @@ class SerialConnection(Connection):
 
 class WebsocketConnection(Connection):
 
+    #: Addresses of boards found by scanning
+    addresses = List()
+
     #: ws address
-    #: TODO: Config this
-    addresses = List().tag(config=True)
     address = Str('192.168.41.144').tag(config=True)
 
     #: Ws port
     port = Int(8266).tag(config=True)
 
-    #:
-    connection = Instance(WebSocketClientProtocol)
+    #: Comma separated CIDR ranges to scan, if empty the /24 of the address
+    networks = Str().tag(config=True)
+
+    #: Number of hosts probed at once and how long to wait for each
+    scan_concurrency = Int(32).tag(config=True)
+    scan_timeout = Float(1.0).tag(config=True)
+
+    #: Scanner used to find boards
+    discovery = Instance(Discovery)
+
+    #: Set while a scan is running
+    scanning = Bool()
+
+    #: Writes are coalesced into a frame for up to batch_delay seconds or
+    #: until batch_size bytes are pending
+    batch_delay = Float(0.005).tag(config=True)
+    batch_size = Int(1024).tag(config=True)
+
+    #: The WebSocketClientProtocol, autobahn is imported when connecting
+    connection = Value()
 
     #:
     connector = Instance(object)
 
+    #: Writes waiting to be sent
+    write_buffer = Instance(bytearray, ())
+    flush_call = Value()
+
+    #: Binary file transfer in progress
+    transfer = Instance(FileTransfer)
+
     def _default_name(self):
         return "ws://{}:{}".format(self.address, self.port)
 
+    def _default_discovery(self):
+        path = os.path.expanduser('~/.config/micropyde/discovery.json')
+        return Discovery(DiscoveryCache(path))
+
+    def _default_addresses(self):
+        #: Show the boards from previous scans right away
+        return self.discovery.cache.addresses(self.port)
+
     @observe('address', 'port')
     def _refresh_name(self, change):
         self.name = self._default_name()
 
-    def is_available(self):
-        try:
-            log.info("Testing connection to: {}:{}".format(self.address,
-                                                        self.port))
-            s = socket.create_connection((self.address, self.port), 0.2)
-            s.close()
+    def check_available(self, timeout=0.5):
+        log.info("Testing connection to: {}:{}".format(self.address,
+                                                    self.port))
+        point = TCP4ClientEndpoint(reactor, self.address, self.port,
+                                   timeout=timeout)
+
+        def on_connect(p):
+            p.transport.loseConnection()
             log.info("ws REPL available!")
             return True
-        except Exception as e:
-            log.info("ws REPL unavailable: {}".format(e))
+
+        def on_error(e):
+            log.info("ws REPL unavailable: {}".format(e.getErrorMessage()))
             return False
 
+        d = connectProtocol(point, Protocol())
+        return d.addCallbacks(on_connect, on_error)
+
     def scan_subnet(self):
-        """ Scan to find any ws clients on the port"""
-        subnet = self.address.split('.')[0:3]
-        addrs = []
-
-        def on_connect(p, addr):
-            log.debug("scan | {}:{} is up!".format(addr,
-                                                   self.port))
-            addrs.append(addr)
-            p.transport.loseConnection()
+        """ Scan the configured networks for boards serving the WebREPL.
+        Boards are added to the addresses as soon as they are found.
 
-        #: Scan for everything in the subnet
-        #: timeout after 1 second
-        ds = []
-        for i in range(256):
-            addr = ".".join(subnet+[str(i)])
-            point = TCP4ClientEndpoint(reactor, addr, self.port)
-            d = connectProtocol(point, Protocol())
-            d.addCallback(lambda p, addr=addr: on_connect(p, addr))
-            d.addErrback(lambda e, addr=addr: log.debug(
-                "scan | {} is down".format(addr)))
-            reactor.callLater(1, d.cancel)
-            ds.append(d)
+        """
+        if self.scanning:
+            return
+        try:
+            networks = parse_networks(self.networks, self.address)
+        except ValueError as e:
+            log.warning("scan | Invalid network: {}".format(e))
+            return
+        discovery = self.discovery
+        discovery.concurrency = self.scan_concurrency
+        discovery.timeout = self.scan_timeout
+        self.scanning = True
+
+        def on_found(address):
+            if address not in self.addresses:
+                self.addresses = self.addresses + [address]
 
-        #: When they all finish update the addresses property
-        done = DeferredList(ds)
-        done.addCallback(lambda r: setattr(self, 'addresses', addrs))
+        def on_done(addresses):
+            self.scanning = False
+            return addresses
+
+        d = discovery.scan(networks, self.port, found=on_found)
+        return d.addBoth(on_done)
+
+    def stop_scan(self):
+        self.discovery.stop()
 
     def connect(self, protocol):
+        from autobahn.twisted.websocket import (
+            WebSocketClientFactory, WebSocketClientProtocol
+        )
         d = Deferred()
+        self.closing = False
 
         factory = WebSocketClientFactory(
                     'ws://{}:{}'.format(self.address, self.port))
 
+        def on_failed(connector, reason):
+            if not d.called:
+                d.errback(reason)
+        factory.clientConnectionFailed = on_failed
+
         this = self
 
         class DelegateProtocol(WebSocketClientProtocol):
@@ -231,22 +558,38 @@ class WebsocketConnection(Connection):
             delegate = protocol
             connector = self
 
-            def onConnect(self, response):
+            def onOpen(self):
                 this.connection = self
-                self.delegate.transport = self.transport
+                self.delegate.transport = WebsocketTransport(
+                    this, self.transport)
                 d.callback(self)
                 log.debug("ws://{}:{} connected!".format(this.address,
                                                  this.port))
                 self.delegate.connectionMade()
 
             def onMessage(self, payload, isBinary):
-                self.delegate.dataReceived(payload)
+                if logs.trace is not None:
+                    logs.trace.record(logs.RX, this.name, payload)
+                if isBinary and this.transfer is not None:
+                    this.transfer.feed(payload)
+                else:
+                    self.delegate.dataReceived(payload)
 
             def onClose(self, wasClean, code, reason):
                 log.debug("ws://{}:{} disconnected: "
                           "clean={} code={} reason={}!".format(
                     this.address, this.port, wasClean, code, reason))
+                if not d.called:
+                    d.errback(ConnectionLost(reason or "Handshake failed"))
+                    return
+                if this.connection not in (None, self):
+                    return  #: Closing a connection that was replaced
                 self.delegate.connectionLost(reason)
+                if this.connection is None:
+                    return  #: It was disconnected on purpose
+                if this.transfer is not None:
+                    this.transfer.cancel(ConnectionLost(reason))
+                this.connection_lost(reason)
 
         factory.protocol = DelegateProtocol
 
@@ -254,11 +597,88 @@ class WebsocketConnection(Connection):
         return d
 
     def write(self, message):
+        """ Queue the message to be sent. Small writes (ex keystrokes or
+        chunks of a script) are combined into one frame.
+
+        """
+        if not self.connection:
+            return 0
+        if isinstance(message, str):
+            message = message.encode()
+        if logs.trace is not None:
+            logs.trace.record(logs.TX, self.name, message)
+        self.write_buffer.extend(message)
+        if len(self.write_buffer) >= self.batch_size:
+            self.flush()
+        elif self.flush_call is None:
+            self.flush_call = reactor.callLater(self.batch_delay, self.flush)
+        return len(message)
+
+    def flush(self):
+        """ Send everything written since the last flush """
+        call = self.flush_call
+        if call is not None and call.active():
+            call.cancel()
+        self.flush_call = None
+        data = bytes(self.write_buffer)
+        self.write_buffer.clear()
+        if not self.connection:
+            return
+        size = self.batch_size
+        for i in range(0, len(data), size):
+            self.connection.sendMessage(data[i:i+size])
+
+    def send_binary(self, data):
+        """ Send a binary frame (flushing any pending text first) """
+        self.flush()
         if self.connection:
-            self.connection.sendMessage(message)
+            if logs.trace is not None:
+                logs.trace.record(logs.TX, self.name, data)
+            self.connection.sendMessage(data, isBinary=True)
+
+    def put_file(self, filename, data, progress=None):
+        """ Write the data to the filename on the board using the WebREPL
+        file transfer protocol.
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires when the board has written the file
+
+        """
+        return self.start_transfer(progress).put(filename, data)
+
+    def get_file(self, filename, size=0, progress=None):
+        """ Read a file from the board using the WebREPL file transfer
+        protocol.
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires with the contents of the file
+
+        """
+        return self.start_transfer(progress).get(filename, size)
+
+    def start_transfer(self, progress=None):
+        if self.connection is None:
+            raise ConnectionLost("Not connected")
+        if self.transfer is not None:
+            raise RuntimeError("A file transfer is already in progress")
+        transfer = FileTransfer(self.send_binary, progress)
+
+        def on_done(result):
+            self.transfer = None
+            return result
+        transfer.deferred.addBoth(on_done)
+        self.transfer = transfer
+        return transfer
 
     def disconnect(self):
         c = self.connector
+        self.closing = True
+        if self.flush_call is not None:
+            self.flush()
         if c:
             c.disconnect()
             self.connector = None
@@ -280,18 +700,43 @@ class Board(Model):
     #: Current connection for this board
     connection = Instance(Connection).tag(config=True)
 
+    #: Reconnect if the connection drops and the delay between attempts
+    #: which doubles after each failure up to the max delay (in seconds)
+    auto_reconnect = Bool(True).tag(config=True)
+    reconnect_delay = Float(0.5).tag(config=True)
+    reconnect_max_delay = Float(30).tag(config=True)
+
+    #: Whether the connection is open
+    connected = Bool()
+
+    #: Set while waiting to reconnect
+    reconnecting = Bool()
+    reconnect_attempts = Int()
+    reconnect_call = Value()
+
+    #: Protocol the connection was opened with
+    protocol = Value()
+
+    #: Writes made while connecting, sent once connected
+    queue = Instance(deque, kwargs={'maxlen': 256})
+
+    #: Deferreds waiting for the connection to open
+    waiters = List()
+
+    #: Features detected on the device, cleared whenever the connection
+    #: changes or drops since it may be a different board or firmware
+    features = Dict()
+
+    #: Timing of operations and bytes sent and received
+    stats = Instance(BoardStats, ())
+
     def _default_connections(self):
         """ """
         return [SerialConnection(), WebsocketConnection()]
 
     def _default_available_connections(self):
-        available = []
-        if not self.configured_connections:
-            self.configured_connections = self._default_connections()
-        for connection in self.configured_connections:
-            if connection.is_available():
-                available.append(connection)
-        return available
+        reactor.callLater(0, self.refresh_connections)
+        return []
 
     def _default_connection(self):
         if not self.configured_connections:
@@ -304,8 +749,30 @@ class Board(Model):
 
     @observe('configured_connections')
     def refresh_connections(self, change=None):
-        """ Refresh available connections """
-        self.available_connections = self._default_available_connections()
+        """ Check which connections are available without blocking. All
+        are checked at once and each is added or removed as soon as its
+        result comes back.
+
+        """
+        if not self.configured_connections:
+            self.configured_connections = self._default_connections()
+            return
+        ds = []
+        for connection in self.configured_connections:
+            d = connection.check_available()
+            d.addErrback(lambda e: log.warning(
+                "Availability check failed: {}".format(e)))
+            d.addCallback(self._update_available, connection)
+            ds.append(d)
+        return DeferredList(ds)
+
+    def _update_available(self, available, connection):
+        """ Add or remove the connection keeping the configured order """
+        current = self.available_connections
+        self.available_connections = [
+            c for c in self.configured_connections
+            if (c is connection and available) or
+               (c is not connection and c in current)]
 
     def _observe_connection(self, change):
         """ Whenever the connection changes, disconnect  """
@@ -313,12 +780,113 @@ class Board(Model):
             oldvalue = change['oldvalue']
             if oldvalue:
                 oldvalue.disconnect()
+        self.features = {}
 
     def connect(self, protocol):
-        """ Delegate to the current connection """
-        return self.connection.connect(protocol)
+        """ Delegate to the current connection. If it drops it's reopened
+        with the same protocol until disconnect is called.
+
+        """
+        self.cancel_reconnect()
+        self.protocol = protocol
+        d = self.connection.connect(protocol)
+
+        def on_error(failure):
+            self.protocol = None
+            self.queue.clear()
+            return failure
+        return d.addCallbacks(self._on_connected, on_error)
+
+    def _on_connected(self, result):
+        self.connected = True
+        self.reconnecting = False
+        self.reconnect_attempts = 0
+        queue = self.queue
+        if queue:
+            log.debug("board | Sending {} queued writes".format(len(queue)))
+        while queue:
+            self.connection.write(queue.popleft())
+        waiters, self.waiters = self.waiters, []
+        for d in waiters:
+            d.callback(True)
+        return result
+
+    @observe('connection.lost')
+    def _on_connection_lost(self, change):
+        if change['type'] != 'event':
+            return
+        self.connected = False
+        self.features = {}
+        if self.auto_reconnect and self.protocol is not None:
+            self.schedule_reconnect()
+
+    def schedule_reconnect(self):
+        """ Try to reconnect after a delay that backs off exponentially """
+        delay = min(self.reconnect_max_delay,
+                    self.reconnect_delay*2**self.reconnect_attempts)
+        self.reconnect_attempts += 1
+        self.reconnecting = True
+        log.info("board | Reconnecting in {}s (attempt {})".format(
+            delay, self.reconnect_attempts))
+        self.reconnect_call = reactor.callLater(delay, self._reconnect)
+
+    def _reconnect(self):
+        self.reconnect_call = None
+        connection = self.connection
+        if isinstance(connection, SerialConnection):
+            connection.locate()
+
+        def on_error(failure):
+            log.debug("board | Reconnect failed: {}".format(
+                failure.getErrorMessage()))
+            if self.protocol is not None:
+                self.schedule_reconnect()
+        d = connection.connect(self.protocol)
+        d.addCallbacks(self._on_connected, on_error)
+
+    def cancel_reconnect(self):
+        call = self.reconnect_call
+        if call is not None and call.active():
+            call.cancel()
+        self.reconnect_call = None
+        self.reconnecting = False
+        self.reconnect_attempts = 0
+
+    def wait_for_connection(self, timeout=30):
+        """ Return a deferred that fires once the connection is open or
+        fails with ConnectionLost if it isn't within the timeout.
+
+        """
+        if self.connected:
+            return succeed(True)
+        d = Deferred()
+        self.waiters.append(d)
+
+        def on_timeout():
+            if d in self.waiters:
+                self.waiters.remove(d)
+                d.errback(ConnectionLost("Timed out waiting to reconnect"))
+        call = reactor.callLater(timeout, on_timeout)
+
+        def on_done(result):
+            if call.active():
+                call.cancel()
+            return result
+        return d.addBoth(on_done)
 
     def write(self, message):
+        """ Write to the connection. Writes made while it is being opened
+        are queued (the oldest are dropped if the queue is full) and sent
+        once it's connected.
+
+        """
+        if self.protocol is not None and not self.connected:
+            queue = self.queue
+            if len(queue) == queue.maxlen:
+                log.warning("board | Write queue full, dropping oldest")
+            queue.append(message)
+            return 0
+        self.stats.sent(len(message))
         return self.connection.write(message)
 
     @inlineCallbacks
@@ -326,18 +894,29 @@ class Board(Model):
         i = 0
         n = len(message)
         total = max(1, n)
-        while True:
-            wrote = min(n-i, bufsize)
-            data = message[i:i+wrote]
-            if not data:
-                break
-            i += wrote
-            self.write(data)
-            if callback is not None:
-                callback(100*i/total)
-            yield async_sleep(sleep)
+        with self.stats.measure('write_in_chunks', n) as m:
+            while True:
+                if not self.connected:
+                    raise ConnectionLost()
+                wrote = min(n-i, bufsize)
+                data = message[i:i+wrote]
+                if not data:
+                    break
+                i += wrote
+                self.write(data)
+                if callback is not None:
+                    callback(100*i/total)
+                yield async_sleep(sleep)
+                m.idle += sleep/1000.0
 
     def disconnect(self):
+        self.cancel_reconnect()
+        self.protocol = None
+        self.connected = False
+        self.queue.clear()
+        waiters, self.waiters = self.waiters, []
+        for d in waiters:
+            d.errback(ConnectionLost("Disconnected"))
         return self.connection.disconnect()
 
 
@@ -355,6 +934,14 @@ class QueryProtocol(LineReceiver):
         self.request = None
         self.callback = callback
         self.active = True
+        self.lines = []
+        self.waiters = []
+
+        #: Timing of the current query
+        self.sent_at = 0
+        self.first_at = None
+        self.last_at = None
+        self.received = 0
 
     def ready(self):
         return self.connect_event
@@ -362,7 +949,47 @@ class QueryProtocol(LineReceiver):
     def connectionMade(self):
         self.lines = []
         #: If websocket we have to wait for the password first
-        self.connect_event.callback(True)
+        if not self.connect_event.called:
+            self.connect_event.callback(True)
+
+    def connectionLost(self, reason):
+        """ Fail anything waiting on the board so it doesn't hang. If the
+        board reconnects the protocol can be used again.
+
+        """
+        self.connect_event = Deferred()
+        self.clearLineBuffer()
+        lines, self.lines = self.lines, []
+        d, self.request = self.request, None
+        if d is not None:
+            d.errback(ConnectionLost(lines=lines))
+        waiters, self.waiters = self.waiters, []
+        for d, prefixes in waiters:
+            d.errback(ConnectionLost(lines=lines))
+
+    def wait_for(self, *prefixes, **kwargs):
+        """ Return a deferred that fires with the first line received that
+        starts with any of the given prefixes.
+
+        """
+        timeout = kwargs.get('timeout')
+        d = Deferred()
+        waiter = (d, prefixes)
+        self.waiters.append(waiter)
+        if timeout:
+            def on_timeout():
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                    d.errback(IOError("Timeout waiting for {}".format(
+                        prefixes)))
+            call = reactor.callLater(timeout, on_timeout)
+
+            def on_done(result):
+                if call.active():
+                    call.cancel()
+                return result
+            d.addBoth(on_done)
+        return d
 
     @inlineCallbacks
     def login(self):
@@ -373,34 +1000,66 @@ class QueryProtocol(LineReceiver):
         yield self.ready()
 
         #: Then wait for the password prompt
-        yield async_sleep(300)
-        log.debug(self._buffer)
+        with self.plugin.board.stats.measure('login') as m:
+            yield async_sleep(300)
+            m.idle = 0.3
+        transport_log.debug("login | %r", self._buffer)
         if 'Password:' in self._buffer.decode():
             #: Hack
             yield self.plugin.show_password_prompt()
 
+    def dataReceived(self, data):
+        self.received += len(data)
+        self.plugin.board.stats.received(len(data))
+        super(QueryProtocol, self).dataReceived(data)
+
     def lineReceived(self, line):
-        log.debug(line)
+        transport_log.debug("rx | %r", line)
         text = line.decode()
         self.lines.append(text)
         if self.request:
+            now = time.perf_counter()
+            if self.first_at is None:
+                self.first_at = now
+            self.last_at = now
             self.pending += 1
-            timed_call(self.timeout, self.finish)
+            reactor.callLater(self.timeout/1000.0, self.finish, self.request)
+        for waiter in self.waiters[:]:
+            d, prefixes = waiter
+            if text.startswith(prefixes):
+                self.waiters.remove(waiter)
+                d.callback(text)
         if self.callback:
             try:
                 self.callback(text)
             except Exception as e:
                 log.exception(e)
 
-    def finish(self):
+    def finish(self, request):
+        if request is not self.request:
+            return  #: Request was lost
         self.pending -= 1
         if self.pending == 0:
             lines = self.lines[:]
             self.lines = []
             d = self.request
             self.request = None
+            self.record_query()
             d.callback(lines)
 
+    def record_query(self):
+        """ Record the time until the first line (rtt), between the first
+        and last line (device) and waiting for more after the last (idle).
+
+        """
+        now = time.perf_counter()
+        first, last = self.first_at, self.last_at
+        self.plugin.board.stats.record(
+            'query', now - self.sent_at, self.received,
+            idle=now - last if last else 0,
+            device=last - first if first else 0,
+            rtt=first - self.sent_at if first else None)
+
     def query(self, msg, raw=False, timeout=None):
         """ Send a command and wait for it to reply
         :param msg:
@@ -426,6 +1085,10 @@ class QueryProtocol(LineReceiver):
 
         if not raw and not msg.endswith(b'\r\n'):
             msg += b'\r\n'
+        self.sent_at = time.perf_counter()
+        self.first_at = self.last_at = None
+        self.received = len(msg)
+        self.plugin.board.stats.sent(len(msg))
         self.transport.write(msg)
         return self.request
 
@@ -435,13 +1098,13 @@ class BoardPlugin(Plugin):
     #: Active board
     board = Instance(Board, ()).tag(config=True)
 
-    #: Module index
-    modules = Dict().tag(config=True)
+    #: Module index (loaded from the cache store when first used)
+    modules = Dict()
     indexing_progress = Int()
     indexing_status = Str()
 
-    #: Files on device
-    files = Dict().tag(config=True)
+    #: Files on device (loaded from the cache store when first used)
+    files = Dict()
     scanning_progress = Int()
     scanning_status = Str()
 
@@ -451,9 +1114,237 @@ class BoardPlugin(Plugin):
     #: Passwords
     passwords = Dict().tag(config=True)
 
+    #: Times to resume a transfer if the connection drops and how long to
+    #: wait for it to reconnect each time (in seconds)
+    resume_attempts = Int(5)
+    resume_timeout = Float(60)
+
+    #: Capture of everything received by the monitor
+    capture = Instance(StreamCapture)
+    capture_enabled = Bool(True).tag(config=True)
+    capture_size = Int(64).tag(config=True)  #: Total size in MB
+
+    #: When to connect to a board that is plugged in
+    auto_connect = Enum('off', 'same', 'any').tag(config=True)
+
+    #: Fired with the port when a board should be connected to
+    port_attached = Event()
+
+    #: Decodes samples for the telemetry plot
+    telemetry = Instance(Telemetry, ()).tag(config=True)
+
+    #: Heap and function timing samples from the device
+    profiler = Instance(DeviceProfiler, ()).tag(config=True)
+
+    #: Compile modules with mpy-cross before uploading them, the target
+    #: architecture (for native code) and any other mpy-cross flags
+    compile_mpy = Bool(False).tag(config=True)
+    mpy_arch = Enum(*MPY_ARCHS).tag(config=True)
+    mpy_flags = Str().tag(config=True)
+
+    #: Compiler for the current settings (created when needed)
+    compiler = Instance(MpyCompiler)
+
+    #: Compress serial uploads if the board can decompress them
+    compress_uploads = Bool(True).tag(config=True)
+
+    #: Keeps the module index and file tree out of the config
+    store = Instance(CacheStore)
+
+    def _default_store(self):
+        return CacheStore(os.path.expanduser('~/.config/micropyde/cache.db'))
+
+    def _default_modules(self):
+        try:
+            return self.store.load_modules()
+        except Exception as e:
+            log.warning("Failed to load the module index: {}".format(e))
+            return {}
+
+    def _default_files(self):
+        try:
+            return self.store.load_files()
+        except Exception as e:
+            log.warning("Failed to load the file tree: {}".format(e))
+            return {}
+
+    def __setstate__(self, state):
+        """ Older versions kept the module index and file tree in the
+        config so move them into the store.
+
+        """
+        for name, save in (('modules', self.store.save_modules),
+                           ('files', self.store.save_files)):
+            value = state.pop(name, None)
+            if value:
+                try:
+                    save(value)
+                except Exception as e:
+                    log.warning("Failed to move {} to the store: {}".format(
+                        name, e))
+        super(BoardPlugin, self).__setstate__(state)
+
+    def _default_capture(self):
+        path = os.path.expanduser('~/.config/micropyde/capture')
+        segments = 8
+        segment_size = max(1, self.capture_size*1024*1024//segments)
+        return StreamCapture(path, segment_size=segment_size,
+                             segments=segments)
+
+    @observe('mpy_arch', 'mpy_flags')
+    def _reset_compiler(self, change):
+        if change['type'] == 'update':
+            self.compiler = None
+
+    def get_compiler(self):
+        """ Return the compiler or None if mpy-cross can't be found """
+        if self.compiler is None:
+            editor = self.workbench.get_plugin("micropyde.editor")
+            executable = find_mpy_cross(editor.upy_path)
+            if executable is None:
+                return None
+            self.compiler = MpyCompiler(
+                executable,
+                cache_dir=os.path.expanduser('~/.config/micropyde/mpy'),
+                arch=self.mpy_arch,
+                flags=self.mpy_flags.split())
+        return self.compiler
+
+    def _observe_capture_size(self, change):
+        if change['type'] == 'update' and self.capture:
+            segments = self.capture.segments
+            self.capture.segment_size = max(
+                1, self.capture_size*1024*1024//segments)
+
+    def start(self):
+        super(BoardPlugin, self).start()
+        monitor = PortMonitor.instance()
+        monitor.observe('ports', self._on_ports_changed)
+        monitor.observe('added', self._on_port_added)
+        monitor.start()
+
+    def stop(self):
+        super(BoardPlugin, self).stop()
+        monitor = PortMonitor.instance()
+        monitor.unobserve('ports', self._on_ports_changed)
+        monitor.unobserve('added', self._on_port_added)
+        monitor.stop()
+        if self.capture:
+            self.capture.close()
+        self.profiler.close()
+
+    def _on_ports_changed(self, change):
+        """ Update the available connections when a device is plugged in
+        or removed
+
+        """
+        self.board.refresh_connections()
+
+    def _on_port_added(self, change):
+        """ Reattach to a board when it is plugged in (or comes back after
+        a reset) according to the auto connect policy.
+
+        """
+        port = change['value']
+        connection = self.board.connection
+        if (self.auto_connect == 'off' or
+                not isinstance(connection, SerialConnection)):
+            return
+        if self.auto_connect == 'same':
+            key = connection.port_key
+            if key != port_key(port) and (key or
+                                          connection.port != port.device):
+                return
+        log.info("Auto connecting to {}".format(port.device))
+        self.port_attached(port)
+
+    # -------------------------------------------------------------------------
+    # Monitor API
+    # -------------------------------------------------------------------------
+    def stream_received(self, data):
+        """ Called by the monitor with the raw data from the device """
+        self.board.stats.received(len(data))
+        if self.capture_enabled:
+            try:
+                self.capture.write(data)
+            except Exception as e:
+                log.warning("Failed to capture monitor output: {}".format(e))
+                self.capture_enabled = False
+        try:
+            self.telemetry.feed(data)
+        except Exception as e:
+            log.warning("Failed to decode telemetry: {}".format(e))
+            self.telemetry.reset()
+        if self.profiler.running:
+            try:
+                self.profiler.feed(data)
+            except Exception as e:
+                log.warning("Failed to parse profiler samples: {}".format(e))
+
+    def show_history(self, event):
+        """ Show the captured monitor history """
+        HistoryDialog = load_enaml('micropyde.board.dialogs', 'HistoryDialog')
+        ui = self.workbench.get_plugin("micropyde.ui")
+        HistoryDialog(ui.get_dock_area(), plugin=self).show()
+
     # -------------------------------------------------------------------------
     # Board API
     # -------------------------------------------------------------------------
+    @inlineCallbacks
+    def download(self, path, status=None):
+        """ Download a file from the board. If the connection drops the
+        download continues from the last data received once it reconnects.
+
+        Parameters
+        ----------
+            path: str
+                Path of the file on the board
+            status: callable or None
+                Called with status messages
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires with the contents of the file
+
+        """
+        status = status or log.info
+        board = self.board
+        board.disconnect()
+        device = QueryProtocol(self)
+        yield board.connect(device)
+        if isinstance(board.connection, WebsocketConnection):
+            data = yield self.transfer_webrepl(
+                device, lambda c: c.get_file(path), status)
+            return data
+
+        data = []
+        received = 0
+        attempts = 0
+        while True:
+            yield device.login()
+            status("Downloading {}...".format(path))
+            code = DOWNLOAD_TEMPLATE.format(path=path, offset=received)
+            try:
+                lines = yield device.query(
+                    b'\n\x05' + code.encode() + b'\x04', timeout=1000)
+                complete = True
+            except ConnectionLost as e:
+                lines = e.lines
+                complete = False
+            chunk = decode_download(lines)
+            data.append(chunk)
+            received += len(chunk)
+            if complete:
+                if not received:
+                    raise IOError("Failed to download file: '%s'" % lines)
+                return b''.join(data)
+            attempts += 1
+            if attempts > self.resume_attempts:
+                raise ConnectionLost()
+            status("Connection lost, resuming from {}...".format(received))
+            yield board.wait_for_connection(self.resume_timeout)
+
     @inlineCallbacks
     def download_file(self, event):
         """ Download a file from tne board
@@ -463,52 +1354,229 @@ class BoardPlugin(Plugin):
         editor = self.workbench.get_plugin("micropyde.editor")
 
         log.info("Download file from device '%s'..." % path)
+        try:
+            with self.board.stats.measure('download_file') as m:
+                data = yield self.download(path)
+                m.bytes = len(data)
+        except IOError as e:
+            log.warning(e)
+            return
+        download_path = os.path.join(editor.project_path, path)
+        with open(download_path, 'wb') as f:
+            f.write(data)
 
-        # Connect
+        core = self.workbench.get_plugin('enaml.workbench.core')
+        core.invoke_command("micropyde.editor.open_file",
+                            parameters={'path': download_path})
+
+    @inlineCallbacks
+    def upload(self, filename, source, progress=None, status=None):
+        """ Upload the source to the filename on the board. The board
+        writes to a temporary file and only replaces the file once the hash
+        is verified. If the connection drops the upload continues from
+        what the board has written once it reconnects.
+
+        Parameters
+        ----------
+            filename: str
+                Path of the file on the board
+            source: bytes
+                Contents of the file
+            progress: callable or None
+                Called with the percent complete
+            status: callable or None
+                Called with each line received from the board
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires with whether the upload succeeded
+
+        """
+        status = status or transport_log.debug
+        progress = progress or (lambda percent: None)
+        board = self.board
+        board.disconnect()
+
+        session = QueryProtocol(self)
+        session.callback = lambda text: status(text[0:200])
+        yield board.connect(session)
+        if isinstance(board.connection, WebsocketConnection):
+            yield self.transfer_webrepl(
+                session, lambda c: c.put_file(filename, source, progress),
+                status)
+            return True
+
+        expected_hash = hashlib.sha256(source).hexdigest()
+        log.info("Expected Hash: {}".format(expected_hash))
+        payload = None
+        resume = False
+        attempts = 0
+        while True:
+            started = done = None
+            try:
+                yield session.login()
+                if payload is None:
+                    payload, template = yield self.encode_upload(
+                        session, filename, source, expected_hash)
+                    total = max(1, len(payload))
+                uploader = template.format(resume=resume).encode()
+                started = session.wait_for('Offset:', timeout=30)
+                board.write(b'\x03\n\x05')
+                yield async_sleep(10)
+                status("Sending uploader...")
+                yield board.write_in_chunks(uploader)
+                board.write(b'\n\x04')
+                offset = int((yield started).split(':')[-1])
+                if offset:
+                    log.info("Resuming upload at {}".format(offset))
+                done = session.wait_for('Upload success', 'Upload failed')
+                remaining = len(payload) - offset
+
+                def on_progress(percent, offset=offset):
+                    progress(100*(offset + remaining*percent/100)/total)
+
+                yield board.write_in_chunks(payload[offset:],
+                                            callback=on_progress)
+                result = yield done
+                return result.startswith('Upload success')
+            except ConnectionLost:
+                for d in (started, done):
+                    if d is not None:
+                        d.addErrback(lambda f: None)  #: Lost with the attempt
+                attempts += 1
+                if attempts > self.resume_attempts:
+                    raise
+                status("Connection lost, waiting to resume...")
+                yield board.wait_for_connection(self.resume_timeout)
+                resume = True
+
+    @inlineCallbacks
+    def encode_upload(self, session, filename, source, expected_hash):
+        """ Choose how to send the source. Compressed uploads are base64
+        encoded and decompressed by the board. Anything that can't be sent
+        through the REPL as is (ex .mpy files) is base64 encoded.
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires with the data to send and the
+                uploader (with `resume` left to fill in)
+
+        """
+        method = None
+        data = source
+        if self.compress_uploads:
+            method = yield self.get_decompressor(session)
+        if method:
+            c = zlib.compressobj(9, zlib.DEFLATED, DEFLATE_WBITS)
+            compressed = c.compress(source) + c.flush()
+            if len(compressed) < 0.9*len(source):
+                data = compressed
+                log.info("Compressed {} to {} bytes".format(
+                    len(source), len(data)))
+            else:
+                method = None
+        if method is None and not UNSAFE_PATTERN.search(source):
+            uploader = UPLOAD_TEMPLATE.format(
+                filename=filename, expected_hash=expected_hash,
+                size=len(source), resume='{resume}')
+            return source, uploader
+        uploader = ENCODED_UPLOAD_TEMPLATE.format(
+            filename=filename, expected_hash=expected_hash,
+            size=len(source), datasize=len(data), method=method,
+            wbits=DEFLATE_WBITS, resume='{resume}')
+        return b2a_base64(data, newline=False), uploader
+
+    @inlineCallbacks
+    def get_decompressor(self, session):
+        """ Find which module the board can decompress uploads with. It's
+        only checked once per connection.
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires with the module name or None
+
+        """
+        features = self.board.features
+        if 'decompress' not in features:
+            board = self.board
+            found = session.wait_for('Decompress:', timeout=10)
+            board.write(b'\x03\n\x05')
+            yield async_sleep(10)
+            yield board.write_in_chunks(DECOMPRESS_QUERY.encode())
+            board.write(b'\n\x04')
+            try:
+                line = yield found
+            except ConnectionLost:
+                raise
+            except IOError as e:
+                log.warning("Could not check for decompression: {}".format(e))
+                return None
+            method = line.split(':')[-1].strip()
+            features['decompress'] = None if method == 'None' else method
+            log.info("Board decompresses uploads with: {}".format(
+                features['decompress']))
+        return features['decompress']
+
+    @inlineCallbacks
+    def transfer_webrepl(self, session, transfer, status):
+        """ Run a file transfer using the WebREPL binary protocol. It's far
+        faster than going through the REPL but can't resume at an offset,
+        so if the connection drops the transfer is restarted once it
+        reconnects.
+
+        """
+        board = self.board
+        attempts = 0
+        while True:
+            try:
+                yield session.login()
+                status("Transferring using the WebREPL file protocol...")
+                result = yield transfer(board.connection)
+                return result
+            except ConnectionLost:
+                attempts += 1
+                if attempts > self.resume_attempts:
+                    raise
+                status("Connection lost, waiting to retry...")
+                yield board.wait_for_connection(self.resume_timeout)
+
+    @inlineCallbacks
+    def remove(self, path):
+        """ Remove a file from the board
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires with whether the file existed
+
+        """
         board = self.board
         board.disconnect()
         device = QueryProtocol(self)
         yield board.connect(device)
         yield device.login()
-        log.info("Downloading...")
-        result = yield device.query(b'\n\x05' + textwrap.dedent("""
-            def __downloader__():
-                import sys
-                from ubinascii import b2a_base64
-                f = open('{path}', 'rb')
-                while True:
-                    d = f.read(256)
-                    if not d:
-                        break
-                    sys.stdout.write(b2a_base64(d))
-                f.close()
-            __downloader__()""".format(
-                path=path
-        )).encode() + b'\x04', timeout=1000)
+        code = REMOVE_TEMPLATE.format(path=path)
+        lines = yield device.query(
+            b'\n\x05' + code.encode() + b'\x04', timeout=1000)
+        return any(line.startswith('Removed') for line in lines)
 
-        log.info(result)
-        source = []
-        start, end = 0, -1
-        for i, line in enumerate(result):
-            if "__downloader__" in line:
-                start = i+1
-            elif line.startswith(">>>"):
-                end = i
-        source = result[start:end]
-
-        if not source:
-            log.warning("Failed to download file: '%s'" % result)
+    @inlineCallbacks
+    def compile_project(self, event):
+        """ Compile every module in the project so uploads use the cache """
+        compiler = self.get_compiler()
+        if compiler is None:
+            log.warning("mpy-cross was not found, build it in the "
+                        "micropython source or add it to the PATH")
             return
-        download_path = os.path.join(editor.project_path, path)
-        with open(download_path, 'wb') as f:
-            for chunk in source:
-                log.info(chunk)
-                data = b64decode(chunk)
-                f.write(data)
-
-        core = self.workbench.get_plugin('enaml.workbench.core')
-        core.invoke_command("micropyde.editor.open_file",
-                            parameters={'path': download_path})
+        editor = self.workbench.get_plugin("micropyde.editor")
+        paths = []
+        for root, dirs, files in os.walk(editor.project_path):
+            paths.extend(os.path.join(root, f) for f in files)
+        compiled = yield compiler.compile_all(paths)
+        log.info("Compiled {} modules".format(len(compiled)))
 
     @inlineCallbacks
     def upload_file(self, event):
@@ -516,10 +1584,24 @@ class BoardPlugin(Plugin):
         path = editor.active_document.name
         with open(path, 'rb') as f:
             source = f.read()
+        filename = os.path.split(path)[-1]
+        stale = None
+        if self.compile_mpy and should_compile(filename):
+            compiler = self.get_compiler()
+            if compiler is None:
+                log.warning("mpy-cross was not found, uploading the source")
+            else:
+                try:
+                    source = yield compiler.compile(path, source)
+                except SyntaxError as e:
+                    log.warning(e)
+                    return
+                #: The board imports a .py before a .mpy so remove it
+                stale = filename
+                filename = filename[:-3] + '.mpy'
         log.info("Uploading {} to board...".format(path))
 
-        with enaml.imports():
-            from .dialogs import ProgressDialog
+        ProgressDialog = load_enaml('micropyde.board.dialogs', 'ProgressDialog')
         ui = self.workbench.get_plugin("micropyde.ui")
         dialog = ProgressDialog(
             ui.get_dock_area(),
@@ -528,42 +1610,20 @@ class BoardPlugin(Plugin):
             heading=f"Uploading {path} to board...",
             status="Connecting...")
         dialog.show()
-        try:
-            board = self.board
-            board.disconnect()
-
-            session = QueryProtocol(self)
-
-            def line_received(text):
-                dialog.status = text[0:200]
-
-            session.callback = line_received
-            yield board.connect(session)
-            yield session.login()
 
-            hash = hashlib.sha256()
-            hash.update(source)
-            expected_hash = hash.hexdigest()
-            log.info("Expected Hash: {}".format(expected_hash))
+        def on_status(text):
+            dialog.status = text
 
-            uploader = UPLOAD_TEMPLATE.format(
-                filename=os.path.split(path)[-1],
-                expected_hash=expected_hash,
-                size=len(source)
-            ).encode()
-
-            def on_progress(percent):
-                dialog.progress = percent
-
-            board.write(b'\x03\n\x05')
-            yield async_sleep(10)
-            dialog.status = "Sending uploader..."
-            yield board.write_in_chunks(uploader, callback=on_progress)
-            board.write(b'\n\x04')
-            yield async_sleep(100)
-            dialog.status = "Uploading..."
-            yield board.write_in_chunks(source, callback=on_progress)
+        def on_progress(percent):
+            dialog.progress = percent
 
+        try:
+            with self.board.stats.measure('upload_file', len(source)):
+                ok = yield self.upload(filename, source,
+                                       progress=on_progress, status=on_status)
+            if ok and stale:
+                yield self.remove(stale)
+            dialog.status = "Upload complete" if ok else "Upload failed"
         except Exception as e:
             log.exception(e)
             dialog.status = f'Upload error {traceback.format_exc()}'
@@ -573,6 +1633,7 @@ class BoardPlugin(Plugin):
         #: Open the port and let it read
         editor = self.workbench.get_plugin("micropyde.editor")
         terminal = editor.get_terminal()
+        terminal.loaded = True
         if not terminal.opened:
             terminal.toggle_port()
 
@@ -583,6 +1644,7 @@ class BoardPlugin(Plugin):
     # -------------------------------------------------------------------------
     # Modules API
     # -------------------------------------------------------------------------
+    @measured('build_index')
     @inlineCallbacks
     def build_index(self, event):
         log.info("build index")
@@ -642,6 +1704,7 @@ class BoardPlugin(Plugin):
         self.indexing_progress = 100
         self.indexing_status = "Done!"
         self.modules = index
+        yield deferToThread(self.store.save_modules, index)
 
     # def _default_modules(self):
     #     """ Try to load module index from the cache """
@@ -661,9 +1724,56 @@ class BoardPlugin(Plugin):
     #         except Exception as e:
     #             log.info("Failed to save module index: {}".format(e))
 
+    # -------------------------------------------------------------------------
+    # Profiler API
+    # -------------------------------------------------------------------------
+    @inlineCallbacks
+    def start_profiling(self, event):
+        """ Load the sampler on the device and collect samples. With a
+        timer on the device samples keep coming while code runs and are
+        read from the monitor once it's reopened, otherwise the sampler is
+        polled while the REPL is idle.
+
+        """
+        profiler = self.profiler
+        board = self.board
+        board.disconnect()
+        session = QueryProtocol(self, callback=profiler.line_received)
+        yield board.connect(session)
+        profiler.status = "Connecting..."
+        yield session.login()
+        profiler.open(board.connection.name)
+        yield session.query(
+            b'\r\n\x05'+profiler.sampler_script().encode()+b'\x04',
+            raw=True)
+        if profiler.timer:
+            profiler.status = "Sampling every {}ms".format(profiler.interval)
+        else:
+            profiler.status = "Polling every {}ms".format(profiler.interval)
+        try:
+            while profiler.running and board.protocol is session:
+                if not profiler.timer:
+                    yield session.query(b'_mpyprof.sample()')
+                yield async_sleep(profiler.interval)
+        except ConnectionLost:
+            pass
+        if profiler.running and not profiler.timer:
+            profiler.status = "Paused while the REPL is in use"
+
+    def stop_profiling(self, event):
+        """ Stop the device timer and close the history """
+        profiler = self.profiler
+        if not profiler.running:
+            return
+        if profiler.timer and self.board.connected:
+            self.board.write(b'\r\n_mpyprof.stop()\r\n')
+        profiler.close()
+        profiler.status = "Stopped"
+
     # -------------------------------------------------------------------------
     # File Browser API
     # -------------------------------------------------------------------------
+    @measured('scan_files')
     @inlineCallbacks
     def scan_files(self, event):
         excluded = ['http_server',
@@ -706,6 +1816,7 @@ class BoardPlugin(Plugin):
         if not contents:
             return
         self.files = contents
+        yield deferToThread(self.store.save_files, contents)
 
     def save_password(self, pwd):
         """ Save the password for the current connection """
@@ -716,8 +1827,7 @@ class BoardPlugin(Plugin):
         """ Probably shouldn't go here but whatever """
         d = Deferred()
         ui = self.workbench.get_plugin('micropyde.ui')
-        with enaml.imports():
-            from .dialogs import PasswordDialog
+        PasswordDialog = load_enaml('micropyde.board.dialogs', 'PasswordDialog')
 
         board = self.board
 
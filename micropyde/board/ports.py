@@ -0,0 +1,245 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import sys
+import socket
+from atom.api import Atom, Bool, Dict, Event, Float, List, Value
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.interfaces import IReadDescriptor
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+from zope.interface import implementer
+from micropyde.core.utils import log
+
+#: Netlink protocol the kernel sends device events on
+NETLINK_KOBJECT_UEVENT = 15
+
+#: Subsystems of devices that may be serial ports
+SERIAL_SUBSYSTEMS = (b'tty', b'usb-serial')
+
+
+def port_key(port):
+    """ Return a key that identifies the board on the port. USB devices are
+    identified by VID:PID and serial number (or the USB location if there
+    isn't one) so a board keeps the same key if it comes back under a
+    different device path.
+
+    """
+    if port.vid is None:
+        return port.device
+    key = "{:04X}:{:04X}:{}".format(port.vid, port.pid or 0,
+                                    port.serial_number or port.location)
+    #: Keep each interface of multi-port adapters separate
+    location = port.location or ''
+    if ':' in location:
+        key += ":" + location.split(':')[-1]
+    return key
+
+
+@implementer(IReadDescriptor)
+class UeventReader(object):
+    """ Reads kernel device events from a netlink socket so the reactor
+    is notified when a serial device is added or removed (Linux only).
+
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                    NETLINK_KOBJECT_UEVENT)
+        self.socket.setblocking(False)
+        self.socket.bind((0, 1))
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def doRead(self):
+        while True:
+            try:
+                data = self.socket.recv(16384)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.parse(data)
+
+    def parse(self, data):
+        """ Parse an event of the form "action@devpath\\0KEY=value\\0..." and
+        notify the callback if it's for a serial device.
+
+        """
+        fields = data.split(b'\0')
+        event = {}
+        for field in fields[1:]:
+            key, sep, value = field.partition(b'=')
+            if sep:
+                event[key] = value
+        if event.get(b'SUBSYSTEM') in SERIAL_SUBSYSTEMS:
+            self.callback(event.get(b'ACTION', b'').decode(),
+                          event.get(b'DEVPATH', b'').decode())
+
+    def connectionLost(self, reason):
+        self.socket.close()
+
+    def logPrefix(self):
+        return 'uevent'
+
+
+class PortMonitor(Atom):
+    """ Keeps a live registry of the serial ports. Listing ports can be slow
+    so it's done in a thread and only repeated when the kernel reports
+    a device was added or removed. If device events are not supported the
+    ports are polled instead.
+
+    """
+    #: Singleton instance
+    _instance = None
+
+    #: Cached list of comports with duplicates removed
+    ports = List()
+
+    #: Ports by the key of the board connected to them
+    registry = Dict()
+
+    #: Fired with the port when a board is plugged in or removed
+    added = Event()
+    removed = Event()
+
+    #: Interval in seconds to poll when device events are unavailable
+    poll_interval = Float(2.0)
+
+    #: Polling loop
+    poller = Value()
+
+    #: Whether ports have been listed at least once
+    loaded = Bool()
+
+    #: Whether device events are being received
+    watching = Bool()
+
+    #: Device event reader
+    reader = Value()
+
+    #: Deferreds waiting on the listing in progress
+    waiters = List()
+
+    #: Delayed call to refresh after a device event
+    delayed = Value()
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def _default_ports(self):
+        self.refresh()
+        return []
+
+    def start(self):
+        """ Start listening for device events or polling if they are not
+        supported on this platform.
+
+        """
+        if self.reader is not None or self.poller is not None:
+            return
+        if sys.platform.startswith('linux'):
+            try:
+                self.reader = UeventReader(self.on_event)
+                reactor.addReader(self.reader)
+                self.watching = True
+                return
+            except (OSError, AttributeError) as e:
+                log.debug("ports | Device events unavailable: {}".format(e))
+                self.reader = None
+        self.poller = LoopingCall(self.refresh)
+        self.poller.start(self.poll_interval, now=False)
+
+    def stop(self):
+        if self.delayed is not None and self.delayed.active():
+            self.delayed.cancel()
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+        if self.reader is not None:
+            reactor.removeReader(self.reader)
+            self.reader.connectionLost(None)
+            self.reader = None
+        self.watching = False
+
+    def on_event(self, action, devpath):
+        """ Refresh shortly after a device event. Events come in bursts and
+        the device node may not exist yet so wait for them to settle.
+
+        """
+        log.debug("ports | {} {}".format(action, devpath))
+        if self.delayed is not None and self.delayed.active():
+            self.delayed.reset(0.5)
+        else:
+            self.delayed = reactor.callLater(0.5, self.refresh)
+
+    def get_ports(self):
+        """ Return a deferred that fires with the list of ports. If the
+        cache is kept up to date by device events it's used as is.
+
+        """
+        if self.loaded and (self.watching or self.poller is not None):
+            return succeed(self.ports)
+        return self.refresh()
+
+    def refresh(self):
+        """ List the ports in a thread. Requests made while the listing is
+        in progress share the result.
+
+        """
+        d = Deferred()
+        self.waiters.append(d)
+        if len(self.waiters) == 1:
+            from serial.tools.list_ports import comports
+            deferToThread(comports).addCallbacks(self._on_ports,
+                                                 self._on_error)
+        return d
+
+    def find(self, key):
+        """ Return the port the board with the given key is on (if any) """
+        return self.registry.get(key)
+
+    def key_for(self, device):
+        """ Return the key of the board on the given device path """
+        for key, port in self.registry.items():
+            if port.device == device:
+                return key
+        return ""
+
+    def _on_ports(self, ports):
+        registry = {}
+        for port in sorted(ports, key=lambda p: p.device):
+            #: Skip aliases of the same device (ex cu.* and tty.* on osx)
+            registry.setdefault(port_key(port), port)
+        last = self.registry
+        self.registry = registry
+        self.ports = sorted(registry.values(), key=lambda p: p.device)
+
+        if self.loaded:
+            for key in set(last) - set(registry):
+                log.debug("ports | Removed {}".format(key))
+                self.removed(last[key])
+            for key in set(registry) - set(last):
+                log.debug("ports | Added {}".format(key))
+                self.added(registry[key])
+        self.loaded = True
+        waiters, self.waiters = self.waiters, []
+        for d in waiters:
+            d.callback(self.ports)
+
+    def _on_error(self, failure):
+        log.warning("ports | Failed to list ports: {}".format(
+            failure.getErrorMessage()))
+        waiters, self.waiters = self.waiters, []
+        for d in waiters:
+            d.callback(self.ports)
@@ -0,0 +1,348 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Samples the heap and the time spent in decorated functions on the device.
+The sampler is injected into the REPL and prints a tagged line for each
+sample which is parsed here, plotted and appended to a history file per
+board.
+
+Functions are timed by decorating them with `profile`, which is defined in
+the REPL globals and as the `mpyprof` module while the sampler is loaded:
+
+    try:
+        from mpyprof import profile
+    except ImportError:
+        profile = lambda f: f
+
+    @profile
+    def read_sensor():
+        ...
+
+@author: jrm
+"""
+import os
+import re
+import ast
+import json
+import time
+from collections import deque
+from atom.api import Atom, Bool, Dict, Enum, Float, Instance, Int, Str, Value
+from micropyde.core.api import Model, log
+from .telemetry import RingBuffer
+
+#: Injected through the query session, period is zero when the host polls
+SAMPLER_TEMPLATE = """
+import gc
+import time
+try:
+    import micropython
+except ImportError:
+    micropython = None
+try:
+    _mpyprof.stop()
+except NameError:
+    pass
+
+class _mpyprof:
+    stats = {{}}
+    timer = None
+    mem_info = {mem_info}
+
+    def profile(f):
+        name = f.__name__
+        def wrapper(*args, **kwargs):
+            t = time.ticks_us()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                dt = time.ticks_diff(time.ticks_us(), t)
+                s = _mpyprof.stats.get(name)
+                if s is None:
+                    _mpyprof.stats[name] = [1, dt, dt]
+                else:
+                    s[0] += 1
+                    s[1] += dt
+                    if dt > s[2]:
+                        s[2] = dt
+        return wrapper
+
+    def sample(*args):
+        stats, _mpyprof.stats = _mpyprof.stats, {{}}
+        print('PROF', (time.ticks_ms(), gc.mem_free(), gc.mem_alloc(), stats))
+        if _mpyprof.mem_info and micropython:
+            micropython.mem_info()
+        print('PROF_END')
+
+    def start(period):
+        if period and micropython:
+            try:
+                from machine import Timer
+                try:
+                    t = Timer(-1)
+                except Exception:
+                    t = Timer(0)
+                t.init(period=period, mode=Timer.PERIODIC,
+                       callback=lambda t: micropython.schedule(
+                           _mpyprof.sample, 0))
+                _mpyprof.timer = t
+            except Exception:
+                pass
+        print('PROF_READY', 1 if _mpyprof.timer else 0)
+
+    def stop():
+        if _mpyprof.timer:
+            _mpyprof.timer.deinit()
+            _mpyprof.timer = None
+
+import sys
+sys.modules['mpyprof'] = _mpyprof
+profile = _mpyprof.profile
+_mpyprof.start({period})
+"""
+
+#: Columns of each sample
+COLUMNS = ('time', 'mem_free', 'mem_alloc', 'max_free', 'stack')
+
+#: Lines of micropython.mem_info()
+MAX_FREE_PATTERN = re.compile(r'max free sz: (\d+)')
+STACK_PATTERN = re.compile(r'stack: (\d+)')
+
+
+def parse_sample(text):
+    """ Parse a line printed by the sampler
+
+    Returns
+    -------
+        sample: dict
+            The device ticks (ms), heap free and allocated (bytes) and the
+            calls, total and max time (us) of each function
+
+    """
+    ticks, free, alloc, stats = ast.literal_eval(text[len('PROF '):])
+    return {
+        'time': time.time(),
+        'ticks': ticks,
+        'mem_free': free,
+        'mem_alloc': alloc,
+        'max_free': 0,
+        'stack': 0,
+        'functions': stats,
+    }
+
+
+class FunctionStats(Atom):
+    """ Totals for one decorated function """
+
+    name = Str()
+
+    #: Number of calls and the total and longest time (in us)
+    calls = Int()
+    total = Float()
+    max = Float()
+
+    @property
+    def mean(self):
+        return self.total/self.calls if self.calls else 0
+
+    def add(self, calls, total, longest):
+        self.calls += calls
+        self.total += total
+        self.max = max(self.max, longest)
+
+    def to_dict(self):
+        return {'calls': self.calls, 'total': self.total, 'max': self.max,
+                'mean': self.mean}
+
+
+class DeviceProfiler(Model):
+    """ Collects the samples printed by the sampler running on the device
+    and keeps a history of them for each board.
+
+    """
+
+    #: Sample with a timer on the device (which keeps sampling while code
+    #: is running) or poll it from the host while the REPL is idle
+    mode = Enum('timer', 'poll').tag(config=True)
+
+    #: Time between samples (in ms)
+    interval = Int(1000).tag(config=True)
+
+    #: Include micropython.mem_info() (largest free block and stack)
+    mem_info = Bool(True).tag(config=True)
+
+    #: Number of samples kept for plotting
+    capacity = Int(3600).tag(config=True)
+
+    #: History files are written here
+    history_dir = Str()
+
+    #: Set while sampling
+    running = Bool()
+
+    #: Whether the device timer is sampling (otherwise it's polled)
+    timer = Bool()
+
+    #: Board the history is for
+    board_name = Str()
+
+    #: Samples with the COLUMNS
+    buffer = Instance(RingBuffer)
+
+    #: Number of samples received, used to trigger redraws
+    count = Int()
+
+    #: Stats of each function by name
+    functions = Dict()
+
+    #: Last sample received
+    last = Dict()
+
+    status = Str()
+
+    #: Sample waiting for the end of the mem_info output
+    _pending = Value()
+
+    #: Partial line from the monitor
+    _remainder = Value(b'')
+
+    #: Open history file
+    _file = Value()
+
+    def _default_history_dir(self):
+        return os.path.expanduser('~/.config/micropyde/profiles')
+
+    def _default_buffer(self):
+        return RingBuffer(self.capacity, len(COLUMNS))
+
+    def sampler_script(self):
+        """ Return the script that loads the sampler on the device """
+        period = self.interval if self.mode == 'timer' else 0
+        return SAMPLER_TEMPLATE.format(period=period, mem_info=self.mem_info)
+
+    def history_path(self, name):
+        name = re.sub(r'[^\w.-]+', '_', name).strip('_') or 'board'
+        return os.path.join(self.history_dir, name + '.jsonl')
+
+    # -------------------------------------------------------------------------
+    # Sampling
+    # -------------------------------------------------------------------------
+    def open(self, name):
+        """ Load the history of the board and start appending to it """
+        self.close()
+        self.reset()
+        self.board_name = name
+        path = self.history_path(name)
+        try:
+            self.load_history(path)
+        except Exception as e:
+            log.warning("profiler | Failed to load {}: {}".format(path, e))
+        try:
+            if not os.path.exists(self.history_dir):
+                os.makedirs(self.history_dir)
+            self._file = open(path, 'a')
+        except OSError as e:
+            log.warning("profiler | History not saved: {}".format(e))
+        self.running = True
+
+    def close(self):
+        """ Stop sampling and close the history """
+        self.running = False
+        self.timer = False
+        self._pending = None
+        self._remainder = b''
+        f, self._file = self._file, None
+        if f is not None:
+            f.close()
+
+    def load_history(self, path):
+        """ Load the most recent samples from the history file """
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            lines = deque(f, maxlen=self.capacity)
+        for line in lines:
+            try:
+                self.add_sample(json.loads(line), save=False)
+            except (ValueError, KeyError):
+                continue
+
+    def feed(self, data):
+        """ Parse samples from data received by the monitor """
+        if not self.running:
+            return
+        lines = (self._remainder + data).split(b'\n')
+        self._remainder = lines.pop()[-4096:]
+        for line in lines:
+            self.line_received(line.decode(errors='replace'))
+
+    def line_received(self, text):
+        """ Parse a line from the device. A sample starts with a PROF line,
+        followed by the mem_info output (if enabled) and ends with PROF_END.
+
+        """
+        text = text.strip()
+        if text.startswith('PROF_END'):
+            self._finish()
+        elif text.startswith('PROF_READY'):
+            self.timer = text.split()[-1] == '1'
+        elif text.startswith('PROF '):
+            self._finish()
+            try:
+                self._pending = parse_sample(text)
+            except (ValueError, SyntaxError) as e:
+                log.debug("profiler | Invalid sample {!r}: {}".format(text, e))
+        elif self._pending is not None:
+            m = MAX_FREE_PATTERN.search(text)
+            if m:
+                self._pending['max_free'] = int(m.group(1))
+            m = STACK_PATTERN.match(text)
+            if m:
+                self._pending['stack'] = int(m.group(1))
+
+    def _finish(self):
+        sample, self._pending = self._pending, None
+        if sample is not None:
+            self.add_sample(sample)
+
+    def add_sample(self, sample, save=True):
+        self.buffer.extend([[sample[c] for c in COLUMNS]])
+        for name, (calls, total, longest) in sample['functions'].items():
+            stats = self.functions.get(name)
+            if stats is None:
+                stats = self.functions[name] = FunctionStats(name=name)
+            stats.add(calls, total, longest)
+        self.last = sample
+        self.count += 1
+        if save and self._file is not None:
+            self._file.write(json.dumps(sample) + '\n')
+            self._file.flush()
+
+    # -------------------------------------------------------------------------
+    # Results
+    # -------------------------------------------------------------------------
+    def values(self):
+        return self.buffer.values()
+
+    def reset(self):
+        """ Discard the samples shown (the history file is kept) """
+        self.buffer = self._default_buffer()
+        self.functions = {}
+        self.last = {}
+        self.count = 0
+
+    def to_dict(self):
+        return {
+            'board': self.board_name,
+            'columns': COLUMNS,
+            'samples': self.values().tolist(),
+            'functions': {name: f.to_dict()
+                          for name, f in sorted(self.functions.items())},
+        }
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
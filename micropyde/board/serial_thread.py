@@ -0,0 +1,134 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import sys
+import serial
+import threading
+from collections import deque
+from twisted.internet import reactor
+from twisted.internet.error import ConnectionDone, ConnectionLost
+from twisted.python.failure import Failure
+from micropyde.core.utils import log
+
+
+class SerialThreadTransport(object):
+    """ A serial port transport that reads on a dedicated thread instead
+    of through the reactor so bytes aren't dropped or delayed while the
+    UI is busy.
+
+    The thread does large reads and appends them to a deque (appends and
+    pops are atomic so no lock is needed). The reactor is woken once per
+    batch and hands everything received since the last batch to the
+    protocol in a single dataReceived call.
+
+    """
+
+    def __init__(self, protocol, port, baudrate=115200, read_size=4096,
+                 low_latency=True):
+        self.protocol = protocol
+        self.port = port
+        self.read_size = read_size
+        self.serial = serial.Serial(port, baudrate, timeout=0.05)
+        if low_latency and sys.platform.startswith('linux'):
+            try:
+                #: Sets ASYNC_LOW_LATENCY so the driver doesn't hold bytes
+                self.serial.set_low_latency_mode(True)
+            except (AttributeError, IOError, ValueError) as e:
+                log.debug("serial | Low latency mode unavailable: "
+                          "{}".format(e))
+        self.queue = deque()
+        self.scheduled = False
+        self.running = False
+        self.disconnecting = False
+        self.thread = None
+
+    def start(self):
+        """ Connect the protocol and start reading. Must be called from
+        the reactor thread.
+
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name="serial-{}".format(self.port))
+        self.thread.start()
+        self.protocol.makeConnection(self)
+
+    # -------------------------------------------------------------------------
+    # Reader thread
+    # -------------------------------------------------------------------------
+    def run(self):
+        ser = self.serial
+        queue = self.queue
+        reason = ConnectionDone()
+        try:
+            while self.running:
+                data = ser.read(min(max(1, ser.in_waiting), self.read_size))
+                if not data:
+                    continue
+                queue.append(data)
+                if not self.scheduled:
+                    self.scheduled = True
+                    reactor.callFromThread(self.deliver)
+        except (serial.SerialException, OSError) as e:
+            reason = ConnectionLost(str(e))
+        finally:
+            try:
+                ser.close()
+            except Exception:
+                pass
+            reactor.callFromThread(self.closed, reason)
+
+    # -------------------------------------------------------------------------
+    # Reactor thread
+    # -------------------------------------------------------------------------
+    def deliver(self):
+        """ Pass everything in the queue to the protocol at once """
+        #: Clear first so data added while draining schedules another call
+        self.scheduled = False
+        queue = self.queue
+        chunks = []
+        while queue:
+            chunks.append(queue.popleft())
+        if chunks:
+            self.protocol.dataReceived(b''.join(chunks))
+
+    def closed(self, reason):
+        self.deliver()
+        self.running = False
+        self.protocol.connectionLost(Failure(reason))
+
+    # -------------------------------------------------------------------------
+    # ITransport
+    # -------------------------------------------------------------------------
+    def write(self, data):
+        if not self.running:
+            return 0
+        try:
+            return self.serial.write(data)
+        except (serial.SerialException, OSError) as e:
+            log.warning("serial | Write failed: {}".format(e))
+            self.loseConnection()
+            return 0
+
+    def writeSequence(self, data):
+        for chunk in data:
+            self.write(chunk)
+
+    def loseConnection(self):
+        """ Stop the reader, it closes the port on the way out """
+        self.disconnecting = True
+        self.running = False
+
+    abortConnection = loseConnection
+
+    def getPeer(self):
+        return self.port
+
+    def getHost(self):
+        return self.port
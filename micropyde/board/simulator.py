@@ -0,0 +1,1205 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+
+A fake MicroPython board for testing and benchmarking without hardware.
+
+The simulator exposes a pty (usable as a serial port) and a WebREPL
+endpoint. Both are connected to a REPL that is either the unix port of
+MicroPython (if it's installed) or an emulation of the friendly, paste and
+raw REPL modes that runs code with CPython. The link latency, bandwidth,
+and heap size can be set to mimic a real board.
+
+Run it with `python -m micropyde.board.simulator --help`.
+
+"""
+import io
+import os
+import ast
+import re
+import sys
+import tty
+import math
+import json
+import time
+import types
+import codeop
+import ctypes
+import random
+import shutil
+import zlib
+import struct
+import hashlib
+import binascii
+import argparse
+import threading
+import traceback
+import tracemalloc
+import collections
+from collections import deque
+from twisted.internet import reactor, abstract, fdesc
+from twisted.internet.protocol import ProcessProtocol
+from autobahn.twisted.websocket import (
+    WebSocketServerFactory, WebSocketServerProtocol
+)
+from micropyde.core.utils import log
+from .webrepl import (
+    WEBREPL_REQUEST, WEBREPL_RESPONSE, WEBREPL_PUT_FILE, WEBREPL_GET_FILE,
+    WEBREPL_GET_VER
+)
+
+#: Printed on reset
+BANNER = ("MicroPython v1.19.1 on 2022-06-18; "
+          "micropyde simulator with CPython {}\r\n"
+          "Type \"help()\" for more information.\r\n").format(
+    sys.version.split()[0])
+
+#: Emulated MicroPython version
+VERSION = (1, 19, 1)
+
+#: Control characters used by the REPL
+CTRL_A, CTRL_B, CTRL_C, CTRL_D, CTRL_E = 1, 2, 3, 4, 5
+
+
+class Link(object):
+    """ Delivers data after a fixed latency at no more than `bandwidth`
+    bytes per second (0 for unlimited) like a serial line or network would.
+    Data is always delivered in order.
+
+    """
+
+    #: Data is split so it trickles in like it would over the wire
+    resolution = 0.01
+
+    def __init__(self, deliver, latency=0, bandwidth=0):
+        self.deliver = deliver
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.queue = deque()
+        self.busy_until = 0
+        self.call = None
+
+    def send(self, data):
+        if not data:
+            return
+        if not self.latency and not self.bandwidth:
+            return self.deliver(data)
+        now = time.time()
+        if self.bandwidth:
+            t = max(now, self.busy_until)
+            step = max(1, int(self.bandwidth*self.resolution))
+            for i in range(0, len(data), step):
+                chunk = data[i:i+step]
+                t += len(chunk)/float(self.bandwidth)
+                self.queue.append((t + self.latency, chunk))
+            self.busy_until = t
+        else:
+            self.queue.append((now + self.latency, data))
+        if self.call is None:
+            self.schedule()
+
+    def schedule(self):
+        due = self.queue[0][0]
+        self.call = reactor.callLater(max(0, due - time.time()), self.flush)
+
+    def flush(self):
+        self.call = None
+        now = time.time()
+        queue = self.queue
+        chunks = []
+        while queue and queue[0][0] <= now:
+            chunks.append(queue.popleft()[1])
+        if chunks:
+            self.deliver(b''.join(chunks))
+        if queue:
+            self.schedule()
+
+    def close(self):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+        self.queue.clear()
+
+
+# -----------------------------------------------------------------------------
+# CPython emulation
+# -----------------------------------------------------------------------------
+class StdinBuffer(object):
+    """ Blocking stdin for code running on the emulated board. It's fed
+    from the reactor thread and read from the code's thread.
+
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.condition = threading.Condition()
+        self.interrupted = False
+
+    def feed(self, data):
+        with self.condition:
+            self.data.extend(data)
+            self.condition.notify_all()
+
+    def interrupt(self):
+        with self.condition:
+            self.interrupted = True
+            self.condition.notify_all()
+
+    def take(self):
+        """ Remove and return anything that wasn't read """
+        with self.condition:
+            data = bytes(self.data)
+            self.data.clear()
+            self.interrupted = False
+            return data
+
+    def read(self, n=1):
+        with self.condition:
+            while len(self.data) < n:
+                if self.interrupted:
+                    self.interrupted = False
+                    raise KeyboardInterrupt()
+                self.condition.wait(0.1)
+            data = bytes(self.data[:n])
+            del self.data[:n]
+            return data
+
+    def readline(self):
+        with self.condition:
+            while b'\r' not in self.data and b'\n' not in self.data:
+                if self.interrupted:
+                    self.interrupted = False
+                    raise KeyboardInterrupt()
+                self.condition.wait(0.1)
+            i = min(self.data.find(c) for c in (b'\r', b'\n')
+                    if c in self.data) + 1
+            data = bytes(self.data[:i])
+            del self.data[:i]
+            return data
+
+
+class DeviceStdin(object):
+    """ sys.stdin of the emulated board (reads return str) """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.buffer = DeviceStdinBuffer(backend)
+
+    def read(self, n=1):
+        return self.buffer.read(n).decode('latin-1')
+
+    def readline(self):
+        return self.buffer.readline().decode('latin-1')
+
+
+class DeviceStdinBuffer(object):
+    """ sys.stdin.buffer of the emulated board (reads return bytes) """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def read(self, n=1):
+        self.backend.check_heap()
+        return self.backend.stdin.read(n)
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def readline(self):
+        return self.backend.stdin.readline()
+
+
+class DeviceStdoutBuffer(object):
+    """ sys.stdout.buffer of the emulated board (writes are sent as is) """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.backend.write(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class DeviceStdout(DeviceStdoutBuffer):
+    """ sys.stdout of the emulated board. Like the bare metal ports, line
+    feeds are sent as CRLF.
+
+    """
+
+    def __init__(self, backend):
+        super(DeviceStdout, self).__init__(backend)
+        self.buffer = DeviceStdoutBuffer(backend)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        n = len(data)
+        self.backend.write(bytes(data).replace(b'\n', b'\r\n'))
+        return n
+
+
+class DeviceFile(object):
+    """ File opened by code on the emulated board. Like MicroPython, text
+    can be written to files opened in binary mode.
+
+    """
+
+    def __init__(self, f, binary):
+        self.file = f
+        self.binary = binary
+
+    def write(self, data):
+        if self.binary and isinstance(data, str):
+            data = data.encode('latin-1')
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+
+class DeflateIO(object):
+    """ Decompressing stream like MicroPython's deflate.DeflateIO """
+
+    def __init__(self, stream, format=0, wbits=0):
+        if format == 1:
+            wbits = -(wbits or 8)
+        elif format == 3:
+            wbits = 16 + (wbits or 15)
+        else:
+            wbits = 32 + 15 if format == 0 else wbits or 15
+        self.stream = stream
+        self.decompressor = zlib.decompressobj(wbits)
+
+    def read(self, n=-1):
+        d = self.decompressor
+        data = b''
+        while (n < 0 or len(data) < n) and not d.eof:
+            chunk = d.unconsumed_tail or self.stream.read(256)
+            if not chunk:
+                break
+            data += d.decompress(chunk, max(0, n - len(data)))
+        return data
+
+    def close(self):
+        self.stream.close()
+
+
+class PythonBackend(object):
+    """ Runs code sent to the board with CPython. Enough of MicroPython's
+    modules are emulated (os, sys, gc, micropython, machine, time and the
+    u-prefixed aliases) to run the code the IDE sends. Files are kept in
+    the `root` directory.
+
+    If a heap size is given, allocations are traced and a MemoryError is
+    raised when code uses more than that (it's checked on I/O so it's
+    approximate).
+
+    """
+
+    name = "CPython"
+
+    def __init__(self, root, heap=0):
+        self.root = os.path.abspath(root)
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        self.heap = heap
+        self.cwd = '/'
+        self.interrupt_char = CTRL_C
+        self.stdin = StdinBuffer()
+        self.thread = None
+        self.output = None
+        self.baseline = 0
+        if heap and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.reset()
+
+    def reset(self):
+        """ Clear everything like a soft reset """
+        self.cwd = '/'
+        self.interrupt_char = CTRL_C
+        self.stdin.take()
+        self.modules = self.create_modules()
+        self.namespace = {'__name__': '__main__',
+                          '__builtins__': self.create_builtins()}
+
+    # -------------------------------------------------------------------------
+    # Execution
+    # -------------------------------------------------------------------------
+    @property
+    def busy(self):
+        return self.thread is not None
+
+    def execute(self, source, mode, output, done):
+        """ Run the source on a thread. Output is passed to `output` and
+        `done` is called with the error text (if any) in the reactor
+        thread when it finishes.
+
+        """
+        self.output = output
+        self.thread = threading.Thread(target=self.run,
+                                       args=(source, mode, done),
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self, source, mode, done):
+        error = ''
+        if self.heap:
+            self.baseline = tracemalloc.get_traced_memory()[0]
+        try:
+            source = source.replace('\r\n', '\n').replace('\r', '\n')
+            tree = ast.parse(source, '<stdin>')
+            if mode == 'single':
+                #: Print the value of expressions like the REPL does
+                for node in tree.body:
+                    if isinstance(node, ast.Expr):
+                        node.value = ast.Call(
+                            func=ast.Name('__display__', ast.Load()),
+                            args=[node.value], keywords=[])
+                ast.fix_missing_locations(tree)
+                self.namespace['__builtins__']['__display__'] = self.display
+            exec(compile(tree, '<stdin>', 'exec'), self.namespace)
+        except SoftReset:
+            error = None
+        except BaseException as e:
+            error = self.format_exception(e)
+        finally:
+            self.thread = None
+            reactor.callFromThread(done, error)
+
+    def display(self, value):
+        if value is not None:
+            self.write(repr(value).encode() + b'\r\n')
+
+    def interrupt(self):
+        """ Raise a KeyboardInterrupt in the running code """
+        self.stdin.interrupt()
+        thread = self.thread
+        if thread is not None:
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_ulong(thread.ident),
+                ctypes.py_object(KeyboardInterrupt))
+
+    def write(self, data):
+        """ Called from the code's thread """
+        self.check_heap()
+        reactor.callFromThread(self.output, data)
+
+    def format_exception(self, e):
+        tb = traceback.extract_tb(e.__traceback__)
+        lines = ["Traceback (most recent call last):"]
+        for frame in tb:
+            if frame.filename.startswith('<') or \
+                    frame.filename.startswith(self.root):
+                lines.append('  File "{}", line {}, in {}'.format(
+                    frame.filename, frame.lineno, frame.name))
+        message = str(e)
+        name = type(e).__name__
+        lines.append("{}: {}".format(name, message) if message else name)
+        return "\r\n".join(lines) + "\r\n"
+
+    # -------------------------------------------------------------------------
+    # Heap
+    # -------------------------------------------------------------------------
+    def heap_used(self):
+        if not self.heap:
+            return 0
+        return max(0, tracemalloc.get_traced_memory()[0] - self.baseline)
+
+    def check_heap(self):
+        if self.heap and self.heap_used() > self.heap:
+            raise MemoryError("memory allocation failed")
+
+    # -------------------------------------------------------------------------
+    # Filesystem
+    # -------------------------------------------------------------------------
+    def resolve(self, path):
+        """ Map a path on the board to a path in the root """
+        if not path.startswith('/'):
+            path = self.cwd.rstrip('/') + '/' + path
+        path = os.path.normpath(path).lstrip('/')
+        if path.startswith('..'):
+            raise OSError(2, "ENOENT")
+        return os.path.join(self.root, path)
+
+    def open(self, path, mode='r', *args, **kwargs):
+        try:
+            f = open(self.resolve(path), mode, *args, **kwargs)
+        except FileNotFoundError:
+            raise OSError(2, "ENOENT")
+        return DeviceFile(f, 'b' in mode)
+
+    # -------------------------------------------------------------------------
+    # Emulated builtins and modules
+    # -------------------------------------------------------------------------
+    def create_builtins(self):
+        import builtins
+        namespace = dict(vars(builtins))
+        stdout = self.modules['sys'].stdout
+
+        def _print(*args, sep=' ', end='\n', file=None):
+            text = sep.join(str(a) for a in args) + end
+            (file or stdout).write(text)
+
+        def _input(prompt=''):
+            self.write(prompt.encode())
+            return self.stdin.readline().decode().rstrip('\r\n')
+
+        def _import(name, globals=None, locals=None, fromlist=(), level=0):
+            module = self.import_module(name)
+            if fromlist or '.' not in name:
+                return module
+            return self.import_module(name.split('.')[0])
+
+        namespace.update({
+            'print': _print,
+            'input': _input,
+            'open': self.open,
+            'help': self.help,
+            '__import__': _import,
+            'exit': sys.exit,
+        })
+        return namespace
+
+    def import_module(self, name):
+        modules = self.modules
+        if name in modules:
+            return modules[name]
+        for folder in ('/', '/lib/'):
+            path = self.resolve(folder + name.replace('.', '/') + '.py')
+            if os.path.exists(path):
+                module = types.ModuleType(name)
+                module.__file__ = path
+                module.__builtins__ = self.namespace['__builtins__']
+                modules[name] = module
+                with open(path) as f:
+                    exec(compile(f.read(), path, 'exec'), module.__dict__)
+                return module
+        raise ImportError("no module named '{}'".format(name))
+
+    def create_modules(self):
+        backend = self
+
+        def module(name, **attrs):
+            m = types.ModuleType(name)
+            m.__dict__.update(attrs)
+            return m
+
+        def stat(path):
+            try:
+                return tuple(os.stat(backend.resolve(path)))[:10]
+            except FileNotFoundError:
+                raise OSError(2, "ENOENT")
+
+        def chdir(path):
+            if not os.path.isdir(backend.resolve(path)):
+                raise OSError(2, "ENOENT")
+            backend.cwd = '/' + os.path.relpath(
+                backend.resolve(path), backend.root).strip('.')
+
+        def ilistdir(path='.'):
+            for name in os.listdir(backend.resolve(path)):
+                full = os.path.join(backend.resolve(path), name)
+                kind = 0x4000 if os.path.isdir(full) else 0x8000
+                yield (name, kind, 0, os.path.getsize(full))
+
+        def wrap(func):
+            def call(path, *args):
+                try:
+                    return func(backend.resolve(path), *args)
+                except FileNotFoundError:
+                    raise OSError(2, "ENOENT")
+            return call
+
+        uos = module(
+            'uos',
+            listdir=lambda path='.': sorted(
+                os.listdir(backend.resolve(path))),
+            ilistdir=ilistdir,
+            stat=stat,
+            remove=wrap(os.remove),
+            rmdir=wrap(os.rmdir),
+            mkdir=wrap(os.mkdir),
+            rename=lambda a, b: os.replace(backend.resolve(a),
+                                           backend.resolve(b)),
+            getcwd=lambda: backend.cwd,
+            chdir=chdir,
+            sync=lambda: None,
+            statvfs=lambda path='/': (4096, 4096, 512, 256, 256, 0, 0, 0, 0,
+                                      255),
+            uname=lambda: ('simulator', 'simulator', '1.19.1',
+                           'v1.19.1', 'micropyde simulator'),
+            urandom=os.urandom,
+            dupterm=lambda *args: None,
+        )
+
+        stdout = DeviceStdout(backend)
+        usys = module(
+            'usys',
+            stdin=DeviceStdin(backend),
+            stdout=stdout,
+            stderr=stdout,
+            platform='simulator',
+            version='3.4.0',
+            implementation=types.SimpleNamespace(name='micropython',
+                                                 version=VERSION),
+            byteorder='little',
+            maxsize=2**31-1,
+            path=['', '/lib'],
+            argv=[],
+            exit=sys.exit,
+            print_exception=lambda e, file=stdout: file.write(
+                backend.format_exception(e)),
+        )
+        usys.modules = {}
+
+        def mem_free():
+            if not backend.heap:
+                return 2**20
+            return max(0, backend.heap - backend.heap_used())
+
+        def mem_info(verbose=False):
+            used = backend.heap_used()
+            free = mem_free()
+            backend.write((
+                "stack: 736 out of 15360\r\n"
+                "GC: total: {}, used: {}, free: {}\r\n"
+                " No. of 1-blocks: 0, 2-blocks: 0, max blk sz: 0, "
+                "max free sz: {}\r\n").format(used+free, used, free,
+                                               free//16).encode())
+
+        ugc = module(
+            'gc',
+            collect=lambda: None,
+            enable=lambda: None,
+            disable=lambda: None,
+            isenabled=lambda: True,
+            mem_free=mem_free,
+            mem_alloc=backend.heap_used,
+            threshold=lambda *args: -1,
+        )
+
+        identity = lambda f: f
+        umicropython = module(
+            'micropython',
+            const=lambda v: v,
+            opt_level=lambda *args: 0,
+            mem_info=mem_info,
+            qstr_info=lambda *args: None,
+            stack_use=lambda: 736,
+            heap_lock=lambda: None,
+            heap_unlock=lambda: 0,
+            kbd_intr=lambda c: setattr(backend, 'interrupt_char', c),
+            alloc_emergency_exception_buf=lambda n: None,
+            schedule=lambda f, arg: f(arg),
+            native=identity,
+            viper=identity,
+        )
+
+        start = time.time()
+
+        def ticks_ms():
+            return int((time.time()-start)*1000) & 0x3fffffff
+
+        def ticks_us():
+            return int((time.time()-start)*1000000) & 0x3fffffff
+
+        utime = module(
+            'utime',
+            time=lambda: int(time.time()),
+            time_ns=time.time_ns,
+            localtime=lambda secs=None: time.localtime(secs)[:8],
+            gmtime=lambda secs=None: time.gmtime(secs)[:8],
+            mktime=lambda t: int(time.mktime(tuple(t)+(0,)*(9-len(t)))),
+            sleep=time.sleep,
+            sleep_ms=lambda ms: time.sleep(ms/1000.0),
+            sleep_us=lambda us: time.sleep(us/1000000.0),
+            ticks_ms=ticks_ms,
+            ticks_us=ticks_us,
+            ticks_cpu=ticks_us,
+            ticks_add=lambda t, d: (t + d) & 0x3fffffff,
+            ticks_diff=lambda a, b: ((a - b + 0x20000000) & 0x3fffffff) -
+                                    0x20000000,
+        )
+
+        def reset():
+            raise SoftReset()
+
+        umachine = module(
+            'umachine',
+            reset=reset,
+            soft_reset=reset,
+            freq=lambda *args: 160000000,
+            unique_id=lambda: b'\x00micro',
+            idle=lambda: None,
+            reset_cause=lambda: 0,
+        )
+
+        deflate = module('deflate', DeflateIO=DeflateIO, AUTO=0, RAW=1,
+                         ZLIB=2, GZIP=3)
+
+        modules = {'deflate': deflate}
+        for name, m in (('os', uos), ('sys', usys), ('gc', ugc),
+                        ('micropython', umicropython), ('time', utime),
+                        ('machine', umachine), ('binascii', binascii),
+                        ('hashlib', hashlib), ('json', json),
+                        ('struct', struct), ('io', io), ('re', re),
+                        ('collections', collections), ('math', math),
+                        ('random', random), ('errno', __import__('errno')),
+                        ('array', __import__('array'))):
+            modules[name] = m
+            if name not in ('micropython', 'gc', 'math', 'array'):
+                modules['u'+name] = m
+        usys.modules = modules
+        return modules
+
+    def help(self, obj=None):
+        """ Mimics the output of help on MicroPython """
+        write = lambda text: self.write(text.encode())
+        if obj is None:
+            write("Welcome to the micropyde simulator!\r\n")
+        elif obj == 'modules':
+            names = sorted(self.modules)
+            for i in range(0, len(names), 4):
+                write("".join(n.ljust(16) for n in names[i:i+4]).rstrip() +
+                      "\r\n")
+            write("Plus any modules on the filesystem\r\n")
+        else:
+            write("object {} is of type {}\r\n".format(
+                repr(obj), type(obj).__name__))
+            #: Only the public names since CPython's modules have far more
+            for name in dir(obj):
+                if name.startswith('_'):
+                    continue
+                value = getattr(obj, name)
+                if callable(value) and not isinstance(value, type):
+                    text = "<function>"
+                else:
+                    text = repr(value)[:80]
+                write("  {} -- {}\r\n".format(name, text))
+
+
+class SoftReset(BaseException):
+    """ Raised by machine.reset() to reset the emulated board """
+
+
+class Repl(object):
+    """ The friendly, paste and raw REPL state machine. Input is passed
+    to `input` and output is sent to each of the listeners.
+
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.listeners = []
+        self.mode = 'friendly'
+        self.line = bytearray()
+        self.lines = []
+        self.paste = bytearray()
+        self.raw = bytearray()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def emit(self, data):
+        for listener in self.listeners[:]:
+            listener(data)
+
+    def emit_text(self, text):
+        self.emit(text.encode())
+
+    def start(self):
+        self.emit_text(BANNER + ">>> ")
+
+    def soft_reset(self, raw=False):
+        self.backend.reset()
+        self.line = bytearray()
+        self.lines = []
+        self.emit_text("MPY: soft reboot\r\n")
+        if raw:
+            self.emit_text("raw REPL; CTRL-B to exit\r\n>")
+        else:
+            self.mode = 'friendly'
+            self.emit_text(BANNER + ">>> ")
+
+    def input(self, data):
+        backend = self.backend
+        i = 0
+        while i < len(data):
+            if backend.busy:
+                #: Only ctrl-C is special while running, the rest is stdin
+                c = backend.interrupt_char
+                j = data.find(bytes([c]), i) if 0 <= c < 256 else -1
+                if j == -1:
+                    backend.stdin.feed(data[i:])
+                    return
+                backend.stdin.feed(data[i:j])
+                backend.interrupt()
+                i = j + 1
+                continue
+            c = data[i]
+            i += 1
+            getattr(self, 'on_{}'.format(self.mode))(c)
+
+    def execute(self, source, mode):
+        def done(error):
+            if error is None:
+                return self.soft_reset(raw=self.mode == 'raw')
+            if self.mode == 'raw':
+                self.emit(b'\x04' + error.encode() + b'\x04>')
+            else:
+                self.emit_text(error + ">>> ")
+            #: Anything not read by the code is handled by the REPL
+            left = self.backend.stdin.take()
+            if left:
+                self.input(left)
+        self.backend.execute(source, mode, self.emit, done)
+
+    def on_friendly(self, c):
+        if c == CTRL_A:
+            self.mode = 'raw'
+            self.raw = bytearray()
+            self.emit_text("\r\nraw REPL; CTRL-B to exit\r\n>")
+        elif c == CTRL_B:
+            self.line = bytearray()
+            self.emit_text("\r\n" + BANNER + ">>> ")
+        elif c == CTRL_C:
+            self.line = bytearray()
+            self.lines = []
+            self.emit_text("\r\n>>> ")
+        elif c == CTRL_D:
+            if not self.line:
+                self.soft_reset()
+        elif c == CTRL_E:
+            self.mode = 'paste'
+            self.paste = bytearray()
+            self.emit_text(
+                "\r\npaste mode; Ctrl-C to cancel, Ctrl-D to finish\r\n=== ")
+        elif c in (8, 127):
+            if self.line:
+                self.line.pop()
+                self.emit(b'\x08 \x08')
+        elif c == 13:
+            self.emit(b'\r\n')
+            line = self.line.decode('utf-8', 'replace')
+            self.line = bytearray()
+            self.lines.append(line)
+            source = "\n".join(self.lines)
+            try:
+                complete = codeop.compile_command(source + "\n", '<stdin>',
+                                                  'single')
+            except (SyntaxError, ValueError, OverflowError):
+                complete = True
+            if complete is None and (len(self.lines) == 1 or line.strip()):
+                self.emit_text("... ")
+                return
+            self.lines = []
+            if not source.strip():
+                self.emit_text(">>> ")
+                return
+            self.execute(source + "\n", 'single')
+        elif c >= 32 or c == 9:
+            self.line.append(c)
+            self.emit(bytes([c]))
+
+    def on_paste(self, c):
+        if c == CTRL_C:
+            self.mode = 'friendly'
+            self.emit_text("\r\n>>> ")
+        elif c == CTRL_D:
+            self.mode = 'friendly'
+            self.emit(b'\r\n')
+            source = self.paste.decode('utf-8', 'replace')
+            self.execute(source, 'exec')
+        else:
+            self.paste.append(c)
+            if c == 13:
+                self.emit_text("\r\n=== ")
+            else:
+                self.emit(bytes([c]))
+
+    def on_raw(self, c):
+        if c == CTRL_A:
+            self.raw = bytearray()
+            self.emit_text("\r\nraw REPL; CTRL-B to exit\r\n>")
+        elif c == CTRL_B:
+            self.mode = 'friendly'
+            self.emit_text("\r\n" + BANNER + ">>> ")
+        elif c == CTRL_C:
+            self.raw = bytearray()
+        elif c == CTRL_D:
+            if not self.raw:
+                self.emit(b'OK')
+                return self.soft_reset(raw=True)
+            source = self.raw.decode('utf-8', 'replace')
+            self.raw = bytearray()
+            self.emit(b'OK')
+            self.execute(source, 'exec')
+        else:
+            self.raw.append(c)
+
+
+# -----------------------------------------------------------------------------
+# MicroPython unix port
+# -----------------------------------------------------------------------------
+class MicroPythonRepl(ProcessProtocol):
+    """ Runs the unix port of MicroPython in a pty so it can be used like
+    a board. The process is restarted when it exits (ex ctrl-D) to mimic a
+    soft reset. Note the unix port does not support the raw REPL.
+
+    """
+
+    def __init__(self, executable, root, heap=0):
+        self.executable = executable
+        self.root = os.path.abspath(root)
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        self.heap = heap
+        self.listeners = []
+        self.stopped = False
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def start(self):
+        args = [self.executable]
+        if self.heap:
+            args.extend(['-X', 'heapsize={}'.format(self.heap)])
+        reactor.spawnProcess(self, self.executable, args, path=self.root,
+                             env=os.environ, usePTY=True)
+
+    def input(self, data):
+        if self.transport is not None:
+            self.transport.write(data)
+
+    def outReceived(self, data):
+        for listener in self.listeners[:]:
+            listener(data)
+
+    def processEnded(self, reason):
+        if not self.stopped:
+            log.debug("simulator | micropython exited, restarting")
+            self.outReceived(b"MPY: soft reboot\r\n")
+            self.start()
+
+    def stop(self):
+        self.stopped = True
+        if self.transport is not None:
+            self.transport.signalProcess('KILL')
+
+
+# -----------------------------------------------------------------------------
+# Endpoints
+# -----------------------------------------------------------------------------
+class PtyEndpoint(abstract.FileDescriptor):
+    """ Exposes the REPL on a pty which can be opened like a serial port """
+
+    def __init__(self, repl, latency=0, bandwidth=0):
+        abstract.FileDescriptor.__init__(self, reactor)
+        self.repl = repl
+        self.fd, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        fdesc.setNonBlocking(self.fd)
+        self.path = os.ttyname(self.slave)
+        self.rx = Link(repl.input, latency, bandwidth)
+        self.tx = Link(self.write, latency, bandwidth)
+        repl.add_listener(self.tx.send)
+        self.connected = 1
+        self.startReading()
+
+    def fileno(self):
+        return self.fd
+
+    def doRead(self):
+        return fdesc.readFromFD(self.fd, self.rx.send)
+
+    def writeSomeData(self, data):
+        return fdesc.writeToFD(self.fd, data)
+
+    def close(self):
+        self.repl.remove_listener(self.tx.send)
+        self.rx.close()
+        self.tx.close()
+        self.stopReading()
+        self.stopWriting()
+        for fd in (self.fd, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def split_utf8(data):
+    """ Split off any incomplete utf-8 character at the end of the data so
+    text frames are always valid.
+
+    """
+    for i in range(1, min(4, len(data)) + 1):
+        c = data[-i]
+        if c & 0xC0 == 0x80:
+            continue  #: Continuation byte
+        if c & 0x80 and i < (2 if c < 0xE0 else 3 if c < 0xF0 else 4):
+            return data[:-i], data[-i:]
+        break
+    return data, b''
+
+
+class WebreplProtocol(WebSocketServerProtocol):
+    """ Emulates the WebREPL. Text frames go to the REPL and binary frames
+    are handled as file transfer requests.
+
+    """
+
+    def onOpen(self):
+        self.endpoint = self.factory.endpoint
+        self.repl = self.endpoint.repl
+        self.rx = Link(self.on_input, self.endpoint.latency,
+                       self.endpoint.bandwidth)
+        self.tx = Link(self.send_text, self.endpoint.latency,
+                       self.endpoint.bandwidth)
+        self.pending = b''
+        self.request = b''
+        self.transfer = None
+        self.password = self.endpoint.password
+        self.logged_in = not self.password
+        self.entered = bytearray()
+        if self.logged_in:
+            self.login()
+        else:
+            self.sendMessage(b"Password: ")
+
+    def login(self):
+        self.logged_in = True
+        self.repl.add_listener(self.tx.send)
+        self.sendMessage(b"\r\nWebREPL connected\r\n>>> ")
+
+    def onMessage(self, payload, isBinary):
+        if isBinary:
+            self.on_binary(payload)
+        else:
+            self.rx.send(payload)
+
+    def on_input(self, data):
+        if self.logged_in:
+            return self.repl.input(data)
+        for c in data:
+            if c == 13:
+                if self.entered.decode() == self.password:
+                    return self.login()
+                log.warning("simulator | WebREPL access denied")
+                self.sendMessage(b"\r\nAccess denied\r\n")
+                return self.sendClose()
+            self.entered.append(c)
+
+    def send_text(self, data):
+        data, self.pending = split_utf8(self.pending + data)
+        if data:
+            self.sendMessage(data)
+
+    def onClose(self, wasClean, code, reason):
+        if hasattr(self, 'tx'):
+            self.repl.remove_listener(self.tx.send)
+            self.rx.close()
+            self.tx.close()
+
+    # -------------------------------------------------------------------------
+    # File transfer
+    # -------------------------------------------------------------------------
+    def respond(self, status=0):
+        self.sendMessage(WEBREPL_RESPONSE.pack(b"WB", status), isBinary=True)
+
+    def on_binary(self, data):
+        transfer = self.transfer
+        if transfer is None:
+            self.request += data
+            if len(self.request) < WEBREPL_REQUEST.size:
+                return
+            request = self.request[:WEBREPL_REQUEST.size]
+            data = self.request[WEBREPL_REQUEST.size:]
+            self.request = b''
+            sig, op, _, _, size, n, name = WEBREPL_REQUEST.unpack(request)
+            name = name[:n].decode()
+            path = os.path.join(self.endpoint.root, name.lstrip('/'))
+            if op == WEBREPL_PUT_FILE:
+                self.transfer = transfer = {'op': op, 'path': path,
+                                            'size': size,
+                                            'data': bytearray()}
+                self.respond(0)
+            elif op == WEBREPL_GET_FILE:
+                if not os.path.isfile(path):
+                    return self.respond(1)
+                self.transfer = transfer = {'op': op,
+                                            'file': open(path, 'rb')}
+                self.respond(0)
+            elif op == WEBREPL_GET_VER:
+                return self.sendMessage(bytes(VERSION), isBinary=True)
+            else:
+                return self.respond(1)
+            if not data:
+                return
+        if transfer['op'] == WEBREPL_PUT_FILE:
+            buf = transfer['data']
+            buf.extend(data[:transfer['size']-len(buf)])
+            if len(buf) == transfer['size']:
+                with open(transfer['path'], 'wb') as f:
+                    f.write(buf)
+                self.transfer = None
+                self.respond(0)
+        else:
+            #: Each byte received requests the next block
+            for c in data:
+                chunk = transfer['file'].read(1024)
+                self.sendMessage(struct.pack("<H", len(chunk)) + chunk,
+                                 isBinary=True)
+                if not chunk:
+                    transfer['file'].close()
+                    self.transfer = None
+                    self.respond(0)
+                    break
+
+
+class WebreplEndpoint(object):
+    """ Serves the WebREPL on the given port """
+
+    def __init__(self, repl, root, port=8266, interface='127.0.0.1',
+                 latency=0, bandwidth=0, password=''):
+        self.repl = repl
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.password = password
+        factory = WebSocketServerFactory()
+        factory.protocol = WebreplProtocol
+        factory.endpoint = self
+        self.listener = reactor.listenTCP(port, factory, interface=interface)
+        self.port = self.listener.getHost().port
+
+    def close(self):
+        return self.listener.stopListening()
+
+
+class Simulator(object):
+    """ A simulated board with a pty and or WebREPL endpoint.
+
+    Parameters
+    ----------
+        root: str
+            Directory used as the board's filesystem
+        backend: str
+            'micropython' to run the unix port, 'cpython' to emulate it
+            or 'auto' to use the unix port if it's installed
+        latency: float
+            Delay in seconds added in each direction
+        bandwidth: int
+            Bytes per second in each direction or 0 for unlimited. For a
+            serial port this is the baudrate / 10.
+        heap: int
+            Heap size in bytes or 0 for unlimited
+        password: str
+            WebREPL password, if empty no password is required
+
+    """
+
+    def __init__(self, root, backend='auto', latency=0, bandwidth=0, heap=0,
+                 password=''):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.password = password
+        executable = shutil.which('micropython')
+        if backend == 'micropython' or (backend == 'auto' and executable):
+            if not executable:
+                raise RuntimeError("The micropython executable was not found")
+            self.repl = MicroPythonRepl(executable, self.root, heap)
+        else:
+            self.repl = Repl(PythonBackend(self.root, heap))
+        self.endpoints = []
+
+    def start(self):
+        self.repl.start()
+
+    def open_pty(self):
+        """ Expose the REPL on a pty and return its path """
+        endpoint = PtyEndpoint(self.repl, self.latency, self.bandwidth)
+        self.endpoints.append(endpoint)
+        return endpoint.path
+
+    def listen_webrepl(self, port=8266, interface='127.0.0.1'):
+        """ Serve the WebREPL and return the port it's listening on """
+        endpoint = WebreplEndpoint(self.repl, self.root, port, interface,
+                                   self.latency, self.bandwidth,
+                                   self.password)
+        self.endpoints.append(endpoint)
+        return endpoint.port
+
+    def stop(self):
+        for endpoint in self.endpoints:
+            endpoint.close()
+        self.endpoints = []
+        if isinstance(self.repl, MicroPythonRepl):
+            self.repl.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated MicroPython board")
+    parser.add_argument('--root', default='.',
+                        help="Directory used as the board's filesystem")
+    parser.add_argument('--backend', default='auto',
+                        choices=['auto', 'micropython', 'cpython'])
+    parser.add_argument('--pty', action='store_true', help="Open a pty")
+    parser.add_argument('--webrepl', type=int, default=None, metavar='PORT',
+                        help="Serve the WebREPL on the port")
+    parser.add_argument('--interface', default='127.0.0.1')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--latency', type=float, default=0,
+                        help="Latency in ms")
+    parser.add_argument('--baudrate', type=int, default=0,
+                        help="Limit the bandwidth to this baudrate")
+    parser.add_argument('--heap', type=int, default=0,
+                        help="Heap size in bytes")
+    args = parser.parse_args()
+
+    simulator = Simulator(args.root, backend=args.backend,
+                          latency=args.latency/1000.0,
+                          bandwidth=args.baudrate//10, heap=args.heap,
+                          password=args.password)
+    if args.pty or args.webrepl is None:
+        print("Serial: {}".format(simulator.open_pty()))
+    if args.webrepl is not None:
+        port = simulator.listen_webrepl(args.webrepl, args.interface)
+        print("WebREPL: ws://{}:{}".format(args.interface, port))
+    sys.stdout.flush()
+    simulator.start()
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
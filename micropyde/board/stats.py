@@ -0,0 +1,262 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import json
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from atom.api import Atom, Bool, Dict, Float, Instance, Int, List, Str
+
+#: Upper edge of each latency bucket (in seconds), the last is everything
+#: over 10s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2,
+                   0.5, 1, 2, 5, 10, float('inf'))
+
+
+def format_bucket(edge):
+    if edge == float('inf'):
+        return ">10s"
+    if edge < 1:
+        return "{:g}ms".format(edge*1000)
+    return "{:g}s".format(edge)
+
+
+def measured(name):
+    """ Record each call of a BoardPlugin method that returns a Deferred
+    as the operation `name` once it fires.
+
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(plugin, *args, **kwargs):
+            stats = plugin.board.stats
+            start = time.perf_counter()
+
+            def done(result, error=False):
+                stats.record(name, time.perf_counter() - start, error=error)
+                return result
+
+            d = f(plugin, *args, **kwargs)
+            d.addCallbacks(done, lambda failure: done(failure, error=True))
+            return d
+        return wrapper
+    return decorator
+
+
+class Histogram(Atom):
+    """ Counts of values in fixed log spaced buckets """
+
+    edges = List(default=list(LATENCY_BUCKETS))
+    counts = List()
+
+    def _default_counts(self):
+        return [0]*len(self.edges)
+
+    def add(self, value):
+        self.counts[bisect_left(self.edges, value)] += 1
+
+    def percentile(self, p):
+        """ Upper edge of the bucket containing the percentile """
+        total = sum(self.counts)
+        if not total:
+            return 0
+        n = 0
+        for edge, count in zip(self.edges, self.counts):
+            n += count
+            if n >= total*p/100.0:
+                return edge
+        return self.edges[-1]
+
+    def to_dict(self):
+        return {format_bucket(e): c for e, c in zip(self.edges, self.counts)}
+
+
+class Measurement(object):
+    """ Filled in while an operation runs. The idle and device times are
+    added by the operation when it knows them.
+
+    """
+    __slots__ = ('name', 'start', 'bytes', 'idle', 'device', 'rtt')
+
+    def __init__(self, name, nbytes=0):
+        self.name = name
+        self.start = time.perf_counter()
+        self.bytes = nbytes
+        self.idle = 0.0
+        self.device = 0.0
+        self.rtt = None
+
+
+class OperationStats(Atom):
+    """ Totals for one kind of operation (ex query or upload_file) """
+
+    name = Str()
+
+    #: Number of times it ran and how many failed
+    count = Int()
+    errors = Int()
+
+    #: Bytes sent or received
+    bytes = Int()
+
+    #: Total time (s) and the parts spent sleeping or waiting on timeouts
+    #: (idle) and waiting on the device to reply (device)
+    total = Float()
+    idle = Float()
+    device = Float()
+
+    #: Duration of each run
+    latency = Instance(Histogram, ())
+
+    #: Time until the first reply (for queries)
+    rtt = Instance(Histogram, ())
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else 0
+
+    @property
+    def throughput(self):
+        """ Bytes per second while running """
+        return self.bytes/self.total if self.total else 0
+
+    @property
+    def host(self):
+        """ Time not spent idle or waiting on the device """
+        return max(0, self.total - self.idle - self.device)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'total': self.total,
+            'mean': self.mean,
+            'idle': self.idle,
+            'device': self.device,
+            'host': self.host,
+            'throughput': self.throughput,
+            'latency': self.latency.to_dict(),
+            'rtt': self.rtt.to_dict(),
+        }
+
+
+class BoardStats(Atom):
+    """ Collects timing of board operations and the bytes sent and
+    received so slow transfers can be narrowed down to the link, the
+    device or the host.
+
+    """
+    enabled = Bool(True)
+
+    #: Stats of each operation by name
+    operations = Dict()
+
+    #: Bytes sent and received since the last reset
+    tx_bytes = Int()
+    rx_bytes = Int()
+
+    #: Samples of (time, tx_bytes, rx_bytes) taken by sample()
+    history = Instance(deque, kwargs={'maxlen': 600})
+
+    #: When the stats were last reset
+    started = Float(factory=time.time)
+
+    def sent(self, n):
+        self.tx_bytes += n
+
+    def received(self, n):
+        self.rx_bytes += n
+
+    def operation(self, name):
+        op = self.operations.get(name)
+        if op is None:
+            op = self.operations[name] = OperationStats(name=name)
+        return op
+
+    def record(self, name, duration, nbytes=0, idle=0, device=0, rtt=None,
+               error=False):
+        """ Add a run of the operation """
+        if not self.enabled:
+            return
+        op = self.operation(name)
+        op.count += 1
+        op.bytes += nbytes
+        op.total += duration
+        op.idle += idle
+        op.device += device
+        op.latency.add(duration)
+        if rtt is not None:
+            op.rtt.add(rtt)
+        if error:
+            op.errors += 1
+
+    @contextmanager
+    def measure(self, name, nbytes=0):
+        """ Time the block. It works across yields in inlineCallbacks.
+
+        Yields
+        ------
+            measurement: Measurement
+                Set the bytes, idle and device time on it as they're known
+
+        """
+        m = Measurement(name, nbytes)
+        try:
+            yield m
+        except BaseException:
+            self.record(name, time.perf_counter() - m.start, m.bytes, m.idle,
+                        m.device, m.rtt, error=True)
+            raise
+        self.record(name, time.perf_counter() - m.start, m.bytes, m.idle,
+                    m.device, m.rtt)
+
+    def sample(self):
+        """ Save the byte counters so throughput can be computed """
+        self.history.append((time.time(), self.tx_bytes, self.rx_bytes))
+
+    def throughput(self):
+        """ Compute the tx and rx rate (bytes/s) between samples
+
+        Returns
+        -------
+            rates: list
+                A list of (time, tx rate, rx rate) tuples
+
+        """
+        rates = []
+        history = list(self.history)
+        for (t0, tx0, rx0), (t1, tx1, rx1) in zip(history, history[1:]):
+            dt = (t1 - t0) or 1
+            rates.append((t1, (tx1 - tx0)/dt, (rx1 - rx0)/dt))
+        return rates
+
+    def reset(self):
+        self.operations = {}
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+        self.history.clear()
+        self.started = time.time()
+
+    def to_dict(self):
+        return {
+            'started': self.started,
+            'duration': time.time() - self.started,
+            'tx_bytes': self.tx_bytes,
+            'rx_bytes': self.rx_bytes,
+            'throughput': self.throughput(),
+            'operations': {name: op.to_dict()
+                           for name, op in sorted(self.operations.items())},
+        }
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
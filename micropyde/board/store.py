@@ -0,0 +1,112 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import os
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS modules (
+    name TEXT PRIMARY KEY,
+    members TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    info TEXT
+);
+"""
+
+
+class CacheStore(object):
+    """ Keeps data built from the board (the module index and the file
+    tree) in a sqlite database so it doesn't have to be loaded with the
+    config. Each call opens its own connection so it can be used from any
+    thread.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.created = False
+
+    def connect(self):
+        if not self.created:
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+        db = sqlite3.connect(self.path)
+        if not self.created:
+            db.executescript(SCHEMA)
+            self.created = True
+        return db
+
+    def query(self, sql, *args):
+        db = self.connect()
+        try:
+            return db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+
+    def replace(self, table, rows):
+        """ Replace everything in the table with the rows """
+        with self.lock:
+            db = self.connect()
+            try:
+                with db:
+                    db.execute("DELETE FROM {}".format(table))
+                    if rows:
+                        marks = ",".join("?"*len(rows[0]))
+                        db.executemany("INSERT INTO {} VALUES ({})".format(
+                            table, marks), rows)
+            finally:
+                db.close()
+
+    # -------------------------------------------------------------------------
+    # Modules
+    # -------------------------------------------------------------------------
+    def load_modules(self):
+        """ Load the module index as a dict of members by module name """
+        return {name: json.loads(members) for name, members in self.query(
+            "SELECT name, members FROM modules")}
+
+    def save_modules(self, index):
+        self.replace('modules', [(name, json.dumps(members))
+                                 for name, members in index.items()])
+
+    # -------------------------------------------------------------------------
+    # Files
+    # -------------------------------------------------------------------------
+    def load_files(self):
+        """ Load the file tree as nested dicts like scan_files builds """
+        rows = self.query("SELECT path, parent, name, info FROM files "
+                          "ORDER BY length(path)")
+        nodes = {'': {'files': {}}}
+        for path, parent, name, info in rows:
+            node = {'name': name, 'info': json.loads(info) if info else None,
+                    'files': {}}
+            nodes[path] = node
+            nodes.get(parent, nodes[''])['files'][name] = node
+        return nodes['']['files']
+
+    def save_files(self, tree):
+        rows = []
+
+        def walk(files, parent):
+            for name, spec in files.items():
+                path = '{}/{}'.format(parent, name) if parent else name
+                info = spec.get('info')
+                rows.append((path, parent, name,
+                             None if info is None else json.dumps(info)))
+                walk(spec.get('files') or {}, path)
+        walk(tree, '')
+        self.replace('files', rows)
@@ -0,0 +1,240 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import re
+import struct
+import binascii
+from collections import Counter
+import numpy as np
+from atom.api import Bool, Enum, Instance, Int, List, Str, Value
+from micropyde.core.api import Model, log
+
+#: Matches any int or float in a line of text
+NUMBER_PATTERN = re.compile(
+    rb'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+
+class RingBuffer(object):
+    """ A fixed size 2D numpy buffer of samples where each column is a
+    channel. Once full the oldest samples are overwritten.
+
+    """
+
+    def __init__(self, capacity, channels):
+        self.data = np.zeros((capacity, channels))
+        self.index = 0
+        self.size = 0
+
+    @property
+    def capacity(self):
+        return self.data.shape[0]
+
+    @property
+    def channels(self):
+        return self.data.shape[1]
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, rows):
+        """ Add the rows of samples to the buffer """
+        rows = np.asarray(rows, dtype=self.data.dtype)
+        capacity = self.capacity
+        n = len(rows)
+        if n >= capacity:
+            self.data[:] = rows[-capacity:]
+            self.index = 0
+            self.size = capacity
+            return
+        first = min(n, capacity - self.index)
+        self.data[self.index:self.index+first] = rows[:first]
+        self.data[:n-first] = rows[first:]
+        self.index = (self.index + n) % capacity
+        self.size = min(self.size + n, capacity)
+
+    def values(self):
+        """ Return the samples in order from oldest to newest """
+        if self.size < self.capacity:
+            return self.data[:self.size]
+        return np.concatenate((self.data[self.index:],
+                               self.data[:self.index]))
+
+    def clear(self):
+        self.index = 0
+        self.size = 0
+
+
+def decimate(y, width):
+    """ Reduce the samples to a min/max envelope with two points per pixel
+    so the plot never draws more points than it has pixels.
+
+    Returns
+    -------
+        result: tuple
+            Tuple of the x (sample index) and y arrays
+
+    """
+    n = len(y)
+    if width <= 0 or n <= 2*width:
+        return np.arange(n), y
+    k = n // width
+    offset = n - k*width
+    bins = y[offset:].reshape(width, k)
+    x = np.repeat(offset + np.arange(width)*k + k//2, 2)
+    env = np.empty(2*width)
+    env[0::2] = bins.min(axis=1)
+    env[1::2] = bins.max(axis=1)
+    return x, env
+
+
+class TextDecoder(object):
+    """ Decodes lines of numbers, eg "x=0.1, y=0.2, z=0.9" into a row
+    per line. Lines without any numbers are skipped.
+
+    """
+
+    def __init__(self):
+        self.remainder = b''
+
+    def feed(self, data):
+        lines = (self.remainder + data).split(b'\n')
+        self.remainder = lines.pop()
+        rows = []
+        for line in lines:
+            values = NUMBER_PATTERN.findall(line)
+            if values:
+                rows.append([float(v) for v in values])
+        return rows
+
+
+class StructDecoder(object):
+    """ Decodes binary frames made up of a sync header followed by a
+    struct packed record, eg header aa55 and format '<3f'.
+
+    """
+
+    def __init__(self, header, fmt):
+        self.header = header
+        self.record = struct.Struct(fmt)
+        self.remainder = b''
+
+    def feed(self, data):
+        data = self.remainder + data
+        header, record = self.header, self.record
+        size = len(header) + record.size
+        rows = []
+        i = end = 0
+        while True:
+            i = data.find(header, i)
+            if i == -1 or i + size > len(data):
+                break
+            rows.append(record.unpack_from(data, i+len(header)))
+            i = end = i + size
+        if i == -1:
+            #: Keep anything after the last record that could be the start
+            #: of a header
+            self.remainder = data[max(end, len(data)-len(header)+1):]
+        else:
+            self.remainder = data[i:]
+        return rows
+
+
+class Telemetry(Model):
+    """ Decodes numeric samples from the device output into ring buffers
+    so they can be plotted live and exported.
+
+    """
+
+    #: Decode data from the monitor
+    enabled = Bool().tag(config=True)
+
+    #: Line based text or binary struct frames
+    mode = Enum('text', 'struct').tag(config=True)
+
+    #: Struct format and sync header (in hex) of binary frames
+    frame_format = Str('<3f').tag(config=True)
+    frame_header = Str('aa55').tag(config=True)
+
+    #: Number of samples kept per channel
+    capacity = Int(100000).tag(config=True)
+
+    #: Channels to plot (if empty all are plotted)
+    selected = List(int).tag(config=True)
+
+    #: Sample buffer, created once the channel count is known
+    buffer = Instance(RingBuffer)
+
+    #: Number of samples received, used to trigger redraws
+    count = Int()
+
+    #: Error message if the frame format is invalid
+    error = Str()
+
+    #: Active decoder
+    decoder = Value()
+
+    def _default_decoder(self):
+        try:
+            self.error = ""
+            if self.mode == 'struct':
+                header = binascii.unhexlify(self.frame_header)
+                return StructDecoder(header, self.frame_format)
+            return TextDecoder()
+        except (struct.error, binascii.Error, ValueError) as e:
+            self.error = str(e)
+            return None
+
+    def _observe_mode(self, change):
+        if change['type'] == 'update':
+            self.reset()
+
+    _observe_frame_format = _observe_frame_header = _observe_mode
+
+    @property
+    def channels(self):
+        return self.buffer.channels if self.buffer else 0
+
+    def reset(self):
+        """ Discard all samples and recreate the decoder """
+        self.decoder = self._default_decoder()
+        self.buffer = None
+        self.count = 0
+
+    def feed(self, data):
+        """ Decode data received from the device """
+        if not self.enabled or self.decoder is None:
+            return
+        rows = self.decoder.feed(data)
+        if not rows:
+            return
+        if self.buffer is None:
+            #: The channel count is only detected again after a reset
+            #: so stray lines (ex the REPL or a banner) don't discard the
+            #: samples. Use the most common in case the first isn't a sample.
+            counts = Counter(len(r) for r in rows)
+            n = counts.most_common(1)[0][0]
+            log.debug("telemetry | Detected {} channels".format(n))
+            self.buffer = RingBuffer(self.capacity, n)
+        n = self.buffer.channels
+        rows = [r for r in rows if len(r) == n]
+        if not rows:
+            return
+        self.buffer.extend(rows)
+        self.count += len(rows)
+
+    def values(self):
+        return self.buffer.values() if self.buffer else np.zeros((0, 0))
+
+    def export_csv(self, path):
+        values = self.values()
+        header = ",".join("ch{}".format(i) for i in range(values.shape[1]))
+        np.savetxt(path, values, delimiter=',', header=header, comments='')
+
+    def export_npy(self, path):
+        np.save(path, self.values())
@@ -0,0 +1,92 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import re
+import codecs
+
+#: Matches ANSI CSI sequences, two byte escapes, and carriage returns so
+#: they can all be removed from the output in a single pass
+ESCAPE_PATTERN = re.compile(r'\x1b\[[0-?]*[ -/]*[@-~]|\x1b[@-Z\\-_]|\r')
+
+#: Longest escape sequence that will be held back if it is split between
+#: two reads
+MAX_ESCAPE_LENGTH = 32
+
+
+class TerminalBuffer(object):
+    """ A bounded buffer for bytes received from the device. Data is
+    accumulated as it arrives and converted to text once per frame when
+    the console is flushed. If the console can't keep up the oldest bytes
+    are dropped so memory use is capped.
+
+    """
+
+    def __init__(self, size=1024*1024):
+        #: Maximum number of bytes held before the oldest are dropped
+        self.size = size
+
+        #: Bytes received since the last flush
+        self.data = bytearray()
+
+        #: Number of bytes dropped due to overflow
+        self.dropped = 0
+
+        #: Incomplete escape sequence from the previous flush
+        self.pending = ''
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def __len__(self):
+        return len(self.data)
+
+    def feed(self, data):
+        """ Add data received from the device """
+        buf = self.data
+        buf += data
+        overflow = len(buf) - self.size
+        if overflow > 0:
+            del buf[:overflow]
+            self.dropped += overflow
+
+            #: The stream was cut so any partial character is invalid
+            self.decoder.reset()
+            self.pending = ''
+
+    def flush(self):
+        """ Decode and remove escape sequences from all of the buffered
+        data.
+
+        Returns
+        -------
+            text: str
+                The text to display in the console
+
+        """
+        if not self.data:
+            return ''
+        text = self.pending + self.decoder.decode(bytes(self.data))
+        self.data.clear()
+
+        #: Hold back an escape sequence that was split across reads
+        self.pending = ''
+        i = text.rfind('\x1b')
+        if (i != -1 and len(text) - i < MAX_ESCAPE_LENGTH and
+                not ESCAPE_PATTERN.match(text, i)):
+            self.pending = text[i:]
+            text = text[:i]
+        return ESCAPE_PATTERN.sub('', text)
+
+
+def tail_lines(text, n):
+    """ Return only the last n lines of text. The console only keeps a
+    limited number of lines so there is no need to insert more.
+
+    """
+    if text.count('\n') <= n:
+        return text
+    return '\n'.join(text.rsplit('\n', n)[1:])
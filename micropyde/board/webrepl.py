@@ -0,0 +1,178 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import struct
+from twisted.internet.defer import Deferred
+from micropyde.core.utils import log
+
+#: WebREPL binary request (signature, op, reserved, reserved, size,
+#: filename length, filename) and response (signature, status)
+WEBREPL_REQUEST = struct.Struct("<2sBBQLH64s")
+WEBREPL_RESPONSE = struct.Struct("<2sH")
+
+#: Request opcodes
+WEBREPL_PUT_FILE = 1
+WEBREPL_GET_FILE = 2
+WEBREPL_GET_VER = 3
+
+#: Size of each data frame
+WEBREPL_CHUNK_SIZE = 1024
+
+
+class FileTransfer(object):
+    """ Implements the WebREPL file transfer protocol. Requests are sent
+    as binary frames and the binary frames received are passed to `feed`
+    as a stream (replies may be split or combined across frames).
+
+    The deferred fires with True for a put or the file contents for a
+    get or fails with an IOError if the board rejects the request.
+
+    """
+
+    def __init__(self, send, progress=None):
+        #: Sends a binary frame
+        self.send = send
+        self.progress = progress or (lambda percent: None)
+        self.deferred = Deferred()
+        self.buffer = b''
+        self.state = None
+        self.data = []
+        self.size = 0
+        self.received = 0
+
+    def request(self, op, filename, size=0):
+        name = filename.encode()
+        if len(name) > 64:
+            raise ValueError("Filename is too long: {}".format(filename))
+        rec = WEBREPL_REQUEST.pack(b"WA", op, 0, 0, size, len(name), name)
+        #: The board reads the header before the filename
+        self.send(rec[:10])
+        self.send(rec[10:])
+
+    def put(self, filename, data):
+        """ Write the data to the filename on the board """
+        self.data = data
+        self.size = len(data)
+        self.state = 'put'
+        self.request(WEBREPL_PUT_FILE, filename, len(data))
+        return self.deferred
+
+    def get(self, filename, size=0):
+        """ Read the filename from the board. The size is only used to
+        report progress.
+
+        """
+        self.size = size
+        self.state = 'get'
+        self.request(WEBREPL_GET_FILE, filename)
+        return self.deferred
+
+    def feed(self, data):
+        """ Handle a binary frame from the board """
+        self.buffer += data
+        while self.state and self.process():
+            pass
+
+    def process(self):
+        """ Process the buffer, returns True if more may be processed """
+        state = self.state
+        if state in ('put', 'put-done', 'get', 'get-done'):
+            if len(self.buffer) < WEBREPL_RESPONSE.size:
+                return False
+            sig, code = WEBREPL_RESPONSE.unpack_from(self.buffer)
+            self.buffer = self.buffer[WEBREPL_RESPONSE.size:]
+            if sig != b"WB" or code != 0:
+                return self.done(IOError(
+                    "WebREPL request failed (status {})".format(code)))
+            if state == 'put':
+                self.send_data()
+            elif state == 'get':
+                self.state = 'get-size'
+                self.send(b"\0")
+            elif state == 'put-done':
+                return self.done(True)
+            else:
+                return self.done(b''.join(self.data))
+            return True
+        elif state == 'get-size':
+            if len(self.buffer) < 2:
+                return False
+            n, = struct.unpack_from("<H", self.buffer)
+            if n == 0:
+                self.buffer = self.buffer[2:]
+                self.state = 'get-done'
+                return True
+            if len(self.buffer) < 2 + n:
+                return False
+            chunk = self.buffer[2:2+n]
+            self.buffer = self.buffer[2+n:]
+            self.data.append(chunk)
+            self.received += n
+            if self.size:
+                self.progress(min(100, 100*self.received/self.size))
+            self.send(b"\0")
+            return True
+        return False
+
+    def send_data(self):
+        data, total = self.data, max(1, self.size)
+        for i in range(0, len(data), WEBREPL_CHUNK_SIZE):
+            self.send(data[i:i+WEBREPL_CHUNK_SIZE])
+            self.progress(100*min(total, i+WEBREPL_CHUNK_SIZE)/total)
+        self.state = 'put-done'
+
+    def done(self, result):
+        self.state = None
+        d = self.deferred
+        if not d.called:
+            if isinstance(result, Exception):
+                log.warning("webrepl | {}".format(result))
+                d.errback(result)
+            else:
+                d.callback(result)
+        return False
+
+    def cancel(self, reason):
+        """ Fail the transfer (ex if the connection drops) """
+        self.done(reason)
+
+
+class WebsocketTransport(object):
+    """ Transport given to protocols so their writes are sent as websocket
+    frames through the connection instead of directly on the socket.
+
+    """
+
+    def __init__(self, connection, transport):
+        self.connection = connection
+        self.transport = transport
+
+    @property
+    def disconnecting(self):
+        #: Checked by LineReceiver after each line
+        return self.transport.disconnecting
+
+    def write(self, data):
+        return self.connection.write(data)
+
+    def writeSequence(self, data):
+        for chunk in data:
+            self.write(chunk)
+
+    def loseConnection(self):
+        self.connection.disconnect()
+
+    def abortConnection(self):
+        self.transport.abortConnection()
+
+    def getPeer(self):
+        return self.transport.getPeer()
+
+    def getHost(self):
+        return self.transport.getHost()
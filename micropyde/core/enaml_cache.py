@@ -0,0 +1,212 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Compiled enaml modules keyed by a hash of the source, the enaml version and
+the python version instead of the file modified time. The cache can be
+built when the package is installed so the first launch doesn't compile
+anything, and it's still valid when the install directory isn't writable.
+
+Usage:
+
+    python -m micropyde.core.enaml_cache
+    python -m micropyde.core.enaml_cache --check
+
+@author: jrm
+"""
+import os
+import sys
+import json
+import marshal
+import hashlib
+import argparse
+from importlib.util import MAGIC_NUMBER
+from enaml.compat import update_code_co_filename
+from enaml.core.enaml_compiler import EnamlCompiler, COMPILER_VERSION
+from enaml.core.import_hooks import EnamlImporter, imports
+from enaml.core.parser import parse
+from enaml.version import __version__ as ENAML_VERSION
+
+#: Everything that changes the compiled code
+CACHE_TAG = 'enaml-{}-{}-cv{}'.format(
+    ENAML_VERSION, sys.implementation.cache_tag, COMPILER_VERSION)
+
+#: Root of the micropyde package
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: Built at install time
+PACKAGE_CACHE_DIR = os.path.join(PACKAGE_DIR, '__enamlcache__', CACHE_TAG)
+
+#: Used when the package directory is not writable
+USER_CACHE_DIR = os.path.join(
+    os.path.expanduser('~/.cache/micropyde/enaml'), CACHE_TAG)
+
+#: Lists the modules that were compiled and the source hash of each
+INDEX_NAME = 'index.json'
+
+
+def source_key(source):
+    """ Key of the compiled source """
+    h = hashlib.sha1(CACHE_TAG.encode())
+    h.update(MAGIC_NUMBER)
+    h.update(source.encode())
+    return h.hexdigest()
+
+
+def load_code(path, src_path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC_NUMBER)) != MAGIC_NUMBER:
+            return None
+        code = marshal.load(f)
+    return update_code_co_filename(code, src_path)
+
+
+def save_code(code, key, cache_dirs):
+    """ Save the code in the first cache dir that's writable
+
+    Returns
+    -------
+        path: str or None
+            The file written
+
+    """
+    from micropyde.core.utils import atomic_write
+    data = MAGIC_NUMBER + marshal.dumps(code)
+    for cache_dir in cache_dirs:
+        path = os.path.join(cache_dir, key + '.enamlc')
+        try:
+            atomic_write(path, data)
+            return path
+        except OSError:
+            continue
+
+
+class HashedEnamlImporter(EnamlImporter):
+    """ Loads compiled enaml modules from the package or user cache """
+
+    #: Dirs searched in order, new modules are written to the first one
+    #: that's writable
+    cache_dirs = (PACKAGE_CACHE_DIR, USER_CACHE_DIR)
+
+    def get_code(self):
+        file_info = self.file_info
+        src_path = file_info.src_path
+        if not os.path.exists(src_path):
+            return super(HashedEnamlImporter, self).get_code()
+        source = self.read_source()
+        key = source_key(source)
+        for cache_dir in self.cache_dirs:
+            path = os.path.join(cache_dir, key + '.enamlc')
+            if os.path.exists(path):
+                try:
+                    code = load_code(path, src_path)
+                except (OSError, EOFError, ValueError, TypeError):
+                    code = None
+                if code is not None:
+                    return (code, src_path)
+        code = EnamlCompiler.compile(parse(source, src_path), src_path)
+        save_code(code, key, self.cache_dirs)
+        return (code, src_path)
+
+
+def install():
+    """ Use the hashed cache for every enaml import """
+    imports.add_importer(HashedEnamlImporter)
+
+
+def find_sources(package_dir=PACKAGE_DIR):
+    """ Find every enaml file in the package
+
+    Returns
+    -------
+        sources: list
+            A list of (module name, path) tuples
+
+    """
+    package_dir = os.path.abspath(package_dir)
+    root = os.path.dirname(package_dir)
+    sources = []
+    for dirpath, dirs, files in os.walk(package_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(('.', '__')))
+        for f in sorted(files):
+            if f.endswith('.enaml'):
+                path = os.path.join(dirpath, f)
+                name = os.path.relpath(path, root)[:-len('.enaml')]
+                sources.append((name.replace(os.sep, '.'), path))
+    return sources
+
+
+def precompile(package_dir=PACKAGE_DIR, cache_dir=None):
+    """ Compile every enaml file in the package and write the index.
+
+    Parameters
+    ----------
+        package_dir: str
+            Path of the micropyde package (ex the build dir when installing)
+        cache_dir: str
+            Where to write the compiled modules, defaults to the cache dir
+            in the package
+
+    Returns
+    -------
+        index: dict
+            The source hash of each module compiled
+
+    """
+    from micropyde.core.utils import atomic_write
+    from enaml.compat import read_source
+    if cache_dir is None:
+        cache_dir = os.path.join(package_dir, '__enamlcache__', CACHE_TAG)
+    index = {}
+    for name, path in find_sources(package_dir):
+        source = read_source(path)
+        key = source_key(source)
+        index[name] = key
+        if os.path.exists(os.path.join(cache_dir, key + '.enamlc')):
+            continue
+        code = EnamlCompiler.compile(parse(source, path), path)
+        if save_code(code, key, (cache_dir,)) is None:
+            raise OSError("Could not write to {}".format(cache_dir))
+    atomic_write(os.path.join(cache_dir, INDEX_NAME),
+                 json.dumps(index, indent=2, sort_keys=True))
+    return index
+
+
+def check(package_dir=PACKAGE_DIR, cache_dirs=HashedEnamlImporter.cache_dirs):
+    """ Return the names of the modules that are not compiled yet """
+    from enaml.compat import read_source
+    missing = []
+    for name, path in find_sources(package_dir):
+        key = source_key(read_source(path))
+        if not any(os.path.exists(os.path.join(d, key + '.enamlc'))
+                   for d in cache_dirs):
+            missing.append(name)
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[3])
+    parser.add_argument('--check', action='store_true',
+                        help="Exit with an error if a module is not compiled")
+    parser.add_argument('--cache-dir',
+                        help="Where to write the modules (default: {})".format(
+                            PACKAGE_CACHE_DIR))
+    args = parser.parse_args()
+    if args.check:
+        missing = check()
+        for name in missing:
+            print("Not compiled: {}".format(name))
+        raise SystemExit(1 if missing else 0)
+    cache_dir = args.cache_dir
+    if cache_dir is None:
+        cache_dir = (PACKAGE_CACHE_DIR if os.access(PACKAGE_DIR, os.W_OK)
+                     else USER_CACHE_DIR)
+    index = precompile(cache_dir=cache_dir)
+    print("Compiled {} modules to {}".format(len(index), cache_dir))
+
+
+if __name__ == '__main__':
+    main()
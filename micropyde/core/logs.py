@@ -0,0 +1,225 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Logging is done through a queue so the ui and transfers never wait on the
+console or disk, a rate limit keeps high frequency loggers (ex transport
+data) from flooding it, and transport data can be written to a binary
+trace for debugging instead of being logged.
+
+Usage:
+
+    python -m micropyde.core.logs ~/.config/micropyde/logs/transport.trace
+
+@author: jrm
+"""
+import sys
+import time
+import queue
+import struct
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+
+#: Loggers whose level can be set in the settings and their default
+SUBSYSTEMS = OrderedDict([
+    ('micropyde', 'INFO'),
+    ('micropyde.transport', 'WARNING'),
+    ('twisted', 'INFO'),
+    ('parso', 'ERROR'),
+    ('ipykernel', 'WARNING'),
+    ('traitlets', 'WARNING'),
+])
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+#: Transport trace directions
+RX = 0
+TX = 1
+
+#: Trace file layout
+TRACE_MAGIC = b'MPYTRACE1\n'
+TRACE_RECORD = struct.Struct('<dBHI')
+
+#: Active listener and transport trace
+_listener = None
+trace = None
+
+
+class RateLimitFilter(logging.Filter):
+    """ Drop records when more than `rate` per second are logged (allowing
+    bursts up to `burst`). The number dropped is added to the next record
+    that gets through.
+
+    """
+
+    def __init__(self, rate=50, burst=200):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            self.dropped += 1
+            return False
+        self.tokens -= 1
+        if self.dropped:
+            record.msg = "{} ({} messages suppressed)".format(
+                record.getMessage(), self.dropped)
+            record.args = None
+            self.dropped = 0
+        return True
+
+
+class TransportTrace(object):
+    """ Writes transport data as binary records so it can be inspected
+    without formatting every chunk as a log message. Each record is the
+    time, direction, connection name and data.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'ab', buffering=1 << 16)
+        if self.file.tell() == 0:
+            self.file.write(TRACE_MAGIC)
+
+    def record(self, direction, name, data):
+        if isinstance(data, str):
+            data = data.encode()
+        name = name.encode()
+        header = TRACE_RECORD.pack(time.time(), direction, len(name),
+                                   len(data))
+        with self.lock:
+            f = self.file
+            if f is None:
+                return
+            f.write(header)
+            f.write(name)
+            f.write(data)
+
+    def close(self):
+        with self.lock:
+            f, self.file = self.file, None
+        if f is not None:
+            f.close()
+
+
+def read_trace(path):
+    """ Read the records in a transport trace
+
+    Yields
+    ------
+        record: tuple
+            The time, direction, connection name and data
+
+    """
+    size = TRACE_RECORD.size
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError("{} is not a transport trace".format(path))
+        while True:
+            header = f.read(size)
+            if len(header) < size:
+                return
+            t, direction, n, length = TRACE_RECORD.unpack(header)
+            name = f.read(n).decode()
+            yield t, direction, name, f.read(length)
+
+
+# -----------------------------------------------------------------------------
+# Global API
+# -----------------------------------------------------------------------------
+def start_logging(handlers):
+    """ Send every record through a queue to the handlers which are run on
+    the listener thread.
+
+    """
+    global _listener
+    stop_logging()
+    q = queue.SimpleQueue()
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        if isinstance(h, QueueHandler):
+            root.removeHandler(h)
+    root.addHandler(QueueHandler(q))
+    _listener = QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """ Write out any queued records and stop the listener """
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def set_levels(levels):
+    """ Set the level of each subsystem logger, using the defaults for any
+    not given. The root logger allows everything so the subsystem levels
+    decide what's logged.
+
+    """
+    logging.getLogger().setLevel(logging.DEBUG)
+    for name, default in SUBSYSTEMS.items():
+        level = levels.get(name, default)
+        logging.getLogger(name).setLevel(getattr(logging, level, default))
+
+
+def set_rate_limit(name, rate):
+    """ Limit the logger to `rate` records per second, zero to disable """
+    logger = logging.getLogger(name)
+    for f in logger.filters[:]:
+        if isinstance(f, RateLimitFilter):
+            logger.removeFilter(f)
+    if rate:
+        logger.addFilter(RateLimitFilter(rate, burst=rate*4))
+
+
+def start_trace(path):
+    global trace
+    stop_trace()
+    trace = TransportTrace(path)
+    return trace
+
+
+def stop_trace():
+    global trace
+    t, trace = trace, None
+    if t is not None:
+        t.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a transport trace")
+    parser.add_argument('trace', help="Path to the trace")
+    parser.add_argument('--name', help="Only show this connection")
+    args = parser.parse_args()
+    start = None
+    for t, direction, name, data in read_trace(args.trace):
+        if args.name and name != args.name:
+            continue
+        if start is None:
+            start = t
+        sys.stdout.write("{:>10.4f} {} {} {!r}\n".format(
+            t - start, 'TX' if direction == TX else 'RX', name, data))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,19 +10,69 @@ Created on Dec 6, 2017
 @author: jrm
 """
 import os
-import json
+import time
 import enaml
+import logging
+import threading
 import traceback
 import jsonpickle as pickle
-from atom.api import Atom, Str, List, Member
+from atom.api import Atom, Float, Int, Str, List, Member, Value
 from enaml.workbench.plugin import Plugin as EnamlPlugin
 from twisted.internet import reactor
-from .utils import log, clip
+from twisted.internet.threads import deferToThread
+from .utils import atomic_write, log, clip
 
 
 # -----------------------------------------------------------------------------
 # Core models
 # -----------------------------------------------------------------------------
+def config_state(obj):
+    """ Return the values of the members tagged with `config=True`.
+    Only values that were set are read so no defaults are computed while
+    saving (ex loading a document that was never shown).
+
+    """
+    state = {}
+    for name, member in obj.members().items():
+        metadata = member.metadata
+        if not metadata or not metadata.get('config', False):
+            continue
+        value = member.get_slot(obj)
+        if value is not None:
+            state[name] = value
+    return state
+
+
+class StateWriter(object):
+    """ Encodes and writes versions of a plugin's state in the thread
+    pool. Nothing is assigned to the plugin from the thread and an older
+    version never replaces a newer one.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.written = 0
+
+    def write(self, path, version, state):
+        """ Encode and write the state. Encoding happens first so any
+        failure doesn't wipe out the previous state.
+
+        Returns
+        -------
+            written: bool
+                Whether the state was written (False if a newer one was)
+
+        """
+        text = pickle.encode(state, indent=2)
+        with self.lock:
+            if version <= self.written:
+                return False
+            atomic_write(path, text)
+            self.written = version
+        return True
+
+
 class Model(Atom):
     """ An atom object that can exclude members from it's state
     by tagging the member with .tag(persist=False)
@@ -34,23 +84,19 @@ class Model(Atom):
         `config=True`.
 
         """
-        state = super(Model, self).__getstate__()
-        for name, member in self.members().items():
-            metadata = member.metadata
-            if (name in state and (not metadata or
-                    not metadata.get('config', False))):
-                del state[name]
-        return state
+        return config_state(self)
 
     def __setstate__(self, state):
         """  Set the state ignoring any fields that fail to set which
         may occur due to version changes.
 
         """
+        debug = log.isEnabledFor(logging.DEBUG)
         for key, value in state.items():
-            log.debug("Restoring state '{}.{} = {}'".format(
-                self, key, clip(value)
-            ))
+            if debug:
+                log.debug("Restoring state '{}.{} = {}'".format(
+                    self, key, clip(value)
+                ))
             try:
                 setattr(self, key, value)
             except Exception as e:
@@ -64,6 +110,9 @@ class Plugin(EnamlPlugin):
     """ A plugin that behaves like a model and saves it's state
     when any atom member tagged with config=True triggers a save.
 
+    Saves are delayed so a burst of changes is written once. The state is
+    encoded and written in a thread and replaces the file atomically.
+
     Also optionally registers itself in the settings
 
     """
@@ -73,6 +122,24 @@ class Plugin(EnamlPlugin):
     _state_excluded = List()
     _state_members = List(Member)
 
+    #: Seconds to wait after a change before saving. Changes during the
+    #: wait restart it, up to the max delay since the first change.
+    _state_save_delay = Float(1.0)
+    _state_save_max_delay = Float(5.0)
+
+    #: Pending save and when the first change it's waiting on was made
+    _state_save_call = Value()
+    _state_save_requested = Float()
+
+    #: Incremented for each snapshot so an older write never replaces
+    #: a newer one
+    _state_version = Int()
+    _state_written = Int()
+
+    #: Snapshot being written (kept so it can be flushed on exit)
+    _state_snapshot = Value()
+    _state_writer = Value(factory=StateWriter)
+
     # -------------------------------------------------------------------------
     # Plugin API
     # -------------------------------------------------------------------------
@@ -82,8 +149,12 @@ class Plugin(EnamlPlugin):
         self._bind_observers()
 
     def stop(self):
-        """ Unload any state observers when the plugin stops"""
+        """ Unload any state observers when the plugin stops and write
+        any pending changes.
+
+        """
         self._unbind_observers()
+        self.flush_state()
 
     def run_command(self, protocol,  *args, **kwargs):
         """ Run a command without blocking using twisted's spawnProcess
@@ -101,6 +172,24 @@ class Plugin(EnamlPlugin):
         """ Manually trigger a save """
         self._save_state({'type': 'request'})
 
+    def flush_state(self):
+        """ Write any pending changes now (in the calling thread) """
+        call = self._state_save_call
+        if call is not None and call.active():
+            call.cancel()
+            self._state_save_call = None
+            self._state_snapshot = self._snapshot_state()
+        snapshot = self._state_snapshot
+        if snapshot is not None:
+            version, state = snapshot
+            try:
+                self._state_writer.write(self._state_file, version, state)
+            except Exception:
+                log.warning("Failed to save state: {}".format(
+                    traceback.format_exc()))
+                return
+            self._state_saved(version)
+
     def _default__state_file(self):
         return os.path.expanduser(
             "~/.config/micropyde/{}.json".format(self.manifest.id))
@@ -134,41 +223,59 @@ class Plugin(EnamlPlugin):
             self.observe(member.name, self._save_state)
 
     def _save_state(self, change):
-        """ Try to save the plugin state """
-        if change['type'] in ['update', 'container', 'request']:
-            try:
-                log.info("Saving state due to change: {}".format(change))
-
-                #: Dump first so any failure to encode doesn't wipe out the
-                #: previous state
-                state = self.__getstate__()
-                excluded = ['manifest', 'workbench'] + [
-                    m.name for m in self.members().values()
-                    if not m.metadata or not m.metadata.get('config', False)
-                ]
-                for k in excluded+self._state_excluded:
-                    if k in state:
-                        del state[k]
-                state = pickle.dumps(state)
-
-                #: Pretty format it
-                state = json.dumps(json.loads(state), indent=2)
-
-                dst = os.path.dirname(self._state_file)
-                if not os.path.exists(dst):
-                    os.makedirs(dst)
-
-                with open(self._state_file, 'w') as f:
-                    f.write(state)
+        """ Schedule a save of the plugin state """
+        if change['type'] not in ['update', 'container', 'request']:
+            return
+        now = time.time()
+        call = self._state_save_call
+        if call is not None and call.active():
+            #: Coalesce with the pending save
+            if now - self._state_save_requested < self._state_save_max_delay:
+                call.reset(self._state_save_delay)
+            return
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Saving state due to change: {}".format(
+                clip(change, 200)))
+        self._state_save_requested = now
+        self._state_save_call = reactor.callLater(
+            self._state_save_delay, self._save_state_later)
+
+    def _save_state_later(self):
+        self._state_save_call = None
+        self._state_snapshot = version, state = self._snapshot_state()
+        d = deferToThread(self._state_writer.write, self._state_file,
+                          version, state)
+        #: Callbacks run in the reactor thread so observers do too
+        d.addCallback(lambda written: self._state_saved(version))
+        d.addErrback(lambda f: log.warning("Failed to save state: {}".format(
+            f.getTraceback())))
+
+    def _snapshot_state(self):
+        """ Copy the state so it can be encoded in another thread while
+        the plugin keeps changing. Only the values that were set are read
+        so no defaults are computed.
 
-            except Exception as e:
-                log.warning("Failed to save state: {}".format(
-                    traceback.format_exc()
-                ))
+        """
+        state = config_state(self)
+        for k in self._state_excluded:
+            state.pop(k, None)
+        for k, v in state.items():
+            if isinstance(v, list):
+                state[k] = list(v)
+            elif isinstance(v, dict):
+                state[k] = dict(v)
+        self._state_version += 1
+        return self._state_version, state
+
+    def _state_saved(self, version):
+        """ Record that the state up to the version was written """
+        self._state_written = max(self._state_written, version)
+        snapshot = self._state_snapshot
+        if snapshot is not None and snapshot[0] <= version:
+            self._state_snapshot = None
 
     def _unbind_observers(self):
         """ Setup state observers """
         for member in self._state_members:
             self.unobserve(member.name, self._save_state)
 
-
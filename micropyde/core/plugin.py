@@ -9,39 +9,67 @@ The full license is in the file LICENSE, distributed with this software.
 """
 import os
 import sys
+import time
 import logging
 from logging.handlers import RotatingFileHandler
-from atom.api import Str
+from atom.api import Bool, Dict, Enum, Int, Str, Value, observe
+from . import logs
 from .api import Plugin
 
 
 class CorePlugin(Plugin):
 
+    _log_dir = Str()
     _log_filename = Str()
     _log_format = Str(
         '%(asctime)-15s | %(levelname)-7s | %(name)s | %(message)s')
 
+    #: Level of each subsystem logger by name (see logs.SUBSYSTEMS)
+    log_levels = Dict().tag(config=True)
+
+    #: Only log messages at or above this level to stdout
+    log_stdout_level = Enum(*logs.LEVELS).tag(config=True)
+
+    #: Max transport messages logged per second, zero for no limit
+    log_transport_rate = Int(50).tag(config=True)
+
+    #: Write the transport data to a binary trace
+    trace_transport = Bool().tag(config=True)
+
+    #: Set by init_logging
+    _stream_handler = Value()
+
     def start(self):
         """ Setup logging """
-        self.init_logging()
         super(CorePlugin, self).start()
+        self.init_logging()
 
-    def _default__log_filename(self):
+    def stop(self):
+        super(CorePlugin, self).stop()
+        logs.stop_trace()
+        logs.stop_logging()
+
+    def _default__log_dir(self):
         log_dir = os.path.expanduser('~/.config/micropyde/logs')
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
-        return os.path.join(log_dir, 'micropyde.txt')
+        return log_dir
+
+    def _default__log_filename(self):
+        return os.path.join(self._log_dir, 'micropyde.txt')
 
     def init_logging(self):
-        """ Log to stdout and the file """
-        root = logging.getLogger()
-        root.setLevel(logging.DEBUG)
+        """ Log to stdout and the file from a queue so logging never
+        blocks the caller.
+
+        """
         formatter = logging.Formatter(self._log_format)
 
         #: Log to stdout
         stream = logging.StreamHandler(sys.stdout)
-        stream.setLevel(logging.DEBUG)
+        stream.setLevel(self.log_stdout_level)
         stream.setFormatter(formatter)
+        self._stream_handler = stream
 
         #: Log to rotating handler
         disk = RotatingFileHandler(
@@ -52,14 +80,34 @@ class CorePlugin(Plugin):
         disk.setLevel(logging.DEBUG)
         disk.setFormatter(formatter)
 
-        root.addHandler(disk)
-        root.addHandler(stream)
+        logs.start_logging([disk, stream])
+        self._refresh_logging()
 
         #: Start twisted logger
         from twisted.python.log import PythonLoggingObserver
         observer = PythonLoggingObserver()
         observer.start()
 
-        #: Disable annoying logs
-        parso = logging.getLogger('parso.python.diff')
-        parso.setLevel(logging.ERROR)
+    @observe('log_levels', 'log_stdout_level', 'log_transport_rate',
+             'trace_transport')
+    def _refresh_logging(self, change=None):
+        if change and change['type'] == 'create':
+            return
+        logs.set_levels(self.log_levels)
+        logs.set_rate_limit('micropyde.transport', self.log_transport_rate)
+        if self._stream_handler is not None:
+            self._stream_handler.setLevel(self.log_stdout_level)
+        if self.trace_transport and logs.trace is None:
+            path = os.path.join(self._log_dir, 'transport-{}.trace'.format(
+                time.strftime('%Y%m%d-%H%M%S')))
+            logs.start_trace(path)
+            logging.getLogger('micropyde').info(
+                "Writing transport trace to {}".format(path))
+        elif not self.trace_transport:
+            logs.stop_trace()
+
+    def set_log_level(self, name, level):
+        """ Set the level of a subsystem logger and save it """
+        levels = dict(self.log_levels)
+        levels[name] = level
+        self.log_levels = levels
@@ -0,0 +1,273 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Records where startup time goes: module imports (including compiling
+enaml files), plugin starts and dock item creation. The result is saved as
+a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev) and
+a text report sorted by self time.
+
+Usage:
+
+    micropyde --profile-startup startup.json
+    python -m micropyde.core.profiler startup.json --sort total
+
+@author: jrm
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+
+#: The active profiler, if any
+_profiler = None
+
+
+class Span(object):
+    __slots__ = ('cat', 'name', 'start', 'duration', 'children', 'depth')
+
+    def __init__(self, cat, name, start, depth):
+        self.cat = cat
+        self.name = name
+        self.start = start
+        self.depth = depth
+        self.duration = 0.0
+        self.children = 0.0
+
+    @property
+    def self_time(self):
+        return self.duration - self.children
+
+
+class StartupProfiler(object):
+    """ Collects nested timing spans from the main thread. Imports are
+    timed by wrapping the import machinery so enaml modules are included.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.origin = time.perf_counter()
+        self.thread = threading.get_ident()
+        self.spans = []
+        self.stack = []
+        self.marks = []
+        self._find_and_load = None
+
+    # -------------------------------------------------------------------------
+    # Recording
+    # -------------------------------------------------------------------------
+    def begin(self, cat, name):
+        span = Span(cat, name, time.perf_counter(), len(self.stack))
+        self.stack.append(span)
+        return span
+
+    def end(self, span):
+        span.duration = time.perf_counter() - span.start
+        #: Errors can leave spans open above this one
+        while self.stack and self.stack.pop() is not span:
+            pass
+        if self.stack:
+            self.stack[-1].children += span.duration
+        self.spans.append(span)
+
+    @contextmanager
+    def span(self, cat, name):
+        if threading.get_ident() != self.thread:
+            yield
+            return
+        span = self.begin(cat, name)
+        try:
+            yield
+        finally:
+            self.end(span)
+
+    def mark(self, name):
+        """ Record an instant event (ex when the window is shown) """
+        self.marks.append((name, time.perf_counter()))
+
+    def install(self):
+        """ Time every module imported from now on """
+        import importlib._bootstrap as bootstrap
+        find_and_load = self._find_and_load = bootstrap._find_and_load
+        modules = sys.modules
+
+        def timed_find_and_load(name, import_):
+            if name in modules or threading.get_ident() != self.thread:
+                return find_and_load(name, import_)
+            span = self.begin('import', name)
+            try:
+                return find_and_load(name, import_)
+            finally:
+                self.end(span)
+        bootstrap._find_and_load = timed_find_and_load
+
+    def uninstall(self):
+        if self._find_and_load is not None:
+            import importlib._bootstrap as bootstrap
+            bootstrap._find_and_load = self._find_and_load
+            self._find_and_load = None
+
+    # -------------------------------------------------------------------------
+    # Output
+    # -------------------------------------------------------------------------
+    def to_trace(self):
+        """ Convert the spans to the Chrome trace event format """
+        pid = os.getpid()
+        origin = self.origin
+
+        def us(t):
+            return round(t * 1e6, 1)
+
+        events = [{
+            'name': s.name, 'cat': s.cat, 'ph': 'X', 'pid': pid, 'tid': 0,
+            'ts': us(s.start - origin), 'dur': us(s.duration),
+            'args': {'self': us(s.self_time)},
+        } for s in sorted(self.spans, key=lambda s: (s.start, s.depth))]
+        events.extend({
+            'name': name, 'cat': 'mark', 'ph': 'i', 's': 'g', 'pid': pid,
+            'tid': 0, 'ts': us(t - origin)} for name, t in self.marks)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self):
+        """ Write the trace and the text report next to it
+
+        Returns
+        -------
+            paths: tuple
+                The trace and report paths
+
+        """
+        from micropyde.core.utils import atomic_write
+        trace = self.to_trace()
+        atomic_write(self.path, json.dumps(trace).encode())
+        report = os.path.splitext(self.path)[0] + '.txt'
+        atomic_write(report, format_report(trace['traceEvents']).encode())
+        return self.path, report
+
+
+def load_trace(path):
+    with open(path) as f:
+        return json.load(f)['traceEvents']
+
+
+def format_report(events, sort='self', category=None, limit=40):
+    """ Format the trace events as a table
+
+    Parameters
+    ----------
+        events: list
+            Chrome trace events
+        sort: str
+            Column to sort by: self, total or start
+        category: str
+            Only include events in this category (ex import, plugin, dock)
+        limit: int
+            Max number of rows, zero for all
+
+    Returns
+    -------
+        report: str
+
+    """
+    spans = [e for e in events if e['ph'] == 'X' and
+             (category is None or e['cat'] == category)]
+    marks = [e for e in events if e['ph'] == 'i']
+    key = {
+        'self': lambda e: -e['args']['self'],
+        'total': lambda e: -e['dur'],
+        'start': lambda e: e['ts'],
+    }[sort]
+    spans.sort(key=key)
+    if limit:
+        spans = spans[:limit]
+
+    lines = []
+    for e in sorted(marks, key=lambda e: e['ts']):
+        lines.append("{:>10.1f} ms  {}".format(e['ts']/1000, e['name']))
+    if marks:
+        lines.append("")
+
+    totals = {}
+    for e in events:
+        if e['ph'] == 'X':
+            totals[e['cat']] = totals.get(e['cat'], 0) + e['args']['self']
+    lines.append("Self time by category")
+    for cat, total in sorted(totals.items(), key=lambda it: -it[1]):
+        lines.append("{:>10.1f} ms  {}".format(total/1000, cat))
+    lines.append("")
+
+    lines.append("{:>10} {:>10} {:>10}  {:<8} {}".format(
+        "self ms", "total ms", "start ms", "category", "name"))
+    for e in spans:
+        lines.append("{:>10.1f} {:>10.1f} {:>10.1f}  {:<8} {}".format(
+            e['args']['self']/1000, e['dur']/1000, e['ts']/1000,
+            e['cat'], e['name']))
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------------------------------------------------------
+# Global API
+# -----------------------------------------------------------------------------
+def start_profiler(path):
+    """ Start profiling the startup and save the results to path """
+    global _profiler
+    _profiler = StartupProfiler(path)
+    _profiler.install()
+    return _profiler
+
+
+def stop_profiler():
+    """ Stop profiling and save the results.
+
+    Returns
+    -------
+        paths: tuple or None
+            The trace and report paths or None if not profiling
+
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return
+    profiler.uninstall()
+    return profiler.save()
+
+
+@contextmanager
+def profile(cat, name):
+    """ Time the block if the startup is being profiled """
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.span(cat, name):
+            yield
+
+
+def mark(name):
+    if _profiler is not None:
+        _profiler.mark(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[3])
+    parser.add_argument('trace', help="Trace saved by --profile-startup")
+    parser.add_argument('--sort', choices=('self', 'total', 'start'),
+                        default='self')
+    parser.add_argument('--category',
+                        help="Only show one category (ex import or plugin)")
+    parser.add_argument('--limit', type=int, default=40,
+                        help="Max number of rows, 0 for all")
+    args = parser.parse_args()
+    print(format_report(load_trace(args.trace), args.sort, args.category,
+                        args.limit), end='')
+
+
+if __name__ == '__main__':
+    main()
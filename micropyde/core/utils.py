@@ -11,10 +11,12 @@ Created on Jul 12, 2015
 """
 import os
 import sys
+import enaml
 import logging
+import tempfile
+import importlib
 from enaml.image import Image
 from enaml.icon import Icon, IconImage
-from enaml.application import timed_call
 from twisted.internet.defer import Deferred
 
 
@@ -23,14 +25,65 @@ from twisted.internet.defer import Deferred
 # -----------------------------------------------------------------------------
 log = logging.getLogger("micropyde")
 
+#: Data sent to and received from the board. This is high frequency so it's
+#: rate limited and off (WARNING) by default
+transport_log = logging.getLogger("micropyde.transport")
+
 
 def clip(s, n=1000):
     """ Shorten the name of a large value when logging"""
     v = str(s)
     if len(v) > n:
-        v[:n]+"..."
+        v = v[:n]+"..."
     return v
 
+# -----------------------------------------------------------------------------
+# File helpers
+# -----------------------------------------------------------------------------
+def atomic_write(path, data):
+    """ Write the data to a temp file next to the path then rename it over
+    the path so it's never left partially written.
+
+    """
+    dirname = os.path.dirname(path) or '.'
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.' + os.path.basename(path),
+                               suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+# -----------------------------------------------------------------------------
+# Enaml helpers
+# -----------------------------------------------------------------------------
+#: Cache for objects loaded from enaml modules
+_ENAML_CACHE = {}
+
+
+def load_enaml(module, name):
+    """ Import an object (ex a dialog) from an enaml module the first time
+    it's used and reuse it after that.
+
+    """
+    key = (module, name)
+    obj = _ENAML_CACHE.get(key)
+    if obj is None:
+        with enaml.imports():
+            mod = importlib.import_module(module)
+        obj = _ENAML_CACHE[key] = getattr(mod, name)
+    return obj
+
+
 # -----------------------------------------------------------------------------
 # Icon and Image helpers
 # -----------------------------------------------------------------------------
@@ -74,6 +127,8 @@ def menu_icon(name):
 
 
 def async_sleep(ms):
+    #: Imported here so the qt reactor can be installed first
+    from twisted.internet import reactor
     d = Deferred()
-    timed_call(ms, d.callback, True)
+    reactor.callLater(ms/1000.0, d.callback, True)
     return d
\ No newline at end of file
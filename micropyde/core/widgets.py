@@ -9,7 +9,7 @@ Created on Dec 7, 2017
 
 @author: jrm
 """
-from atom.api import Instance
+from atom.api import Bool, Instance, Str
 from enaml.core.declarative import d_
 from enaml.widgets.api import DockArea, DockItem
 from enaml.workbench.api import Plugin
@@ -26,6 +26,24 @@ class PickableDockItem(DockItem):
     #: Plugin this item uses
     plugin = d_(Instance(Plugin))
 
+    #: Id of the plugin. If the plugin was not given it's started when the
+    #: item is first shown.
+    plugin_id = d_(Str())
+
+    #: Set once the item is first shown. Items with costly content can
+    #: wait for this before creating it so startup stays fast.
+    loaded = d_(Bool())
+
+    def _observe_loaded(self, change):
+        """ Start the plugin before the content waiting on `loaded` is
+        created.
+
+        """
+        if self.loaded and self.plugin is None and self.plugin_id:
+            from micropyde.core.workbench import MicropydeWorkbench
+            workbench = MicropydeWorkbench.instance()
+            self.plugin = workbench.get_plugin(self.plugin_id)
+
     def __getstate__(self):
         """ Get the pickle state for the dock item.
 
@@ -10,10 +10,15 @@ The full license is in the file LICENSE, distributed with this software.
 import enamlx
 enamlx.install()
 
+from micropyde.core import enaml_cache
+enaml_cache.install()
+
 import enaml
-from atom.api import Str
+from atom.api import Bool, Int, List, Str
 from enaml.qt import QtWidgets
 from enaml.workbench.ui.api import UIWorkbench
+from micropyde.core import logs, profiler
+from micropyde.core.utils import log
 
 
 class MicropydeWorkbench(UIWorkbench):
@@ -23,6 +28,22 @@ class MicropydeWorkbench(UIWorkbench):
     #: For error messages
     app_name = Str('Micropython IDE')
 
+    #: Quit once the window is ready (used when profiling the startup)
+    exit_after_startup = Bool()
+
+    #: Dialogs imported when the app is idle after starting so they open
+    #: quickly the first time
+    preload_modules = List(default=[
+        'micropyde.editor.dialogs',
+        'micropyde.ui.settings',
+        'micropyde.esp.dialogs',
+        'micropyde.ocd.dialogs',
+        'micropyde.firmware.dialogs',
+    ])
+
+    #: Time between each preloaded module (ms)
+    preload_interval = Int(100)
+
     @classmethod
     def instance(cls):
         return cls._instance
@@ -105,8 +126,75 @@ class MicropydeWorkbench(UIWorkbench):
         #: Init the ui
         ui = self.get_plugin('enaml.workbench.ui')
         ui.show_window()
+        profiler.mark('window shown')
+        ui._application.timed_call(0, self._check_started)
 
         #: Start the core plugin
         plugin = self.get_plugin('micropyde.core')
+
+        #: Run the reactor from the Qt event loop so threads (deferToThread)
+        #: and system event triggers work
+        from twisted.internet import reactor
+        reactor.runReturn(installSignalHandlers=False)
         ui.start_application()
         #self.unregister('enaml.workbench.ui')
+
+        #: Plugins are not stopped on exit so write any pending changes
+        self.flush_state()
+        if reactor.running:
+            #: Wait for pending writes in the thread pool
+            reactor.stop()
+            reactor.runUntilCurrent()
+        logs.stop_trace()
+        logs.stop_logging()
+
+    def get_plugin(self, plugin_id, force_create=True):
+        """ Time plugins being created and started when profiling """
+        if plugin_id in self._plugins or not force_create:
+            return super(MicropydeWorkbench, self).get_plugin(
+                plugin_id, force_create)
+        with profiler.profile('plugin', plugin_id):
+            return super(MicropydeWorkbench, self).get_plugin(plugin_id)
+
+    def _check_started(self):
+        """ Wait until the dock area is shown to finish the startup
+        profile.
+
+        """
+        ui = self.get_plugin('enaml.workbench.ui')
+        workspace = ui.workspace
+        if workspace is None or workspace.content is None or \
+                not workspace.content.find('dock_area'):
+            ui._application.timed_call(10, self._check_started)
+            return
+        profiler.mark('ready')
+        paths = profiler.stop_profiler()
+        if paths:
+            log.info("Startup profile saved to {}".format(" and ".join(paths)))
+        if self.exit_after_startup:
+            ui.close_window()
+            ui.stop_application()
+            return
+        ui._application.timed_call(self.preload_interval, self._preload_next,
+                                   list(self.preload_modules))
+
+    def _preload_next(self, modules):
+        """ Import one module at a time so the ui stays responsive """
+        if not modules:
+            return
+        name = modules.pop(0)
+        try:
+            with enaml.imports():
+                __import__(name)
+        except Exception as e:
+            log.debug("Failed to preload {}: {}".format(name, e))
+        ui = self.get_plugin('enaml.workbench.ui')
+        ui._application.timed_call(self.preload_interval, self._preload_next,
+                                   modules)
+
+    def flush_state(self):
+        """ Write the pending state changes of every plugin that started """
+        for plugin_id in list(self._manifests):
+            plugin = self.get_plugin(plugin_id, force_create=False)
+            if hasattr(plugin, 'flush_state'):
+                plugin.flush_state()
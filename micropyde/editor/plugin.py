@@ -9,6 +9,8 @@ The full license is in the file LICENSE, distributed with this software.
 """
 import os
 import jedi
+import mmap
+import codecs
 import enaml
 from glob import glob
 
@@ -25,6 +27,10 @@ from . import inspection
 from enaml.scintilla.themes import THEMES
 from enaml.scintilla.mono_font import MONO_FONT
 
+#: Size of the chunks used when reading and writing large files
+CHUNK_SIZE = 1024*1024
+
+
 def editor_item_factory():
     with enaml.imports():
         from .editor import EditorDockItem
@@ -36,6 +42,38 @@ def create_editor_item(*args, **kwargs):
     return EditorDockItem(*args, **kwargs)
 
 
+def get_editor_plugin():
+    from micropyde.core.workbench import MicropydeWorkbench
+    workbench = MicropydeWorkbench.instance()
+    return workbench.get_plugin('micropyde.editor')
+
+
+def iter_chunks(path, chunk_size=CHUNK_SIZE):
+    """ Read the file using a memory map and yield the decoded text in
+    chunks. An incremental decoder is used so multibyte characters split
+    across chunks are decoded correctly.
+
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for i in range(0, len(data), chunk_size):
+                yield decoder.decode(data[i:i+chunk_size])
+    yield decoder.decode(b'', final=True)
+
+
+def write_chunks(path, source, chunk_size=CHUNK_SIZE):
+    """ Write the source to the file in chunks so a large document is
+    never encoded all at once.
+
+    """
+    with open(path, 'w') as f:
+        for i in range(0, len(source), chunk_size):
+            f.write(source[i:i+chunk_size])
+
+
 class Document(Model):
     #: Name of the current document
     name = Str().tag(config=True)
@@ -47,6 +85,9 @@ class Document(Model):
     #: Any unsaved changes
     unsaved = Bool(True).tag(config=True)
 
+    #: Large documents are memory mapped and skip linting and completion
+    large = Bool()
+
     #: Any linting errors
     errors = List()
 
@@ -63,16 +104,54 @@ class Document(Model):
         """
         try:
             print("Loading '{}' from disk.".format(self.name))
+            if self.large:
+                #: The editor uses iter_source so this is only needed if a
+                #: large document is saved before it's edited
+                return "".join(iter_chunks(self.name))
             with open(self.name) as f:
                 return f.read()
         except Exception as e:
             self.errors = [str(e)]
         return ""
 
+    def iter_source(self, chunk_size=CHUNK_SIZE):
+        """ Yield the source in chunks. If it has not been loaded yet a
+        large document is read from the memory map a chunk at a time
+        without ever joining it.
+
+        """
+        source = Document.source.get_slot(self)
+        if source is not None or not self.large:
+            source = self.source
+            for i in range(0, len(source), chunk_size):
+                yield source[i:i+chunk_size]
+            return
+        try:
+            for chunk in iter_chunks(self.name, chunk_size):
+                yield chunk
+        except Exception as e:
+            self.errors = [str(e)]
+
+    def _default_large(self):
+        """ Check the size of the file against the editor's threshold
+        """
+        try:
+            plugin = get_editor_plugin()
+            size = os.path.getsize(self.name)
+            return size > plugin.large_file_size*1024
+        except Exception:
+            return False
+
     def _observe_source(self, change):
+        if self.large:
+            #: Don't lint, complete, or reread large files on every change.
+            #: The editor marks them as unsaved when they're edited.
+            return
         try:
             self._update_errors(change)
-            self._update_suggestions(change)
+            if change['type'] != 'create':
+                #: Nothing is being typed when the document is loaded
+                self._update_suggestions(change)
         except Exception as e:
             log.error(e)
         if change['type'] == 'update':
@@ -99,9 +178,7 @@ class Document(Model):
         """ Determine code completion suggestions for the current cursor
         position in the document.
         """
-        from micropyde.core.workbench import MicropydeWorkbench
-        workbench = MicropydeWorkbench.instance()
-        plugin = workbench.get_plugin('micropyde.editor')
+        plugin = get_editor_plugin()
         self.suggestions = plugin.autocomplete(self.source, self.cursor)
 
 
@@ -127,10 +204,13 @@ class EditorPlugin(Plugin):
     theme = Enum('friendly', *THEMES.keys()).tag(config=True)
     zoom = Int(0).tag(config=True)  #: Relative to default
 
+    #: Files larger than this (in KB) are opened in large file mode
+    large_file_size = Int(1024).tag(config=True)
+
     #: TODO: Detect from upy_path
     upy_board = Enum('esp8266', 'pyb', 'stm32', 'teensy', 'unix',
                      'windows', 'cc3200', 'zephyr', 'pic16bit',
-                     'minimal').tag(config=True)
+                     'minimal', 'esp32', 'rp2').tag(config=True)
     upy_path = Str(os.path.abspath(
         '../micropython/micropython/')).tag(config=True)
     upy_lib_path = Str(os.path.abspath(
@@ -208,10 +288,14 @@ class EditorPlugin(Plugin):
             removed = old.difference(new)
             added = new.difference(old)
         elif change['type'] == 'load':
-            removed = {item.doc for item in self.get_editor_items()}
-            added = set(self.documents)
+            if self._restore_area_layout(area):
+                return
+            #: Reuse the items that already exist (ex the main item)
+            existing = {item.doc for item in self.get_editor_items()}
+            added = [d for d in self.documents if d not in existing]
 
-        #: Update operations to apply
+        #: Update operations to apply, these are applied in one batch so
+        #: the area is only laid out once
         ops = []
         removed_targets = set()
 
@@ -222,42 +306,93 @@ class EditorPlugin(Plugin):
                     removed_targets.add(item.name)
                     ops.append(RemoveItem(item=item.name))
 
-        # Remove ops
-        if ops:
-            log.debug(ops)
-            area.update_layout(ops)
-
-        # Add each one at a time
-        targets = set([item.name for item in area.dock_items()
-                   if (item.name.startswith("editor-item") and
-                   item.name not in removed_targets)])
+        targets = [item.name for item in self.get_editor_items()
+                   if item.name not in removed_targets]
 
         log.info(
             "Editor added=%s removed=%s targets=%s",
-            added, removed, targets)
-
+            len(added), len(removed), len(targets))
 
         # Sort documents so active is last so it's on top when we restore
         # from a previous state
+        items = []
         for doc in sorted(added, key=lambda d: int(d == self.active_document)):
             item = create_editor_item(area, plugin=self, doc=doc)
             if targets:
-                op = InsertTab(item=item.name, target=list(targets)[-1])
-                try:
-                    area.update_layout(op)
-                except Exception as e:
-                    # If it fails to add as a tab just insert it
-                    log.exception(e)
-                    op = InsertItem(item=item.name)
-                    area.update_layout(op)
+                ops.append(InsertTab(item=item.name, target=targets[-1]))
             else:
-                op = InsertItem(item=item.name)
-                area.update_layout(op)
-            targets.add(item.name)
+                ops.append(InsertItem(item=item.name))
+            targets.append(item.name)
+            items.append(item)
+
+        #: The last tab inserted is shown so move the active one after them
+        if items and change['type'] == 'load':
+            for item in self.get_editor_items():
+                if item.doc == self.active_document and item not in items:
+                    ops.append(InsertTab(item=item.name, target=targets[-1]))
+
+        if ops and change['type'] == 'load':
+            #: Don't load every tab as it's inserted, only the ones shown
+            with area.suppress_dock_events():
+                area.update_layout(ops)
+            timed_call(0, self._load_visible_items)
+        elif ops:
+            area.update_layout(ops)
 
         # Now save it
         self.save_dock_area(change)
 
+    def _restore_area_layout(self, area):
+        """ Create the items for the documents that don't have one and apply
+        the saved layout once instead of inserting them one at a time.
+        Documents that are not in the saved layout are added as tabs after.
+
+        Returns
+        -------
+            result: bool
+                Whether the saved layout was restored
+
+        """
+        ui = self.workbench.get_plugin('micropyde.ui')
+        if ui.saved_layout is None:
+            return False
+        existing = {item.doc for item in self.get_editor_items()}
+        items = [create_editor_item(area, plugin=self, doc=doc)
+                 for doc in self.documents if doc not in existing]
+        with area.suppress_dock_events():
+            missing = ui.restore_layout(area)
+        if missing is None:
+            for item in items:
+                item.destroy()
+            return False
+        targets = [item.name for item in self.get_editor_items()
+                   if item.name not in missing]
+        ops = []
+        for name in missing:
+            if targets:
+                ops.append(InsertTab(item=name, target=targets[-1]))
+            else:
+                ops.append(InsertItem(item=name))
+            targets.append(name)
+        if ops:
+            with area.suppress_dock_events():
+                area.update_layout(ops)
+        timed_call(0, self._load_visible_items)
+        log.info("Restored the dock layout with %s editors",
+                 len(self.documents))
+        return True
+
+    def _load_visible_items(self):
+        """ Load the items shown after the layout was changed with the dock
+        events suppressed. The others load when they're first selected.
+
+        """
+        for item in self.get_dock_area().dock_items():
+            if getattr(item, 'loaded', True) or not item.proxy_is_active:
+                continue
+            if item.proxy.widget.isVisible():
+                item.loaded = True
+
     def save_dock_area(self, change):
         """ Save the dock area """
         self._area_saves_pending += 1
@@ -290,7 +425,7 @@ class EditorPlugin(Plugin):
         dock_item = self.get_dock_area().find(item)
         if not dock_item:
             return None
-        return dock_item.children[0].editor
+        return dock_item.get_editor()
 
     def get_terminal(self):
         return self.get_dock_area().find('monitor-item')
@@ -351,12 +486,16 @@ class EditorPlugin(Plugin):
 
         #: Otherwise open it
         doc = Document(name=path, unsaved=False)
-        with open(path) as f:
-            doc.source = f.read()
+        if doc.large:
+            #: The source is mapped in and loaded by the editor in chunks
+            log.info("Opening '{}' in large file mode".format(path))
+        else:
+            with open(path) as f:
+                doc.source = f.read()
         self.documents.append(doc)
         self.active_document = doc
         editor = self.get_editor()
-        if editor:
+        if editor and not doc.large:
             editor.set_text(doc.source)
 
     def save_file(self, event):
@@ -368,8 +507,7 @@ class EditorPlugin(Plugin):
         file_dir = os.path.dirname(doc.name)
         if not os.path.exists(file_dir):
             os.makedirs(file_dir)
-        with open(doc.name, 'w') as f:
-            f.write(doc.source)
+        write_chunks(doc.name, doc.source)
         doc.unsaved = False
 
     def save_file_as(self, event):
@@ -388,8 +526,7 @@ class EditorPlugin(Plugin):
         if not os.path.exists(doc_dir):
             os.makedirs(doc_dir)
 
-        with open(path, 'w') as f:
-            f.write(doc.source)
+        write_chunks(path, doc.source)
 
     # -------------------------------------------------------------------------
     # Code inspection API
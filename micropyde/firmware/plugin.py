@@ -0,0 +1,231 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import os
+import shutil
+from collections import deque
+from atom.api import Atom, Bool, Enum, Int, Str, Value, Callable
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.protocol import ProcessProtocol
+from micropyde.core.api import Plugin, log
+from micropyde.board.compiler import should_compile
+
+#: Ports whose directory is not the board name
+PORT_DIRS = {'pyb': 'stm32'}
+
+#: Images each port builds, in order of preference
+FIRMWARE_IMAGES = {
+    'esp8266': ('firmware-combined.bin', 'firmware.bin'),
+    'esp32': ('firmware.bin',),
+    'stm32': ('firmware.elf', 'firmware.hex'),
+    'rp2': ('firmware.elf',),
+}
+
+#: Ports flashed with esptool, the rest use pyocd
+ESP_PORTS = ('esp8266', 'esp32')
+
+#: Generated manifest that freezes the project modules
+MANIFEST_TEMPLATE = """# Generated by micropyde, do not edit
+{include}freeze({path!r}, (
+{modules}))
+"""
+
+
+class BuildProtocol(Atom, ProcessProtocol):
+    """ Collects the output of make. Only the last `max_lines` lines are
+    kept since a full build prints a lot.
+
+    """
+    #: Called with the output after each chunk is received
+    output = Callable()
+
+    #: Fired with the exit code when make exits
+    done = Value(factory=Deferred)
+
+    max_lines = Int(500)
+    lines = Value()
+
+    def _default_lines(self):
+        return deque(maxlen=self.max_lines)
+
+    def outReceived(self, data):
+        self.lines.extend(data.decode(errors='replace').splitlines())
+        if self.output:
+            self.output("\n".join(self.lines))
+
+    errReceived = outReceived
+
+    def processEnded(self, reason):
+        self.done.callback(reason.value.exitCode)
+
+
+class FirmwarePlugin(Plugin):
+    #: Board variant passed to make as BOARD= (ex GENERIC)
+    board_variant = Str().tag(config=True)
+
+    #: Number of parallel jobs, zero uses every cpu
+    jobs = Int(0).tag(config=True)
+
+    #: Use ccache when it's installed
+    use_ccache = Bool(True).tag(config=True)
+
+    #: Extra arguments for make
+    make_args = Str().tag(config=True)
+
+    #: Tool to flash the image with
+    flash_with = Enum('auto', 'esp', 'ocd').tag(config=True)
+
+    #: Last image built
+    image = Str().tag(config=True)
+
+    #: Whether a build is running
+    building = Bool()
+
+    # -------------------------------------------------------------------------
+    # Build API
+    # -------------------------------------------------------------------------
+    def get_port(self):
+        """ Name of the port to build for the configured board """
+        editor = self.workbench.get_plugin('micropyde.editor')
+        return PORT_DIRS.get(editor.upy_board, editor.upy_board)
+
+    def get_port_path(self):
+        editor = self.workbench.get_plugin('micropyde.editor')
+        return os.path.join(editor.upy_path, 'ports', self.get_port())
+
+    def get_build_path(self):
+        """ The build directory is kept between builds so make only rebuilds
+        what changed.
+
+        """
+        name = 'build-micropyde'
+        if self.board_variant:
+            name += '-{}'.format(self.board_variant)
+        return os.path.join(self.get_port_path(), name)
+
+    def find_modules(self, path):
+        """ Find the modules in the project to freeze. boot.py and main.py
+        are left for the filesystem.
+
+        """
+        modules = []
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for f in sorted(files):
+                if should_compile(f):
+                    modules.append(os.path.relpath(
+                        os.path.join(root, f), path).replace(os.sep, '/'))
+        return modules
+
+    def generate_manifest(self):
+        """ Write the frozen manifest into the build directory. It is only
+        rewritten when it changes so make does not rebuild everything.
+
+        Returns
+        -------
+            path: str
+                The path to the manifest
+
+        """
+        editor = self.workbench.get_plugin('micropyde.editor')
+        port_path = self.get_port_path()
+        include = ''
+        if os.path.exists(os.path.join(port_path, 'boards', 'manifest.py')):
+            include = 'include("$(PORT_DIR)/boards/manifest.py")\n'
+        modules = self.find_modules(editor.project_path)
+        text = MANIFEST_TEMPLATE.format(
+            include=include, path=os.path.abspath(editor.project_path),
+            modules="".join("    {!r},\n".format(m) for m in modules))
+
+        build_path = self.get_build_path()
+        path = os.path.join(build_path, 'micropyde_manifest.py')
+        if os.path.exists(path):
+            with open(path) as f:
+                if f.read() == text:
+                    return path
+        os.makedirs(build_path, exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+        log.info("Freezing {} modules from {}".format(
+            len(modules), editor.project_path))
+        return path
+
+    def build_cmd(self, manifest):
+        cmd = [shutil.which('make') or 'make',
+               '-C', self.get_port_path(),
+               '-j{}'.format(self.jobs or os.cpu_count() or 1),
+               'BUILD={}'.format(self.get_build_path()),
+               'FROZEN_MANIFEST={}'.format(manifest)]
+        if self.board_variant:
+            cmd.append('BOARD={}'.format(self.board_variant))
+        if (self.use_ccache and self.get_port() != 'esp32' and
+                shutil.which('ccache')):
+            #: The esp32 port builds with cmake which uses IDF_CCACHE_ENABLE
+            cmd.append('CC=ccache $(CROSS_COMPILE)gcc')
+        cmd.extend(self.make_args.split())
+        return cmd
+
+    def build(self, protocol):
+        """ Build the firmware with the project modules frozen in.
+
+        Returns
+        -------
+            result: Deferred
+                A deferred that fires with the path to the image or None
+                if the build failed
+
+        """
+        if self.building:
+            raise RuntimeError("A build is already running")
+        editor = self.workbench.get_plugin('micropyde.editor')
+        port_path = self.get_port_path()
+        if not os.path.isdir(port_path):
+            log.warning("No port found at {}, check the micropython "
+                        "path and board".format(port_path))
+            return succeed(None)
+        cmd = self.build_cmd(self.generate_manifest())
+        env = os.environ.copy()
+        if self.use_ccache and shutil.which('ccache'):
+            env.setdefault('IDF_CCACHE_ENABLE', '1')
+        self.building = True
+        self.run_command(protocol, *cmd, env=env, path=editor.upy_path)
+
+        def on_done(code):
+            self.building = False
+            if code != 0:
+                log.warning("Firmware build failed ({})".format(code))
+                return
+            image = self.find_image()
+            if image:
+                self.image = image
+                log.info("Built {}".format(image))
+            else:
+                log.warning("Build finished but no image was found in "
+                            "{}".format(self.get_build_path()))
+            return image
+        return protocol.done.addCallback(on_done)
+
+    def find_image(self):
+        build_path = self.get_build_path()
+        names = FIRMWARE_IMAGES.get(
+            self.get_port(), ('firmware.elf', 'firmware.bin', 'firmware.hex'))
+        for name in names:
+            path = os.path.join(build_path, name)
+            if os.path.exists(path):
+                return path
+
+    def get_flasher(self):
+        """ The plugin id used to flash the image """
+        if self.flash_with == 'auto':
+            return 'esp' if self.get_port() in ESP_PORTS else 'ocd'
+        return self.flash_with
+
+    def clean(self):
+        """ Remove the build directory so the next build starts over """
+        shutil.rmtree(self.get_build_path(), ignore_errors=True)
@@ -15,7 +15,6 @@ from atom.api import (
     Atom, List, Instance, ForwardInstance, Str, Bool, Int, Value, Enum
 )
 from micropyde.core.api import Plugin, log
-from pyocd.tools.lists import ListGenerator
 from twisted.internet import utils
 from twisted.internet.protocol import ProcessProtocol
 
@@ -139,25 +138,25 @@ class OpenChipDebuggerPlugin(Plugin):
     flash_format = Enum('auto', 'bin', 'hex', 'elf').tag(config=True)
 
     def _default_available_probes(self):
+        from pyocd.tools.lists import ListGenerator
         return [Probe(**d) for d in ListGenerator.list_probes()['boards']]
 
     def _default_available_targets(self):
+        from pyocd.tools.lists import ListGenerator
         targets = [Target(**d) for d in ListGenerator.list_targets()['targets']]
         targets.sort(key=lambda it: it.name)
         return targets
 
     def _default_available_boards(self):
+        from pyocd.tools.lists import ListGenerator
         return [Board(**d) for d in ListGenerator.list_boards()['boards']]
 
     # -------------------------------------------------------------------------
     # Plugin API
     # -------------------------------------------------------------------------
-    def start(self):
-        super(OpenChipDebuggerPlugin, self).start()
-        self.refresh()
-
     def refresh(self):
-        """ Refresh pyocd targets, probes, and boards
+        """ Refresh pyocd targets, probes, and boards. These are loaded
+        when first used since importing pyocd is slow.
 
         """
         self.available_targets = self._default_available_targets()
@@ -0,0 +1,204 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Saves the dock area layout as a compact description (only the values that
+differ from the defaults) instead of pickling the whole area.
+
+@author: jrm
+"""
+import os
+import json
+import threading
+from enaml.layout.dock_layout import (
+    AreaLayout, DockBarLayout, DockLayout, ItemLayout, SplitLayout, TabLayout
+)
+from enaml.layout.geometry import Rect
+from micropyde.core.api import log
+from micropyde.core.utils import atomic_write
+
+#: Layout types by name and the members saved for each. Child layouts are
+#: in `item` or `items`.
+LAYOUT_TYPES = {
+    'dock': (DockLayout, ()),
+    'area': (AreaLayout, ('floating', 'geometry', 'linked', 'maximized')),
+    'bar': (DockBarLayout, ('position',)),
+    'split': (SplitLayout, ('orientation', 'sizes')),
+    'tabs': (TabLayout, ('tab_position', 'index', 'maximized')),
+    'item': (ItemLayout, ('name', 'floating', 'geometry', 'linked',
+                          'maximized')),
+}
+
+#: Default value of each member
+DEFAULTS = {
+    'floating': False,
+    'geometry': [-1, -1, -1, -1],
+    'linked': False,
+    'maximized': False,
+    'position': 'top',
+    'orientation': 'horizontal',
+    'sizes': [],
+    'tab_position': 'top',
+    'index': 0,
+}
+
+
+def layout_to_dict(layout):
+    """ Convert the layout to a dict of the values that aren't defaults """
+    for kind, (cls, members) in LAYOUT_TYPES.items():
+        if type(layout) is cls or (cls is SplitLayout and
+                                   isinstance(layout, cls)):
+            break
+    else:
+        raise TypeError("Unknown layout {}".format(layout))
+    data = {'type': kind}
+    for name in members:
+        value = getattr(layout, name)
+        if isinstance(value, Rect):
+            value = list(value)
+        if value != DEFAULTS.get(name):
+            data[name] = value
+    if kind == 'area':
+        if layout.item is not None:
+            data['item'] = layout_to_dict(layout.item)
+        if layout.dock_bars:
+            data['dock_bars'] = [layout_to_dict(b) for b in layout.dock_bars]
+    elif kind != 'item':
+        data['items'] = [layout_to_dict(i) for i in layout.items]
+    return data
+
+
+def layout_from_dict(data, available=None):
+    """ Create the layout from a dict made by layout_to_dict. If the names
+    of the available items are given any others (or duplicates) are
+    removed and containers left with one or no items are collapsed.
+
+    Returns
+    -------
+        layout: DockLayout or None
+            The layout or None if nothing is left
+
+    """
+    if available is not None:
+        available = set(available)
+    return _layout_from_dict(data, available)
+
+
+def _layout_from_dict(data, available):
+    kind = data['type']
+    cls, members = LAYOUT_TYPES[kind]
+    kwargs = {name: data[name] for name in members if name in data}
+    if 'geometry' in kwargs:
+        kwargs['geometry'] = Rect(*kwargs['geometry'])
+    if kind == 'item':
+        if available is not None:
+            if data['name'] not in available:
+                return None
+            available.discard(data['name'])
+        return ItemLayout(**kwargs)
+    if kind == 'area':
+        item = data.get('item')
+        if item is not None:
+            item = _layout_from_dict(item, available)
+        bars = [_layout_from_dict(b, available)
+                for b in data.get('dock_bars', [])]
+        bars = [b for b in bars if b is not None]
+        if item is None and not bars:
+            return None
+        return AreaLayout(item, dock_bars=bars, **kwargs)
+    items = [_layout_from_dict(i, available) for i in data.get('items', [])]
+    items = [i for i in items if i is not None]
+    if kind == 'dock':
+        return DockLayout(*items)
+    if not items:
+        return None
+    if kind in ('split', 'tabs') and len(items) == 1 and \
+            len(data['items']) > 1:
+        return items[0]
+    if kind == 'split' and len(kwargs.get('sizes', [])) != len(items):
+        kwargs.pop('sizes', None)
+    if kind == 'tabs':
+        kwargs['index'] = min(kwargs.get('index', 0), len(items) - 1)
+    return cls(*items, **kwargs)
+
+
+def layout_items(layout):
+    """ Return the names of every item in the layout """
+    if isinstance(layout, ItemLayout):
+        return {layout.name}
+    names = set()
+    children = list(getattr(layout, 'items', []))
+    if isinstance(layout, AreaLayout):
+        children = ([layout.item] if layout.item else []) + layout.dock_bars
+    for child in children:
+        names.update(layout_items(child))
+    return names
+
+
+class LayoutStore(object):
+    """ Saves the layout in a background thread. Only layouts that differ
+    from the last one saved are written.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.saved = None
+        self.version = 0
+        self.written = 0
+
+    def load(self):
+        """ Load the layout description
+
+        Returns
+        -------
+            data: dict or None
+                The layout saved or None if there isn't one
+
+        """
+        try:
+            with open(self.path) as f:
+                text = f.read()
+            data = json.loads(text)
+        except (OSError, ValueError) as e:
+            if os.path.exists(self.path):
+                log.warning("Failed to load the layout: {}".format(e))
+            return None
+        self.saved = text
+        return data
+
+    def save(self, layout, blocking=False):
+        """ Save the layout if it changed.
+
+        Returns
+        -------
+            result: Deferred or None
+                A deferred that fires when written or None if the layout
+                didn't change (or blocking is set)
+
+        """
+        text = json.dumps(layout_to_dict(layout), sort_keys=True,
+                          separators=(',', ':'))
+        if text == self.saved:
+            return None
+        self.saved = text
+        self.version += 1
+        if blocking:
+            self.write(self.version, text)
+            return None
+        from twisted.internet.threads import deferToThread
+        d = deferToThread(self.write, self.version, text)
+        d.addErrback(lambda f: log.warning("Failed to save the layout: {}".format(
+            f.getErrorMessage())))
+        return d
+
+    def write(self, version, text):
+        with self.lock:
+            if version <= self.written:
+                return  #: A newer layout was already written
+            atomic_write(self.path, text)
+            self.written = version
@@ -9,11 +9,14 @@ Created on Dec 12, 2017
 
 @author: jrm
 """
+import os
 import enaml
-from atom.api import Atom, List, Str, Instance, Dict
+from atom.api import Atom, List, Str, Instance, Dict, Value
 from micropyde.core.api import Plugin, DockItem, log
+from micropyde.core.profiler import profile
 from enaml.layout.api import AreaLayout, DockBarLayout, HSplitLayout, TabLayout
 from . import extensions
+from .layout import LayoutStore, layout_from_dict, layout_items
 
 
 class MicropydePlugin(Plugin):
@@ -24,6 +27,12 @@ class MicropydePlugin(Plugin):
     dock_items = List(DockItem)
     dock_layout = Instance(AreaLayout)
 
+    #: Saves the layout of the dock area
+    layout_store = Instance(LayoutStore)
+
+    #: Layout description loaded from the store (None if there isn't one)
+    saved_layout = Value()
+
     #: Settings pages to add
     settings_pages = List(extensions.SettingsPage)
 
@@ -73,12 +82,13 @@ class MicropydePlugin(Plugin):
     def create_new_area(self):
         """ Create the dock area
         """
-        with enaml.imports():
-            from .dock import DockView
-        area = DockView(
-            workbench=self.workbench,
-            plugin=self
-        )
+        with profile('dock', 'dock_area'):
+            with enaml.imports():
+                from .dock import DockView
+            area = DockView(
+                workbench=self.workbench,
+                plugin=self
+            )
         return area
 
     def get_dock_area(self):
@@ -90,9 +100,63 @@ class MicropydePlugin(Plugin):
         """
         ui = self.workbench.get_plugin('enaml.workbench.ui')
         if not ui.workspace or not ui.workspace.content:
-            ui.select_workspace('micropyde.workspace')
+            with profile('ui', 'select_workspace'):
+                ui.select_workspace('micropyde.workspace')
         return ui.workspace.content.find('dock_area')
 
+    def _default_layout_store(self):
+        return LayoutStore(os.path.expanduser('~/.config/micropyde/layout.json'))
+
+    def _default_saved_layout(self):
+        return self.layout_store.load()
+
+    def restore_layout(self, area):
+        """ Apply the saved layout to the area in one pass. Items that no
+        longer exist are dropped from it.
+
+        Returns
+        -------
+            missing: list or None
+                Names of the items that are not in the saved layout and
+                still need to be added, or None if it was not applied
+                because there is no saved layout or an item from a plugin
+                is missing from it (ex one was added since it was saved).
+
+        """
+        data = self.saved_layout
+        if data is None:
+            return None
+        names = {item.name for item in area.dock_items()}
+        try:
+            layout = layout_from_dict(data, names)
+        except (KeyError, TypeError, ValueError) as e:
+            log.warning("Invalid saved layout: {}".format(e))
+            return None
+        if layout is None:
+            return None
+        missing = names - layout_items(layout)
+        plugin_items = {item.name for item in self.dock_items}
+        if missing & plugin_items:
+            log.debug("Saved layout is missing items: {}".format(missing))
+            return None
+        with profile('dock', 'restore_layout'):
+            area.apply_layout(layout)
+        return sorted(missing)
+
+    def save_layout(self, blocking=False):
+        """ Save the layout of the dock area if it changed """
+        ui = self.workbench.get_plugin('enaml.workbench.ui')
+        if not ui.workspace or not ui.workspace.content:
+            return
+        area = ui.workspace.content.find('dock_area')
+        if area is None or not area.proxy_is_active:
+            return
+        return self.layout_store.save(area.save_layout(), blocking=blocking)
+
+    def flush_state(self):
+        super(MicropydePlugin, self).flush_state()
+        self.save_layout(blocking=True)
+
     def _refresh_dock_items(self, change=None):
         """ Reload all DockItems registered by any Plugins
 
@@ -115,11 +179,18 @@ class MicropydePlugin(Plugin):
         dock_items = []
         for extension in sorted(point.extensions, key=lambda ext: ext.rank):
             for declaration in extension.get_children(extensions.DockItem):
-                #: Create the item
-                DockItem = declaration.factory()
-                item = DockItem(
-                    plugin=workbench.get_plugin(declaration.plugin_id),
-                )
+                #: Create the item. Only the plugins of the main items are
+                #: started now, the others when their item is first shown.
+                name = getattr(declaration.factory, '__name__', '')
+                with profile('dock', '{}.{}'.format(declaration.plugin_id,
+                                                    name)):
+                    DockItem = declaration.factory()
+                    item = DockItem(
+                        plugin_id=declaration.plugin_id,
+                        plugin=workbench.get_plugin(
+                            declaration.plugin_id,
+                            force_create=declaration.layout == 'main'),
+                    )
 
                 #: Add to our layout
                 layout[declaration.layout].append(item.name)
@@ -161,6 +232,18 @@ class MicropydePlugin(Plugin):
     def _default_settings_page(self):
         return self.settings_pages[0]
 
+    def _default_settings_typemap(self):
+        """ Map each settings model type to its page. This starts the plugin
+        of every page so it's only done when the settings are opened.
+
+        """
+        typemap = {}
+        for d in self.settings_pages:
+            plugin = self.workbench.get_plugin(d.plugin_id)
+            t = type(getattr(plugin, d.model) if d.model else plugin)
+            typemap[t] = d.factory()
+        return typemap
+
     def _observe_settings_page(self, change):
         log.debug("Settings page: {}".format(change))
 
@@ -175,19 +258,14 @@ class MicropydePlugin(Plugin):
         point = workbench.get_extension_point(extensions.SETTINGS_PAGE_POINT)
 
         settings_pages = []
-        typemap = {}
         for extension in sorted(point.extensions, key=lambda ext: ext.rank):
-            for d in extension.get_children(extensions.SettingsPage):
-                #: Save it
-                settings_pages.append(d)
-
-                #: Update the type map
-                plugin = self.workbench.get_plugin(d.plugin_id)
-                t = type(getattr(plugin, d.model) if d.model else plugin)
-                typemap[t] = d.factory()
+            settings_pages.extend(
+                extension.get_children(extensions.SettingsPage))
 
         #: Update items
         log.debug("Updating settings pages: {}".format(settings_pages))
 
-        self.settings_typemap = typemap
         self.settings_pages = settings_pages
+
+        #: The typemap is rebuilt when the settings are next opened
+        del self.settings_typemap
@@ -11,8 +11,6 @@ Created on Jan 1, 2018
 """
 from __future__ import print_function
 
-import jsonpickle as pickle
-
 from atom.api import Str
 
 from enaml.widgets.api import Container
@@ -55,36 +53,25 @@ class MicropydeWorkspace(Workspace):
         registered on start.
 
         """
-        self.save_area()
+        self.save_area(blocking=True)
         self.workbench.unregister(self._manifest_id)
 
-    def save_area(self):
-        """ Save the dock area for the workspace.
+    def save_area(self, blocking=False):
+        """ Save the dock area layout for the workspace if it changed.
 
         """
-        area = self.content.find('dock_area')
+        plugin = self.workbench.get_plugin("micropyde.ui")
         try:
-            with open('micropyde.workspace.db', 'w') as f:
-                f.write(pickle.dumps(area))
+            return plugin.save_layout(blocking=blocking)
         except Exception as e:
             print("Error saving dock area: {}".format(e))
             return e
 
     def load_area(self):
-        """ Load the dock area into the workspace content.
+        """ Load the dock area into the workspace content. The saved layout
+        is applied by the editor once the editor items are created.
 
         """
-        area = None
         plugin = self.workbench.get_plugin("micropyde.ui")
-        try:
-            #with open('inkcut.workspace.db', 'r') as f:
-            #    area = pickle.loads(f.read())
-            pass  #: TODO:
-        except Exception as e:
-            print(e)
-        if area is None:
-            print("Creating new area")
-            area = plugin.create_new_area()
-        else:
-            print("Loading existing doc area")
+        area = plugin.create_new_area()
         area.set_parent(self.content)
@@ -9,7 +9,29 @@ Created on Dec 5, 2017
 
 @author
 """
+import os
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
+
+
+class BuildWithEnamlCache(build_py):
+    """ Compile the enaml files into the package so the first launch
+    doesn't have to. It's skipped if enaml is not available when building.
+
+    """
+    def run(self):
+        super().run()
+        try:
+            from micropyde.core.enaml_cache import CACHE_TAG, precompile
+        except ImportError as e:
+            self.warn("Not compiling enaml files: {}".format(e))
+            return
+        #: Modules are keyed by their source so it can be compiled from here
+        cache_dir = os.path.join(self.build_lib, 'micropyde', '__enamlcache__',
+                                 CACHE_TAG)
+        index = precompile(self.get_package_dir('micropyde'), cache_dir)
+        self.announce("Compiled {} enaml modules".format(len(index)), 2)
+
 
 setup(
   name='micropyde',
@@ -23,13 +45,14 @@ setup(
   packages=find_packages(),
   include_package_data=True,
   version='1.0',
+  cmdclass={'build_py': BuildWithEnamlCache},
   entry_points={
         'console_scripts': ['micropyde = micropyde.app:main'],
     },
   install_requires=[
       'PyQt5', 'enaml', 'enamlx', 'QScintilla', 'twisted', 'autobahn',
       'qt5reactor', 'qtconsole', 'jsonpickle', 'jedi',
-      'pyserial', 'pyflakes',
+      'pyserial', 'pyflakes', 'numpy',
       'esptool', 'pyOCD',
   ],
 )
@@ -0,0 +1,115 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import os
+import shutil
+import tempfile
+import time
+from autobahn.twisted.websocket import (
+    WebSocketServerFactory, WebSocketServerProtocol
+)
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.protocol import Factory, Protocol
+from twisted.trial.unittest import TestCase
+from micropyde.board.discovery import (
+    Discovery, DiscoveryCache, parse_networks, probe
+)
+
+
+def cache_path(test):
+    """ Return a path in a directory that's removed after the test """
+    path = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, path)
+    return os.path.join(path, 'discovery.json')
+
+
+class HttpServer(Protocol):
+    """ Replies to anything like a web server that isn't a WebSocket """
+
+    def dataReceived(self, data):
+        self.transport.write(b"HTTP/1.1 200 OK\r\n\r\n")
+
+
+class SilentServer(Protocol):
+    """ Accepts the connection but never replies """
+
+
+class ProbeTest(TestCase):
+
+    def listen(self, factory, interface='127.0.0.1', port=0):
+        listener = reactor.listenTCP(port, factory, interface=interface)
+        self.addCleanup(listener.stopListening)
+        return listener.getHost().port
+
+    def listen_websocket(self, interface='127.0.0.1', port=0):
+        factory = WebSocketServerFactory()
+        factory.protocol = WebSocketServerProtocol
+        return self.listen(factory, interface, port)
+
+    @inlineCallbacks
+    def test_websocket(self):
+        port = self.listen_websocket()
+        result = yield probe('127.0.0.1', port, timeout=1)
+        self.assertTrue(result)
+
+    @inlineCallbacks
+    def test_not_websocket(self):
+        port = self.listen(Factory.forProtocol(HttpServer))
+        result = yield probe('127.0.0.1', port, timeout=1)
+        self.assertFalse(result)
+
+    @inlineCallbacks
+    def test_timeout(self):
+        port = self.listen(Factory.forProtocol(SilentServer))
+        start = time.time()
+        result = yield probe('127.0.0.1', port, timeout=0.2)
+        self.assertFalse(result)
+        self.assertLess(time.time() - start, 1)
+
+    @inlineCallbacks
+    def test_scan(self):
+        #: Only the WebSocket listener is reported and cached
+        port = self.listen_websocket('127.0.0.2')
+        self.listen(Factory.forProtocol(HttpServer), '127.0.0.3', port)
+        cache = DiscoveryCache(cache_path(self))
+        found = []
+        discovery = Discovery(cache, concurrency=4, timeout=1)
+        networks = parse_networks('127.0.0.2/31')
+        addresses = yield discovery.scan(networks, port, found.append)
+        self.assertEqual(addresses, ['127.0.0.2'])
+        self.assertEqual(found, ['127.0.0.2'])
+        self.assertFalse(discovery.scanning)
+        self.assertEqual(DiscoveryCache(cache.path).addresses(port),
+                         ['127.0.0.2'])
+
+
+class DiscoveryCacheTest(TestCase):
+
+    def test_expire(self):
+        cache = DiscoveryCache(cache_path(self), ttl=60)
+        now = time.time()
+        cache.add('192.168.1.10', 8266, now=now - 120)
+        cache.add('192.168.1.11', 8266, now=now - 30)
+        cache.add('192.168.1.12', 8266, now=now - 10)
+        self.assertEqual(cache.addresses(8266),
+                         ['192.168.1.12', '192.168.1.11'])
+
+        #: Entries also expire once they're stale on disk
+        cache.save()
+        cache.expire(now=now + 45)
+        self.assertEqual(cache.addresses(), ['192.168.1.12'])
+        self.assertEqual(DiscoveryCache(cache.path, ttl=20).addresses(),
+                         ['192.168.1.12'])
+
+    def test_port(self):
+        cache = DiscoveryCache(cache_path(self))
+        cache.add('192.168.1.10', 8266)
+        cache.add('192.168.1.11', 8267)
+        self.assertEqual(cache.addresses(8267), ['192.168.1.11'])
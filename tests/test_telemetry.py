@@ -0,0 +1,46 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+from twisted.trial.unittest import TestCase
+from micropyde.board.telemetry import StructDecoder, Telemetry
+
+
+class StructDecoderTest(TestCase):
+
+    def test_split_header(self):
+        decoder = StructDecoder(b'\xaa\x55', '<B')
+        self.assertEqual(decoder.feed(b'xx\xaa'), [])
+        self.assertEqual(decoder.feed(b'\x55\x09'), [(9,)])
+
+    def test_record_boundary(self):
+        #: The end of a decoded record can't be reused as part of a header
+        decoder = StructDecoder(b'\xaa\x55', '<B')
+        self.assertEqual(decoder.feed(b'\xaa\x55\xaa'), [(0xaa,)])
+        self.assertEqual(decoder.feed(b'\x55\x07\xaa\x55\x01'), [(1,)])
+
+
+class TelemetryTest(TestCase):
+
+    def test_channels(self):
+        telemetry = Telemetry(enabled=True)
+        telemetry.feed(b"banner 1 2\n1,2,3\n4,5,6\n")
+        self.assertEqual(telemetry.channels, 3)
+        self.assertEqual(telemetry.count, 2)
+
+        #: Rows that don't match are dropped without losing the samples
+        telemetry.feed(b"MicroPython v1.19\n7,8,9\n")
+        self.assertEqual(telemetry.channels, 3)
+        self.assertEqual(telemetry.values().tolist(),
+                         [[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+
+        #: Until it's reset
+        telemetry.reset()
+        telemetry.feed(b"1 2\n")
+        self.assertEqual(telemetry.channels, 2)
+        self.assertEqual(telemetry.count, 1)
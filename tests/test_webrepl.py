@@ -0,0 +1,106 @@
+"""
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+@author: jrm
+"""
+import os
+import shutil
+import struct
+import tempfile
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.protocol import Protocol
+from twisted.trial.unittest import TestCase
+from micropyde.board.plugin import WebsocketConnection
+from micropyde.board.simulator import Simulator
+from micropyde.board.webrepl import (
+    FileTransfer, WEBREPL_RESPONSE, WEBREPL_CHUNK_SIZE
+)
+
+
+class Terminal(Protocol):
+    """ Collects the text sent by the board """
+
+    def connectionMade(self):
+        self.received = b''
+        self.lost = Deferred()
+
+    def dataReceived(self, data):
+        self.received += data
+
+    def connectionLost(self, reason):
+        self.lost.callback(reason)
+
+
+class FileTransferTest(TestCase):
+    """ Replies may be split or combined across frames """
+
+    def test_put_split_replies(self):
+        sent = []
+        transfer = FileTransfer(sent.append)
+        d = transfer.put('main.py', b'x' * (WEBREPL_CHUNK_SIZE + 1))
+        ok = WEBREPL_RESPONSE.pack(b"WB", 0)
+        for c in ok + ok:
+            transfer.feed(bytes([c]))
+        self.assertEqual(self.successResultOf(d), True)
+        #: Header, filename and two data frames
+        self.assertEqual(len(sent), 4)
+
+    def test_get_combined_replies(self):
+        sent = []
+        transfer = FileTransfer(sent.append)
+        d = transfer.get('main.py')
+        ok = WEBREPL_RESPONSE.pack(b"WB", 0)
+        transfer.feed(ok + struct.pack("<H", 2) + b"hi")
+        transfer.feed(struct.pack("<H", 0) + ok)
+        self.assertEqual(self.successResultOf(d), b"hi")
+
+    def test_error_status(self):
+        transfer = FileTransfer(lambda data: None)
+        d = transfer.get('missing.py')
+        transfer.feed(WEBREPL_RESPONSE.pack(b"WB", 1))
+        self.failureResultOf(d, IOError)
+
+
+class WebreplTransferTest(TestCase):
+    """ Transfers files with the simulator's WebREPL endpoint """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.sim = Simulator(self.root, backend='cpython')
+        port = self.sim.listen_webrepl(0)
+        self.sim.start()
+        self.terminal = Terminal()
+        self.connection = WebsocketConnection(address='127.0.0.1', port=port)
+        return self.connection.connect(self.terminal)
+
+    @inlineCallbacks
+    def tearDown(self):
+        self.connection.disconnect()
+        yield self.terminal.lost
+        yield self.sim.stop()
+
+    @inlineCallbacks
+    def test_put_get(self):
+        data = os.urandom(3 * WEBREPL_CHUNK_SIZE + 10)
+        progress = []
+        ok = yield self.connection.put_file('test.bin', data, progress.append)
+        self.assertTrue(ok)
+        self.assertEqual(progress[-1], 100)
+        with open(os.path.join(self.root, 'test.bin'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        result = yield self.connection.get_file('test.bin', len(data))
+        self.assertEqual(result, data)
+
+    @inlineCallbacks
+    def test_missing_file(self):
+        d = self.connection.get_file('missing.py')
+        yield self.assertFailure(d, IOError)
+        #: A failed request doesn't block the next one
+        self.assertIsNone(self.connection.transfer)
+        ok = yield self.connection.put_file('main.py', b'print(1)')
+        self.assertTrue(ok)